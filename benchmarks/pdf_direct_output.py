@@ -0,0 +1,86 @@
+"""
+Benchmark direct target-format page encoding in PdfCompressor.
+
+Rasterizes a generated multi-page PDF to PDF and JPG output, once through
+the older path that compresses every page to PNG and then re-encodes it,
+and once encoding each page directly to the requested format. Each variant
+runs in a fresh process.
+
+Build the core extensions first (python setup.py build_ext --inplace).
+Usage: python benchmarks/pdf_direct_output.py [--pages 40] [--dpi 150] [--runs 1]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_pdf(path, pages):
+    import fitz
+    import numpy as np
+    from PIL import Image
+    from io import BytesIO
+
+    rng = np.random.default_rng(0)
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Page {page_num + 1}", fontsize=24)
+        page.insert_textbox(fitz.Rect(72, 110, 540, 420), "Lorem ipsum dolor sit amet. " * 60, fontsize=10)
+        if page_num % 2 == 0:
+            # Every other page carries a photo-like image
+            base = rng.integers(0, 255, (24, 32, 3), dtype=np.uint8)
+            photo = BytesIO()
+            Image.fromarray(base).resize((800, 600), Image.BICUBIC).save(photo, format='JPEG', quality=90)
+            page.insert_image(fitz.Rect(72, 440, 540, 790), stream=photo.getvalue())
+    doc.save(path)
+    doc.close()
+
+
+def run_variant(path, output_format, direct, dpi, runs, results):
+    from core.PdfCompressor.PdfCompressor import PdfCompressor
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = PdfCompressor().process_pdf(path, output_format=output_format, dpi=dpi, workers=1,
+                                             direct=direct)
+        timings.append(time.perf_counter() - start)
+    results[output_format, direct] = (min(timings), len(output))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=40)
+    parser.add_argument('--dpi', type=int, default=150)
+    parser.add_argument('--runs', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'document.pdf')
+        make_pdf(path, args.pages)
+        print(f"Source: {args.pages} pages, {os.path.getsize(path) / 1e6:.1f} MB, rendered at {args.dpi} DPI")
+
+        manager = multiprocessing.Manager()
+        results = manager.dict()
+        for output_format in ('pdf', 'jpg'):
+            for direct in (False, True):
+                proc = multiprocessing.Process(target=run_variant,
+                                               args=(path, output_format, direct, args.dpi, args.runs, results))
+                proc.start()
+                proc.join()
+
+        for output_format in ('pdf', 'jpg'):
+            png_time, png_size = results[output_format, False]
+            direct_time, direct_size = results[output_format, True]
+            print(f"{output_format + ' via png':<16}{png_time:>10.2f} s{png_size / 1e6:>10.2f} MB")
+            print(f"{output_format + ' direct':<16}{direct_time:>10.2f} s{direct_size / 1e6:>10.2f} MB")
+            print(f"Speedup: {png_time / direct_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Compare palette quantizers on speed and quality.
+
+Runs Pillow's median cut and fast octree against the sampled k-means
+quantizer (with each dither mode) and reports time and PSNR against the
+source image.
+
+Build the core extensions first (python setup.py build_ext --inplace).
+Usage: python benchmarks/quantizer.py [IMAGE] [--colors 128] [--runs 3]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.Quantizer.Quantizer import quantize
+
+
+def synthetic_image(width=4000, height=3000):
+    from PIL import ImageFilter
+
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 255, (height // 12, width // 12, 3), dtype=np.uint8)
+    return Image.fromarray(base).resize((width, height), Image.BICUBIC).filter(ImageFilter.GaussianBlur(2))
+
+
+def psnr(reference, img):
+    diff = np.asarray(img.convert('RGB'), dtype=np.float32) - reference
+    mse = float(np.mean(diff * diff))
+    return float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('image', nargs='?')
+    parser.add_argument('--colors', type=int, default=128)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    img = Image.open(args.image).convert('RGB') if args.image else synthetic_image()
+    reference = np.asarray(img, dtype=np.float32)
+    print(f"Image: {img.size[0]}x{img.size[1]}, {args.colors} colors")
+
+    variants = [
+        ('pillow median cut', lambda: img.quantize(args.colors, method=Image.MEDIANCUT)),
+        ('pillow fast octree', lambda: img.quantize(args.colors, method=Image.FASTOCTREE)),
+        ('kmeans', lambda: quantize(img, args.colors)),
+        ('kmeans ordered', lambda: quantize(img, args.colors, dither='ordered')),
+        ('kmeans floyd-steinberg', lambda: quantize(img, args.colors, dither='floyd-steinberg')),
+    ]
+    print(f"{'quantizer':<24}{'time':>10}{'PSNR':>10}")
+    for name, run in variants:
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            out = run()
+            timings.append(time.perf_counter() - start)
+        print(f"{name:<24}{min(timings) * 1000:>8.0f}ms{psnr(reference, out):>8.2f}dB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark JPEG shrink-on-load in the Pillow backend.
+
+Decodes a large camera-sized JPEG and resizes it to 800x600, once with a
+full-resolution decode and once with DCT-domain scaling. Each variant runs
+in a fresh process so peak RSS is measured per variant.
+
+Build the core extensions first (python setup.py build_ext --inplace).
+Usage: python benchmarks/shrink_on_load.py [--megapixels 48] [--runs 3]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_jpeg(path, megapixels):
+    import numpy as np
+    from PIL import Image, ImageFilter
+
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 255, (height // 16, width // 16, 3), dtype=np.uint8)
+    img = Image.fromarray(base).resize((width, height), Image.BICUBIC).filter(ImageFilter.GaussianBlur(3))
+    img.save(path, quality=92)
+    return img.size
+
+
+def run_variant(path, shrink_on_load, runs, results):
+    import resource
+    from core.ImageCompressor.ImageCompressor import PillowBackend
+
+    backend = PillowBackend(shrink_on_load=shrink_on_load)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        backend.process(path, output_format='jpg', quality=85, resize=(800, 600), colors=None)
+        timings.append(time.perf_counter() - start)
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak *= 1024
+    results[shrink_on_load] = (min(timings), peak)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--megapixels', type=float, default=48)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'camera.jpg')
+        size = make_jpeg(path, args.megapixels)
+        print(f"Source: {size[0]}x{size[1]} JPEG, {os.path.getsize(path) / 1e6:.1f} MB -> 800x600")
+
+        manager = multiprocessing.Manager()
+        results = manager.dict()
+        for shrink_on_load in (False, True):
+            proc = multiprocessing.Process(target=run_variant, args=(path, shrink_on_load, args.runs, results))
+            proc.start()
+            proc.join()
+
+        full_time, full_peak = results[False]
+        draft_time, draft_peak = results[True]
+        print(f"{'full decode':<16}{full_time * 1000:>10.1f} ms{full_peak / 2**20:>10.0f} MiB peak RSS")
+        print(f"{'shrink-on-load':<16}{draft_time * 1000:>10.1f} ms{draft_peak / 2**20:>10.0f} MiB peak RSS")
+        print(f"Speedup: {full_time / draft_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -7,13 +7,16 @@ from theme.theme import get_current_theme, theme_manager, get_app_primary_color,
 
 class FileDropArea(QFrame):
     files_dropped = Signal(str)
+    files_selected = Signal(list)  # All selected paths when multiple is True
     
-    def __init__(self, title, description, file_type, parent=None):
+    def __init__(self, title, description, file_type, parent=None, multiple=False):
         super().__init__(parent)
         self.file_type = file_type.lower()
+        self.multiple = multiple
         self.original_title = title
         self.original_description = description
         self.selected_file = None
+        self.selected_files = []
         self.setAcceptDrops(True)
         self.setFrameShape(QFrame.StyledPanel)
 
@@ -173,7 +176,10 @@ class FileDropArea(QFrame):
         self.main_layout.addWidget(success_label, 0, Qt.AlignCenter)
 
         # File name
-        file_name = os.path.basename(self.selected_file) if self.selected_file else "Unknown file"
+        if len(self.selected_files) > 1:
+            file_name = f"{len(self.selected_files)} files"
+        else:
+            file_name = os.path.basename(self.selected_file) if self.selected_file else "Unknown file"
         file_name_label = QLabel(file_name)
         file_name_label.setStyleSheet(f"""
             QLabel {{
@@ -189,7 +195,7 @@ class FileDropArea(QFrame):
         self.main_layout.addWidget(file_name_label)
 
         # Status
-        status_label = QLabel("File Selected")
+        status_label = QLabel("Files Selected" if len(self.selected_files) > 1 else "File Selected")
         status_label.setStyleSheet(f"""
             QLabel {{
                 font-size: 14px;
@@ -210,7 +216,7 @@ class FileDropArea(QFrame):
         button_layout.setSpacing(10)
 
         # Change button
-        change_btn = QPushButton("Change File")
+        change_btn = QPushButton("Change Files" if self.multiple else "Change File")
         change_btn.setCursor(Qt.PointingHandCursor)
         change_btn.setStyleSheet(f"""
             QPushButton {{
@@ -274,7 +280,9 @@ class FileDropArea(QFrame):
     def dropEvent(self, event):
         """Handle dropped files"""
         urls = event.mimeData().urls()
-        if urls:
+        if urls and self.multiple:
+            self.handle_files_selection([url.toLocalFile() for url in urls])
+        elif urls:
             file_path = urls[0].toLocalFile()
             self.handle_file_selection(file_path)
 
@@ -287,32 +295,62 @@ class FileDropArea(QFrame):
         else:
             file_filter = "All Files (*)"
             
+        if self.multiple:
+            file_paths, _ = QFileDialog.getOpenFileNames(self, "Select Files", "", file_filter)
+            if file_paths:
+                self.handle_files_selection(file_paths)
+            return
+            
         file_path, _ = QFileDialog.getOpenFileName(self, "Select File", "", file_filter)
         if file_path:
             self.handle_file_selection(file_path)
 
-    def handle_file_selection(self, file_path):
-        """Handle file selection"""
+    def is_allowed(self, file_path):
+        """Check the file type, showing an error for files that are not allowed"""
         ext = os.path.splitext(file_path)[1].lower()
         
         if self.file_type == 'pdf' and ext != '.pdf':
             show_error_message("Only PDF files are allowed.", "Invalid File")
-            return
+            return False
         elif self.file_type == 'image' and ext not in ['.jpg', '.jpeg', '.png']:
             show_error_message("Only JPG and PNG image files are allowed.", "Invalid File")
+            return False
+        return True
+
+    def handle_file_selection(self, file_path):
+        """Handle file selection"""
+        if not self.is_allowed(file_path):
             return
         
         # Update state
         self.selected_file = file_path
+        self.selected_files = [file_path]
         self.show_selected_state()
         self.setStyleSheet(self.selected_style)
         
         # Emit signal
         self.files_dropped.emit(file_path)
+        self.files_selected.emit(self.selected_files)
+
+    def handle_files_selection(self, file_paths):
+        """Handle selecting several files at once, in the given order"""
+        if not all(self.is_allowed(file_path) for file_path in file_paths):
+            return
+        
+        # Update state
+        self.selected_file = file_paths[0]
+        self.selected_files = list(file_paths)
+        self.show_selected_state()
+        self.setStyleSheet(self.selected_style)
+        
+        # Emit signals
+        self.files_dropped.emit(self.selected_file)
+        self.files_selected.emit(self.selected_files)
 
     def remove_file(self):
         """Remove selected file"""
         self.selected_file = None
+        self.selected_files = []
         self.show_initial_state()
         self.setStyleSheet(self.default_style)
 
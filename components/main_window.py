@@ -45,7 +45,7 @@ class MainWindow(QMainWindow):
             ImageView(),
             PDFView(),
             PDFToImgView(),
-            # ImgToPDFView()
+            ImgToPDFView()
         ]
         
         for view in self.views:
@@ -59,7 +59,7 @@ class MainWindow(QMainWindow):
         self.sidebar.nav_buttons[1].clicked.connect(lambda: self.switch_view(1))
         self.sidebar.nav_buttons[2].clicked.connect(lambda: self.switch_view(2))
         self.sidebar.nav_buttons[3].clicked.connect(lambda: self.switch_view(3))
-        # self.sidebar.nav_buttons[4].clicked.connect(lambda: self.switch_view(4))
+        self.sidebar.nav_buttons[4].clicked.connect(lambda: self.switch_view(4))
         
         # Apply initial theme
         self.apply_theme()
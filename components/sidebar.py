@@ -59,7 +59,7 @@ class Sidebar(QFrame):
             NavButton("Image Compression", "image"),
             NavButton("PDF Compression", "pdf_compress"),
             NavButton("PDF to Image", "pdf_to_image"),
-            # NavButton("Image to PDF", "image_to_pdf")
+            NavButton("Image to PDF", "image_to_pdf")
         ]
         
         for btn in self.nav_buttons:
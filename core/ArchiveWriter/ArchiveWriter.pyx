@@ -0,0 +1,63 @@
+import os
+import zipfile
+
+# Payloads that are already entropy coded; deflating them again only costs time
+STORED_EXTENSIONS = ('jpg', 'jpeg', 'png', 'webp', 'gif', 'jpx', 'jp2', 'j2k', 'jb2', 'zip', 'pdf')
+
+ARCHIVE_KINDS = ('zip', 'directory')
+
+
+def compress_type_for(name):
+    """ZIP_STORED for already-compressed payloads, ZIP_DEFLATED for everything else."""
+    ext = os.path.splitext(name)[1][1:].lower()
+    return zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+class ZipStreamWriter:
+    """
+    Write a zip archive to a file object one entry at a time.
+
+    Each entry is written as soon as it is added and only the central
+    directory is kept in memory. ZIP64 extensions are used automatically
+    for entries or archives past the classic 4 GiB / 65535 entry limits.
+
+    Args:
+        sink: Binary file object opened for writing
+    """
+
+    def __init__(self, sink):
+        self.zip_file = zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        self.entries = 0
+        self.stored = 0
+
+    def add(self, name, data):
+        compress_type = compress_type_for(name)
+        self.zip_file.writestr(name, data, compress_type=compress_type)
+        self.entries += 1
+        self.stored += compress_type == zipfile.ZIP_STORED
+
+    def close(self):
+        """Write the central directory."""
+        self.zip_file.close()
+
+
+class DirectoryWriter:
+    """
+    Write entries as plain files into a directory, created if needed.
+
+    Args:
+        path: Output directory
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = 0
+        os.makedirs(path, exist_ok=True)
+
+    def add(self, name, data):
+        with open(os.path.join(self.path, name), 'wb') as f:
+            f.write(data)
+        self.entries += 1
+
+    def close(self):
+        pass
@@ -1,70 +1,788 @@
 from io import BytesIO
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+import math
+import shutil
 import subprocess
+import PIL
 from PIL import Image
 import tempfile
 import os
 
+from core.MagickPool.MagickPool import get_shared_pool
+from core.Quantizer.Quantizer import DITHER_MODES, PILLOW_METHOD, quantize
+from core.QualityMetrics.QualityMetrics import sample_tiles, tile_boxes, tiled_ssim
+from core.TiledPipeline.TiledPipeline import LARGE_IMAGE_PIXELS, PeakMemory, TiledPipeline, open_image
+
+# Bump when the same inputs and parameters would produce different output
+ENGINE_VERSION = 4
+
+JPEG_FORMATS = ('jpg', 'jpeg')
+
+# Formats whose size responds to the quality setting
+LOSSY_FORMATS = JPEG_FORMATS + ('webp',)
+
+# Palette quantizers: Pillow's median cut, or the sampled k-means + lookup table
+# (the default: faster and closer to the source than median cut)
+QUANTIZERS = ('pillow', 'kmeans')
+
+# ImageMagick settings for each dither mode; None keeps magick's default
+MAGICK_DITHER = {
+    'none': ['+dither'],
+    'ordered': ['+dither', '-ordered-dither', 'o8x8'],
+    'floyd-steinberg': ['-dither', 'FloydSteinberg'],
+}
+
+# Pixel budget of the downscaled proxy used to seed target-size searches
+PROXY_PIXELS = 256 * 256
+
+# Pillow save() format names for the extensions we accept
+PIL_FORMATS = {
+    'jpg': 'JPEG',
+    'jpeg': 'JPEG',
+    'png': 'PNG',
+    'webp': 'WEBP',
+    'tif': 'TIFF',
+    'tiff': 'TIFF',
+    'bmp': 'BMP',
+    'gif': 'GIF',
+}
+
+
+# Leading bytes that identify formats magick can decode from a pipe
+MAGIC_NUMBERS = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+    (b'BM', 'bmp'),
+)
+
+
+def _sniff_format(data):
+    """Return the format name for image bytes, or None if unrecognized."""
+    head = bytes(data[:12])
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    for magic, name in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def _encoded_source(source):
+    """
+    Magick reads encoded files only; hand it decoded PIL images as an
+    uncompressed PNG, which costs a copy but no compression work.
+    """
+    if not isinstance(source, Image.Image):
+        return source
+    buffer = BytesIO()
+    source.save(buffer, format='PNG', compress_level=0)
+    return buffer.getvalue()
+
+
+def _fit_size(size, box):
+    """
+    Scale size to fit inside box while keeping the aspect ratio.
+    Matches ImageMagick's plain WxH geometry, which also enlarges.
+    """
+    width, height = size
+    scale = min(box[0] / width, box[1] / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+class ImageBackend:
+    """
+    Base class for the engines ImageCompressor delegates to.
+    A backend takes a file path or bytes-like source and returns encoded bytes.
+    """
+    name = None
+
+    def is_available(self):
+        return False
+
+    def version(self):
+        """Identify the engine build; part of result cache keys."""
+        return self.name
+
+    def process(self, source, output_format='png', quality=85, resize=None,
+                strip_metadata=True, colors=256, optimize=True, quantizer=None, dither=None):
+        raise NotImplementedError
+
+
+class PillowBackend(ImageBackend):
+    """
+    In-process engine built on Pillow; no subprocess and no temp files.
+
+    Args:
+        shrink_on_load: Let the JPEG decoder scale down in the DCT domain
+            when resizing, so the full-resolution image is never decoded
+    """
+    name = 'pillow'
+
+    def __init__(self, shrink_on_load=True):
+        self.shrink_on_load = shrink_on_load
+
+    def is_available(self):
+        return True
+
+    def version(self):
+        return f'pillow-{PIL.__version__}'
+
+    def _open(self, source):
+        if isinstance(source, Image.Image):
+            return source
+        if isinstance(source, (str, os.PathLike)):
+            return Image.open(source)
+        return Image.open(BytesIO(source))
+
+    def process(self, source, output_format='png', quality=85, resize=None,
+                strip_metadata=True, colors=256, optimize=True, quantizer=None, dither=None):
+        output_format = output_format.lower()
+        pil_format = PIL_FORMATS.get(output_format)
+        if pil_format is None:
+            raise ValueError(f"Unsupported output format: {output_format}")
+
+        img = self._open(source)
+        exif = img.info.get('exif')
+        icc_profile = img.info.get('icc_profile')
+
+        size = _fit_size(img.size, resize) if resize else img.size
+        if self.shrink_on_load and img.format == 'JPEG' and size[0] < img.size[0]:
+            # Decodes at the smallest 1/2, 1/4 or 1/8 scale still >= size;
+            # the Lanczos pass below does the final high-quality resample
+            img.draft(img.mode, size)
+
+        if img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            img = img.convert('RGBA' if 'transparency' in img.info or img.mode.endswith('A') else 'RGB')
+
+        if size != img.size:
+            img = img.resize(size, Image.LANCZOS)
+
+        jpeg = output_format in JPEG_FORMATS
+        if jpeg and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        # Palette reduction only fits in 8 bits; larger counts are a no-op. JPEG
+        # stores full color anyway, so reducing first only costs time and adds banding
+        if colors and colors <= 256 and not jpeg:
+            if quantizer != 'pillow' and img.mode in ('RGB', 'L'):
+                img = quantize(img, colors, dither=dither)
+            else:
+                method = Image.FASTOCTREE if img.mode in ('RGBA', 'LA') else PILLOW_METHOD
+                if img.mode == 'LA':
+                    img = img.convert('RGBA')
+                img = img.quantize(colors=colors, method=method)
+
+        save_kwargs = {}
+        if jpeg:
+            save_kwargs.update(quality=quality, optimize=optimize, progressive=optimize)
+        elif pil_format == 'PNG':
+            # ImageMagick reads the tens digit of -quality as the zlib level
+            save_kwargs.update(compress_level=min(9, quality // 10), optimize=optimize)
+        elif pil_format == 'WEBP':
+            save_kwargs.update(quality=quality, method=6 if optimize else 4)
+
+        if not strip_metadata:
+            if exif:
+                save_kwargs['exif'] = exif
+            if icc_profile:
+                save_kwargs['icc_profile'] = icc_profile
+
+        buffer = BytesIO()
+        img.save(buffer, format=pil_format, **save_kwargs)
+        return buffer.getvalue()
+
+
+_magick_version = None
+
+
+class MagickBackend(ImageBackend):
+    """Engine that shells out to the ImageMagick `magick` binary."""
+    name = 'magick'
+
+    def is_available(self):
+        return shutil.which('magick') is not None
+
+    def version(self):
+        global _magick_version
+        if _magick_version is None:
+            result = subprocess.run(['magick', '-version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            _magick_version = result.stdout.decode(errors='replace').splitlines()[0] if result.stdout else 'unknown'
+        return f'{self.name}-{_magick_version}'
+
+    def _get_temp_file(self, extension, temp_files):
+        temp_file = tempfile.NamedTemporaryFile(suffix=extension, delete=False)
+        temp_file.close()
+        temp_files.append(temp_file.name)
+        return temp_file.name
+
+    def _build_read_defines(self, resize):
+        """
+        Coder hints applied while reading. jpeg:size lets libjpeg shrink on
+        load; twice the target keeps enough detail for the final -resize.
+        """
+        if not resize:
+            return {}
+        return {'jpeg:size': f'{resize[0] * 2}x{resize[1] * 2}'}
+
+    def _define_args(self, defines):
+        args = []
+        for key, value in defines.items():
+            args.extend(['-define', f'{key}={value}'])
+        return args
+
+    def _build_operations(self, output_format, quality, resize, strip_metadata, colors, optimize,
+                          dither=None):
+        operations = []
+        if resize:
+            operations.extend(['-resize', f'{resize[0]}x{resize[1]}'])
+        if strip_metadata:
+            operations.append('-strip')
+        if colors and output_format.lower() not in JPEG_FORMATS:
+            if dither in MAGICK_DITHER:
+                operations.extend(MAGICK_DITHER[dither])
+            operations.extend(['-colors', str(colors)])
+        if optimize:
+            if output_format.lower() in JPEG_FORMATS:
+                operations.extend(['-interlace', 'JPEG'])
+        operations.extend(['-quality', str(quality)])
+        return operations
+
+    def process(self, source, output_format='png', quality=85, resize=None,
+                strip_metadata=True, colors=256, optimize=True, quantizer=None, dither=None):
+        source = _encoded_source(source)
+        operations = self._build_operations(output_format, quality, resize, strip_metadata, colors, optimize,
+                                            dither)
+        read_args = self._define_args(self._build_read_defines(resize))
+        try:
+            return self._process_piped(source, output_format, operations, read_args)
+        except subprocess.CalledProcessError:
+            # Some coders need a seekable file; retry through temp files
+            return self._process_with_files(source, output_format, operations, read_args)
+
+    def _process_piped(self, source, output_format, operations, read_args):
+        """Stream the input over stdin and read the encoded result from stdout."""
+        if isinstance(source, (str, os.PathLike)):
+            input_spec, input_data = os.fspath(source), None
+        else:
+            input_format = _sniff_format(source)
+            input_spec = f'{input_format}:-' if input_format else '-'
+            input_data = source
+        command = ['magick'] + read_args + [input_spec] + operations + [f'{output_format}:-']
+        result = subprocess.run(command, input=input_data, check=True,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return result.stdout
+
+    def _process_with_files(self, source, output_format, operations, read_args):
+        temp_files = []
+        try:
+            if isinstance(source, (str, os.PathLike)):
+                input_path = os.fspath(source)
+            else:
+                input_path = self._get_temp_file(f'.{_sniff_format(source) or "png"}', temp_files)
+                with open(input_path, 'wb') as f:
+                    f.write(source)
+            output_path = self._get_temp_file(f'.{output_format}', temp_files)
+            command = ['magick'] + read_args + [input_path] + operations + [output_path]
+
+            try:
+                subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                with open(output_path, 'rb') as f:
+                    return f.read()
+            except subprocess.CalledProcessError as e:
+                raise RuntimeError(f"ImageMagick processing failed: {e.stderr.decode()}") from e
+        finally:
+            for temp_file in temp_files:
+                try:
+                    os.remove(temp_file)
+                except Exception as e:
+                    print(f"Failed to delete temporary file {temp_file}: {e}")
+
+
+class MagickPoolBackend(MagickBackend):
+    """
+    ImageMagick engine that reuses persistent workers instead of spawning
+    one process per image. Uses the given pool, or else the shared pool
+    configured with pool_options (MagickPool arguments).
+
+    A copy pickled into a worker process, which runs one job at a time,
+    uses a single-worker shared pool there with the same limits, so a
+    process pool of N workers runs N magick processes, not N pools.
+    """
+    name = 'magick-pool'
+
+    def __init__(self, pool=None, pool_options=None):
+        self.pool = pool
+        self.pool_options = dict(pool_options or {})
+
+    def __getstate__(self):
+        # Live pools hold processes and pipes; send their configuration instead
+        options = self.pool.options if self.pool is not None else self.pool_options
+        return {'pool_options': dict(options, size=1)}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def process(self, source, output_format='png', quality=85, resize=None,
+                strip_metadata=True, colors=256, optimize=True, quantizer=None, dither=None):
+        operations = self._build_operations(output_format, quality, resize, strip_metadata, colors, optimize,
+                                            dither)
+        pool = self.pool or get_shared_pool(**self.pool_options)
+        return pool.run(_encoded_source(source), output_format, operations, read_defines=self._build_read_defines(resize))
+
+
+BACKENDS = {
+    PillowBackend.name: PillowBackend,
+    MagickBackend.name: MagickBackend,
+    MagickPoolBackend.name: MagickPoolBackend,
+}
+
+# Fastest first: in-process Pillow avoids a process spawn per image
+BACKEND_PREFERENCE = ('pillow', 'magick-pool', 'magick')
+
+
+def available_backends():
+    """Return the names of the backends usable in this environment."""
+    return [name for name in BACKEND_PREFERENCE if BACKENDS[name]().is_available()]
+
+
+def get_backend(backend=None):
+    """
+    Resolve a backend name or instance.
+    None picks the fastest backend that is available.
+    """
+    if isinstance(backend, ImageBackend):
+        return backend
+    if backend is None:
+        for name in BACKEND_PREFERENCE:
+            candidate = BACKENDS[name]()
+            if candidate.is_available():
+                return candidate
+        raise RuntimeError("No image processing backend is available")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown image backend: {backend}")
+    candidate = BACKENDS[backend]()
+    if not candidate.is_available():
+        raise RuntimeError(f"Image backend '{backend}' is not available")
+    return candidate
+
+
+# One entry per item handed to ImageCompressor.process_many
+BatchResult = namedtuple('BatchResult', ['index', 'source', 'data', 'error'])
+
+
+def _process_batch_item(index, source, backend, cache, params):
+    """
+    Process-pool entry point; errors are returned rather than raised.
+    The cache arrives as a fresh copy, so its hit and miss counts are
+    returned for the parent to add to its own.
+    """
+    try:
+        if isinstance(source, (str, os.PathLike)):
+            compressor = ImageCompressor(image_path=source, backend=backend, cache=cache)
+        else:
+            compressor = ImageCompressor(image_data=source, backend=backend, cache=cache)
+        data, error = compressor.process_image(**params), None
+    except Exception as e:
+        data, error = None, f"{type(e).__name__}: {e}"
+    counts = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    return index, data, error, counts
+
+
 class ImageCompressor:
-    def __init__(self, image_path=None, image_data=None):
+    """
+    Compress a single image with the selected backend.
+
+    Images above LARGE_IMAGE_PIXELS, or whose decoded size exceeds
+    memory_limit when one is given, are streamed through the tiled pipeline
+    so the working set stays bounded. Every encode records the process's
+    peak resident memory while the job ran (bytes, None where unknown) in
+    stats['peak_memory']; see PeakMemory.
+
+    image_data may also be a decoded PIL image (for example a view of a
+    rendered PDF page), which skips decoding; such sources are not cached.
+    """
+
+    def __init__(self, image_path=None, image_data=None, backend=None, cache=None, memory_limit=None):
         if image_path is None and image_data is None:
             raise ValueError("Either image_path or image_data must be provided")
-            
+
         self.image_path = image_path
         self.image_data = image_data
-        self.temp_files = []
-        
-    def __del__(self):
-        for temp_file in self.temp_files:
-            try:
-                os.remove(temp_file)
-            except Exception as e:
-                print(f"Failed to delete temporary file {temp_file}: {e}")
-    
-    def _get_temp_file(self, extension):
-        temp_file = tempfile.NamedTemporaryFile(suffix=extension, delete=False)
-        temp_file.close()
-        self.temp_files.append(temp_file.name)
-        return temp_file.name
-    
-    def _ensure_image_file(self):
+        self.backend = get_backend(backend)
+        self.cache = cache
+        self.memory_limit = memory_limit
+        self.stats = {}
+
+    def _get_source(self):
         if self.image_path:
             return self.image_path
         elif self.image_data:
-            temp_path = self._get_temp_file('.png')
-            with open(temp_path, 'wb') as f:
-                f.write(self.image_data)
-            return temp_path
-        return None
-    
-    def process_image(self, output_format='png', quality=85, resize=None, strip_metadata=True, colors=256, optimize=True):
-        input_path = self._ensure_image_file()
-        output_path = self._get_temp_file(f'.{output_format}')
-        command = ['magick', input_path]
-        
-        if resize:
-            command.extend(['-resize', f'{resize[0]}x{resize[1]}'])
-        if strip_metadata:
-            command.append('-strip')
-        if colors:
-            command.extend(['-colors', str(colors)])
-        if optimize:
-            if output_format.lower() in ['jpg', 'jpeg']:
-                command.extend(['-interlace', 'JPEG']) 
-        
-        command.extend(['-quality', str(quality), output_path])
-        
+            return self.image_data
+        raise ValueError("No image data to process")
+
+    def process_image(self, output_format='png', quality=85, resize=None, strip_metadata=True, colors=256, optimize=True,
+                      target_bytes=None, allow_scale=False, min_quality=10, quantizer=None, dither=None,
+                      target_ssim=None):
+        """
+        Compress the image and return the encoded bytes.
+
+        With target_bytes set, quality is treated as an upper bound and the
+        highest quality (and, with allow_scale, the largest size) that fits
+        the budget is searched for. With target_ssim set (e.g. 0.98), the
+        lowest quality up to `quality` whose output still reaches that
+        structural similarity to the source is used instead. Search cost is
+        recorded in self.stats.
+        When a cache is set, identical input and settings skip all work.
+
+        quantizer picks the palette builder used for `colors`: 'kmeans'
+        (sampled k-means with a lookup table, the default) or 'pillow'
+        (median cut); Pillow backend only. JPEG output is never palette reduced,
+        so colors, quantizer and dither do not apply to it. dither is 'none', 'ordered' or
+        'floyd-steinberg' and applies to the k-means quantizer and to magick;
+        None keeps the default.
+        """
+        if quantizer not in (None,) + QUANTIZERS:
+            raise ValueError(f"Unknown quantizer: {quantizer}")
+        if dither not in DITHER_MODES:
+            raise ValueError(f"Unknown dither mode: {dither}")
+        if target_bytes is not None and target_bytes <= 0:
+            raise ValueError(f"target_bytes must be positive, got {target_bytes}")
+        if target_bytes and target_ssim:
+            raise ValueError("target_bytes and target_ssim cannot be combined")
+        params = dict(
+            output_format=output_format,
+            strip_metadata=strip_metadata,
+            colors=colors,
+            optimize=optimize,
+            quantizer=quantizer,
+            dither=dither
+        )
+
+        cache_key = None
+        if self.cache is not None and not isinstance(self._get_source(), Image.Image):
+            cache_key = self.cache.make_key(
+                self._get_source(),
+                dict(params, output_format=output_format.lower(), quality=quality, resize=resize,
+                     target_bytes=target_bytes, allow_scale=allow_scale, min_quality=min_quality,
+                     target_ssim=target_ssim, memory_limit=self.memory_limit),
+                self.engine_version()
+            )
+            data = self.cache.get(cache_key)
+            if data is not None:
+                self.stats = {'encodes': 0, 'cache_hit': True, 'size': len(data)}
+                return data
+
+        if target_bytes:
+            data = self._process_to_target(target_bytes, quality, min_quality, resize, allow_scale, params)
+        elif target_ssim:
+            data = self._process_to_ssim(target_ssim, quality, min_quality, resize, params)
+        elif self._needs_tiling():
+            buffer = BytesIO()
+            self._process_tiled(buffer, quality, resize, params)
+            data = buffer.getvalue()
+            self.stats['size'] = len(data)
+        else:
+            with PeakMemory() as memory:
+                data = self.backend.process(self._get_source(), quality=quality, resize=resize, **params)
+            self.stats = {'encodes': 1, 'quality': quality, 'size': len(data), 'peak_memory': memory.peak}
+
+        if cache_key is not None:
+            self.cache.put(cache_key, data)
+            self.stats['cache_hit'] = False
+        return data
+
+    def engine_version(self):
+        return f'image-{ENGINE_VERSION}/{self.backend.version()}'
+
+    def _needs_tiling(self):
+        """Whether decoding the whole image would exceed the memory budget."""
+        if isinstance(self._get_source(), Image.Image):
+            # Already decoded; nothing left to stream
+            return False
         try:
-            result = subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            with open(output_path, 'rb') as f:
-                return f.read()
-        except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"ImageMagick processing failed: {e.stderr.decode()}") from e
-    
+            img = open_image(self._get_source())
+        except (OSError, SyntaxError):
+            return False
+        pixels = img.size[0] * img.size[1]
+        if self.memory_limit:
+            return pixels * len(img.getbands()) > self.memory_limit
+        return pixels > LARGE_IMAGE_PIXELS
+
+    def _process_tiled(self, sink, quality, resize, params):
+        magick = MagickBackend()
+        pipeline_args = {'encoder': PillowBackend(), 'magick': magick if magick.is_available() else None}
+        if self.memory_limit:
+            pipeline_args['memory_limit'] = self.memory_limit
+        pipeline = TiledPipeline(**pipeline_args)
+        self.stats = pipeline.process(self._get_source(), sink, quality=quality, resize=resize, **params)
+
+    def _process_to_ssim(self, target_ssim, quality, min_quality, resize, params):
+        """
+        Bisect quality for the smallest output whose SSIM against the
+        (resized) source is at least target_ssim. The metric is computed
+        on a fixed set of full-resolution grayscale tiles, so compression
+        artifacts stay visible while its cost does not grow with image size.
+        """
+        self.stats = {'target_ssim': target_ssim, 'encodes': 0}
+        min_quality = max(1, min(min_quality, quality))
+        with self._open_source_image() as img:
+            out_size = _fit_size(img.size, resize) if resize else img.size
+            if out_size != img.size:
+                img.draft(img.mode, out_size)
+                img = img.resize(out_size, Image.LANCZOS)
+            boxes = tile_boxes(out_size)
+            reference = sample_tiles(img, boxes)
+        source = self._get_source()
+
+        def measure(step):
+            data = self.backend.process(source, quality=step, resize=resize, **params)
+            self.stats['encodes'] += 1
+            with Image.open(BytesIO(data)) as out:
+                return step, data, tiled_ssim(reference, sample_tiles(out, boxes))
+
+        best = measure(quality)
+        if params['output_format'].lower() in LOSSY_FORMATS and best[2] >= target_ssim:
+            low, high = min_quality, quality - 1
+            while low <= high:
+                middle = (low + high) // 2
+                candidate = measure(middle)
+                if candidate[2] >= target_ssim:
+                    best = candidate
+                    high = middle - 1
+                else:
+                    low = middle + 1
+
+        quality_used, data, score = best
+        self.stats.update(
+            quality=quality_used,
+            ssim=score,
+            size=len(data),
+            target_met=score >= target_ssim
+        )
+        return data
+
+    def _open_source_image(self):
+        source = self._get_source()
+        if isinstance(source, Image.Image):
+            return source
+        if isinstance(source, (str, os.PathLike)):
+            return Image.open(source)
+        return Image.open(BytesIO(source))
+
+    def _estimate_quality_curve(self, out_size, quality, min_quality, params):
+        """
+        Encode a small proxy across the quality range and scale its sizes up
+        to the output pixel count. Returns [(quality, log_size), ...].
+        """
+        proxy_scale = min(1.0, math.sqrt(PROXY_PIXELS / (out_size[0] * out_size[1])))
+        proxy_size = (max(1, round(out_size[0] * proxy_scale)), max(1, round(out_size[1] * proxy_scale)))
+        with self._open_source_image() as img:
+            if not isinstance(self._get_source(), Image.Image):
+                # Only an image opened here may be decoded at reduced size
+                img.draft('RGB', proxy_size)
+            proxy = img.resize(proxy_size, Image.BILINEAR)
+        if proxy.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            # PNG cannot hold CMYK and the like; the backends convert these for output anyway
+            proxy = proxy.convert('RGBA' if 'transparency' in proxy.info else 'RGB')
+        buffer = BytesIO()
+        proxy.save(buffer, format='PNG', compress_level=1)
+        proxy_data = buffer.getvalue()
+
+        pixel_ratio = (out_size[0] * out_size[1]) / (proxy_size[0] * proxy_size[1])
+        steps = sorted({min_quality, quality} | {q for q in range(20, quality, 15) if q > min_quality})
+        curve = []
+        for step in steps:
+            size = len(self.backend.process(proxy_data, quality=step, **params)) * pixel_ratio
+            curve.append((step, math.log(size)))
+            self.stats['proxy_encodes'] += 1
+        return curve
+
+    def _predict_log_size(self, curve, quality):
+        """Piecewise-linear interpolation of the proxy curve."""
+        for (q0, s0), (q1, s1) in zip(curve, curve[1:]):
+            if quality <= q1:
+                return s0 + (s1 - s0) * (quality - q0) / max(1, q1 - q0)
+        return curve[-1][1]
+
+    def _invert_curve(self, curve, log_size):
+        """Quality at which the (monotone) proxy curve reaches log_size."""
+        for (q0, s0), (q1, s1) in zip(curve, curve[1:]):
+            if log_size <= s1:
+                if s1 <= s0:
+                    return q0
+                return q0 + (q1 - q0) * (log_size - s0) / (s1 - s0)
+        return curve[-1][0]
+
+    def _search_quality(self, target_bytes, box, quality, min_quality, curve, params):
+        """
+        Search integer qualities for the highest one that fits the budget.
+        Until the answer is bracketed, guesses come from the proxy curve
+        recalibrated by the latest full encode; two encodes in a row on the
+        same side bisect what is left instead. Once bracketed, guesses are
+        false position on log(size) between the bracket ends, and an end
+        kept twice in a row pulls half as hard (the Illinois rule). Whenever
+        two encodes have not halved the bracket, the next one bisects it.
+        Returns (best_fit, smallest) where each is (quality, data) or None.
+        """
+        source = self._get_source()
+        fits = None   # highest quality known to fit
+        over = None   # lowest quality known to exceed the budget
+        fits_weight = over_weight = 1.0
+        smallest = None
+        last_side = None
+        stalled = 0
+        widths = [quality - min_quality + 1]
+        log_target = math.log(target_bytes)
+        guess = min(quality, max(min_quality, math.floor(self._invert_curve(curve, log_target))))
+
+        while True:
+            data = self.backend.process(source, quality=guess, resize=box, **params)
+            self.stats['encodes'] += 1
+            if smallest is None or len(data) < len(smallest[1]):
+                smallest = (guess, data)
+            side = len(data) <= target_bytes
+            if side:
+                fits, fits_weight = (guess, data), 1.0
+            else:
+                over, over_weight = (guess, data), 1.0
+            stalled = stalled + 1 if side == last_side else 0
+            last_side = side
+
+            low = fits[0] + 1 if fits else min_quality
+            high = over[0] - 1 if over else quality
+            if low > high:
+                break
+            widths.append(high - low + 1)
+
+            if len(widths) > 2 and widths[-1] > widths[-3] / 2:
+                estimate = (low + high) / 2
+            elif fits and over:
+                if stalled:
+                    if side:
+                        over_weight /= 2
+                    else:
+                        fits_weight /= 2
+                below = (log_target - math.log(len(fits[1]))) * fits_weight
+                above = (math.log(len(over[1])) - log_target) * over_weight
+                estimate = fits[0] + (over[0] - fits[0]) * below / (below + above)
+            elif stalled:
+                estimate = (low + high) / 2
+            else:
+                bias = math.log(len(data)) - self._predict_log_size(curve, guess)
+                estimate = self._invert_curve(curve, log_target - bias)
+            guess = min(high, max(low, math.floor(estimate)))
+
+        return fits, smallest
+
+    def _process_to_target(self, target_bytes, quality, min_quality, resize, allow_scale, params):
+        """Find the highest-quality encode whose size is at most target_bytes."""
+        self.stats = {'target_bytes': target_bytes, 'encodes': 0, 'proxy_encodes': 0}
+        min_quality = max(1, min(min_quality, quality))
+        with self._open_source_image() as img:
+            out_size = _fit_size(img.size, resize) if resize else img.size
+        lossy = params['output_format'].lower() in LOSSY_FORMATS
+
+        scale = 1.0
+        best = None
+        for _ in range(4):
+            box = resize
+            if scale < 1.0:
+                box = (max(1, round(out_size[0] * scale)), max(1, round(out_size[1] * scale)))
+            scaled = (box[0], box[1]) if box else out_size
+
+            if lossy and quality > min_quality:
+                curve = self._estimate_quality_curve(scaled, quality, min_quality, params)
+                fits, smallest = self._search_quality(target_bytes, box, quality, min_quality,
+                                                      curve, params)
+            else:
+                data = self.backend.process(self._get_source(), quality=quality, resize=box, **params)
+                self.stats['encodes'] += 1
+                smallest = (quality, data)
+                fits = smallest if len(data) <= target_bytes else None
+
+            if fits:
+                best = fits
+                break
+            if best is None or len(smallest[1]) < len(best[1]):
+                best = smallest
+            if not allow_scale:
+                break
+            # Size scales roughly with pixel count; aim a little under budget
+            scale *= min(0.9, 0.95 * math.sqrt(target_bytes / len(smallest[1])))
+
+        quality_used, data = best
+        self.stats.update(
+            quality=quality_used,
+            scale=scale,
+            size=len(data),
+            target_met=len(data) <= target_bytes
+        )
+        return data
+
     def get_pil_image(self, **kwargs):
         image_data = self.process_image(**kwargs)
         return Image.open(BytesIO(image_data))
-    
+
     def save_to_file(self, output_path, **kwargs):
+        if not kwargs.get('target_bytes') and not kwargs.get('target_ssim') and self._needs_tiling():
+            # Stream straight to disk; large outputs never sit in memory or the cache
+            params = {key: kwargs[key] for key in ('output_format', 'strip_metadata', 'colors', 'optimize',
+                                                    'quantizer', 'dither') if key in kwargs}
+            with open(output_path, 'wb') as f:
+                self._process_tiled(f, kwargs.get('quality', 85), kwargs.get('resize'), params)
+            self.stats['size'] = os.path.getsize(output_path)
+            return
         image_data = self.process_image(**kwargs)
         with open(output_path, 'wb') as f:
             f.write(image_data)
+
+    @staticmethod
+    def process_many(paths_or_buffers, max_workers=None, max_in_flight=None, backend=None, cache=None, **params):
+        """
+        Compress many images in parallel over a process pool.
+
+        Args:
+            paths_or_buffers: Iterable of file paths or bytes-like image data
+            max_workers: Worker processes (defaults to the CPU count)
+            max_in_flight: Items submitted but not yet yielded; bounds memory
+                (defaults to twice the worker count)
+            backend: Backend name used inside each worker
+            cache: Optional ResultCache shared by the workers; their hits and
+                misses are added to its counters as results arrive
+            **params: Keyword arguments for process_image
+
+        Yields:
+            BatchResult(index, source, data, error) in completion order.
+            Failed items carry an error message and data=None.
+        """
+        max_workers = max_workers or os.cpu_count() or 1
+        max_in_flight = max(1, max_in_flight or max_workers * 2)
+        items = enumerate(paths_or_buffers)
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+        pending = {}
+
+        def submit(batch):
+            for index, source in batch:
+                payload = source if isinstance(source, (str, os.PathLike, bytes)) else bytes(source)
+                future = executor.submit(_process_batch_item, index, payload, backend, cache, params)
+                pending[future] = source
+
+        try:
+            submit(islice(items, max_in_flight))
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    source = pending.pop(future)
+                    index, data, error, counts = future.result()
+                    if cache is not None:
+                        cache.add_counts(*counts)
+                    yield BatchResult(index, source, data, error)
+                submit(islice(items, max_in_flight - len(pending)))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,150 @@
+import zlib
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from core.ImageCompressor.ImageCompressor import PillowBackend
+from core.PdfWriter.PdfWriter import COLORSPACES, PdfStreamWriter
+from core.TiledPipeline.TiledPipeline import PeakMemory, iter_png_idat
+
+# Page sizes in points, portrait
+PAGE_SIZES = {
+    'letter': (612, 792),
+    'a4': (595.28, 841.89),
+    'a3': (841.89, 1190.55),
+    'legal': (612, 1008),
+}
+ORIENTATIONS = ('portrait', 'landscape')
+
+# Lossy sources are re-encoded as JPEG rather than inflated to lossless samples
+LOSSY_SOURCE_FORMATS = ('JPEG', 'WEBP')
+
+
+class ImageToPdfConverter:
+    """
+    Build a PDF with one image per page, written to the output page by page.
+
+    JPEGs are embedded as they are (/DCTDecode) and 8-bit gray or RGB
+    non-interlaced PNGs keep their compressed IDAT data (/FlateDecode with
+    PNG predictors), so neither is decoded. Other images are decoded once
+    and stored losslessly, or as JPEG when the source was lossy already.
+
+    Args:
+        quality: JPEG quality for images that have to be re-encoded as JPEG
+    """
+
+    def __init__(self, quality=90):
+        self.quality = quality
+        self.stats = {}
+
+    @staticmethod
+    def _page_size(page_size, orientation, image_points):
+        if page_size == 'auto':
+            return image_points
+        width, height = PAGE_SIZES[page_size]
+        if orientation == 'landscape':
+            return height, width
+        return width, height
+
+    @staticmethod
+    def _placement(page, image_points):
+        """Largest rectangle with the image's aspect ratio, centered on the page."""
+        scale = min(page[0] / image_points[0], page[1] / image_points[1])
+        width, height = image_points[0] * scale, image_points[1] * scale
+        return (page[0] - width) / 2, (page[1] - height) / 2, width, height
+
+    @staticmethod
+    def _image_points(size, dpi):
+        x_dpi, y_dpi = (float(value) or 72 for value in dpi or (72, 72))
+        return size[0] * 72 / x_dpi, size[1] * 72 / y_dpi
+
+    def _read(self, source):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return BytesIO(source)
+        return open(source, 'rb')
+
+    def _embedding(self, img, fp):
+        """
+        Return (data, size, mode, filter_name, decode_parms, smask) for one image,
+        passing the source's compressed data through whenever the PDF can use it.
+        """
+        if (img.format == 'JPEG' and img.mode in COLORSPACES
+                and img.getexif().get(0x0112, 1) == 1):
+            fp.seek(0)
+            self.stats['passthrough'] += 1
+            return fp.read(), img.size, img.mode, '/DCTDecode', None, None
+
+        # Read the tile before anything loads the image (PNG getexif() does)
+        rawmode = img.tile[0][3] if len(img.tile) == 1 else None
+        if isinstance(rawmode, tuple):
+            rawmode = rawmode[0]
+        if (img.format == 'PNG' and img.mode in ('L', 'RGB') and rawmode == img.mode
+                and not img.info.get('interlace') and 'transparency' not in img.info):
+            colors = len(img.mode)
+            decode_parms = (f'<< /Predictor 15 /Colors {colors} /BitsPerComponent 8 '
+                            f'/Columns {img.size[0]} >>')
+            self.stats['passthrough'] += 1
+            return b''.join(iter_png_idat(fp)), img.size, img.mode, '/FlateDecode', decode_parms, None
+
+        self.stats['reencoded'] += 1
+        lossy = img.format in LOSSY_SOURCE_FORMATS
+        img = ImageOps.exif_transpose(img)
+        if img.mode == 'P':
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        smask = None
+        if img.mode in ('RGBA', 'LA') or 'transparency' in img.info:
+            img = img.convert('RGBA' if img.mode != 'LA' else 'LA')
+            smask = (zlib.compress(img.getchannel('A').tobytes()), '/FlateDecode')
+            img = img.convert('RGB' if img.mode == 'RGBA' else 'L')
+        elif img.mode not in COLORSPACES:
+            img = img.convert('RGB')
+
+        if lossy:
+            data = PillowBackend().process(img, output_format='jpeg', quality=self.quality, colors=None)
+            return data, img.size, img.mode, '/DCTDecode', None, smask
+        return zlib.compress(img.tobytes()), img.size, img.mode, '/FlateDecode', None, smask
+
+    def _convert(self, sources, sink, page_size, orientation):
+        writer = PdfStreamWriter(sink)
+        with PeakMemory() as memory:
+            for source in sources:
+                with self._read(source) as fp, Image.open(fp) as img:
+                    dpi = img.info.get('dpi')
+                    data, size, mode, filter_name, decode_parms, smask = self._embedding(img, fp)
+                image_points = self._image_points(size, dpi)
+                page = self._page_size(page_size, orientation, image_points)
+                writer.add_image_page(data, size, mode, page, filter_name, smask, decode_parms,
+                                      self._placement(page, image_points))
+                del data, smask
+                self.stats['pages'] += 1
+            writer.close()
+        self.stats['peak_memory'] = memory.peak
+
+    def convert(self, sources, output_path=None, page_size='auto', orientation='portrait'):
+        """
+        Convert images to a PDF, one page per image in the given order.
+
+        Args:
+            sources: Iterable of image paths or image data as bytes; consumed lazily
+            output_path: Write the PDF to this file instead of returning bytes
+            page_size: 'auto' (each page sized to its image at the image's DPI),
+                'letter', 'a4', 'a3' or 'legal'; images are fitted and centered
+            orientation: 'portrait' or 'landscape' for fixed page sizes
+
+        Returns:
+            PDF data as bytes, or output_path when one is given
+        """
+        page_size = page_size.lower()
+        if page_size != 'auto' and page_size not in PAGE_SIZES:
+            raise ValueError(f"Unknown page size: {page_size}")
+        if orientation not in ORIENTATIONS:
+            raise ValueError(f"Unknown orientation: {orientation}")
+
+        self.stats = {'pages': 0, 'passthrough': 0, 'reencoded': 0}
+        if output_path is not None:
+            with open(output_path, 'wb') as sink:
+                self._convert(sources, sink, page_size, orientation)
+            return output_path
+        sink = BytesIO()
+        self._convert(sources, sink, page_size, orientation)
+        return sink.getvalue()
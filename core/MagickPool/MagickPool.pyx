@@ -0,0 +1,341 @@
+import atexit
+import math
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+
+# Script settings persist across the jobs of a worker; every job starts by
+# restoring the ones jobs may change to magick's defaults ('+dither' would
+# turn dithering off, so its default method is named instead)
+JOB_DEFAULTS = ['+interlace', '-dither', 'Riemersma', '+quality']
+
+
+def _scratch_root():
+    """Prefer a RAM-backed directory for job files when the platform has one."""
+    shm = '/dev/shm'
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        return shm
+    return None
+
+
+def _quote(token):
+    """Quote a token for ImageMagick's script reader."""
+    if '"' in token:
+        raise ValueError(f"Cannot pass {token!r} to a magick script")
+    return f'"{token}"'
+
+
+def _script_token(token):
+    """Quote an option argument only when the script reader would split it."""
+    return _quote(token) if any(c.isspace() for c in token) else token
+
+
+class MagickWorker:
+    """
+    A long-lived `magick -script -` process.
+    Commands are written to its stdin one job per line; completion is
+    signalled by a marker file written after the output image.
+    """
+
+    def __init__(self, workdir, limits=None, stderr_lines=50):
+        self.workdir = workdir
+        self.limits = dict(limits or {})
+        # magick counts the time limit from process start, so it is set per job
+        self.time_limit = self.limits.pop('time', None)
+        self.process = None
+        self.started = None
+        self.stderr_tail = deque(maxlen=stderr_lines)
+        self.jobs_done = 0
+
+    def start(self):
+        self.stderr_tail.clear()
+        self.started = time.monotonic()
+        self.process = subprocess.Popen(
+            ['magick', '-script', '-'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1
+        )
+        # Drain stderr so a chatty worker never blocks on a full pipe
+        threading.Thread(target=self._drain_stderr, args=(self.process,), daemon=True).start()
+
+        settings = []
+        for resource, value in self.limits.items():
+            settings.extend(['-limit', resource, str(value)])
+        if settings:
+            self._send(' '.join(settings))
+        self.jobs_done = 0
+
+    def _drain_stderr(self, process):
+        for line in process.stderr:
+            self.stderr_tail.append(line.rstrip())
+
+    def _send(self, line):
+        self.process.stdin.write(line + '\n')
+        self.process.stdin.flush()
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def run(self, input_path, output_spec, operations, done_path, timeout=None, read_defines=None):
+        """
+        Run one job and block until the worker reports it finished.
+        The job starts from JOB_DEFAULTS, and read_defines are set for the
+        read and removed afterwards, since script settings otherwise persist
+        into the next job. Raises RuntimeError if the worker dies or the job
+        times out.
+        """
+        read_defines = read_defines or {}
+        tokens = list(JOB_DEFAULTS)
+        if self.time_limit is not None:
+            # The worker's age so far plus the job's own allowance
+            age = math.ceil(time.monotonic() - self.started)
+            tokens.extend(['-limit', 'time', str(age + int(self.time_limit))])
+        for key, value in read_defines.items():
+            tokens.extend(['-define', _script_token(f'{key}={value}')])
+        tokens.extend(['-read', _quote(input_path)])
+        for key in read_defines:
+            tokens.extend(['+define', _script_token(key)])
+        line = ' '.join(
+            tokens
+            + [_script_token(op) for op in operations]
+            + ['-write', _quote(output_spec), '+delete',
+               'xc:', '-write', _quote(f'txt:{done_path}'), '+delete']
+        )
+        self._send(line)
+
+        deadline = time.monotonic() + timeout if timeout else None
+        delay = 0.0005
+        while not os.path.exists(done_path):
+            if not self.is_alive():
+                raise RuntimeError(f"ImageMagick worker exited: {self.last_error()}")
+            if deadline and time.monotonic() > deadline:
+                raise RuntimeError(f"ImageMagick worker timed out: {self.last_error()}")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.01)
+        self.jobs_done += 1
+
+    def last_error(self):
+        return '\n'.join(self.stderr_tail) or 'no error output'
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            if self.is_alive():
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+        except Exception:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+
+class MagickPool:
+    """
+    Pool of persistent ImageMagick workers shared across images and files.
+
+    Args:
+        size: Number of worker processes (defaults to the CPU count)
+        memory_limit: Per-worker pixel cache memory limit, e.g. '256MiB'
+        map_limit: Per-worker memory-map limit, e.g. '512MiB'
+        thread_limit: Threads each worker may use
+        time_limit: Seconds a single job may run before ImageMagick aborts it
+        job_timeout: Seconds to wait for a single job before restarting the worker
+        max_jobs_per_worker: Recycle a worker after this many jobs (None to never recycle)
+    """
+
+    def __init__(self, size=None, memory_limit=None, map_limit=None, thread_limit=None,
+                 time_limit=None, job_timeout=120, max_jobs_per_worker=None):
+        if shutil.which('magick') is None:
+            raise RuntimeError("ImageMagick 'magick' binary not found")
+
+        # The arguments, so a copy of this configuration can be built elsewhere
+        self.options = dict(size=size, memory_limit=memory_limit, map_limit=map_limit,
+                            thread_limit=thread_limit, time_limit=time_limit, job_timeout=job_timeout,
+                            max_jobs_per_worker=max_jobs_per_worker)
+        self.size = size or os.cpu_count() or 1
+        self.job_timeout = job_timeout
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.limits = {}
+        if memory_limit is not None:
+            self.limits['memory'] = memory_limit
+        if map_limit is not None:
+            self.limits['map'] = map_limit
+        if thread_limit is not None:
+            self.limits['thread'] = thread_limit
+        if time_limit is not None:
+            self.limits['time'] = time_limit
+
+        self.workdir = tempfile.mkdtemp(prefix='magick-pool-', dir=_scratch_root())
+        self.restarts = 0
+        self._closed = False
+        self._idle = queue.Queue()
+        for _ in range(self.size):
+            self._idle.put(MagickWorker(self.workdir, self.limits))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _ensure_running(self, worker):
+        recycle = (self.max_jobs_per_worker is not None
+                   and worker.jobs_done >= self.max_jobs_per_worker)
+        if worker.is_alive() and not recycle:
+            return
+        if worker.process is not None:
+            worker.close()
+            self.restarts += 1
+        worker.start()
+
+    def run(self, source, output_format, operations, read_defines=None):
+        """
+        Process one image and return the encoded output bytes.
+
+        Args:
+            source: Input file path or bytes-like image data
+            output_format: Output format extension ('png', 'jpg', ...)
+            operations: magick options applied between read and write
+            read_defines: Coder defines for the read only, e.g. {'jpeg:size': '1600x1200'}
+        """
+        if self._closed:
+            raise RuntimeError("MagickPool is closed")
+
+        job = uuid.uuid4().hex
+        job_files = []
+        if isinstance(source, (str, os.PathLike)) and '"' not in os.fspath(source):
+            input_path = os.fspath(source)
+        else:
+            if isinstance(source, (str, os.PathLike)):
+                with open(source, 'rb') as f:
+                    source = f.read()
+            input_path = os.path.join(self.workdir, f'{job}.in')
+            with open(input_path, 'wb') as f:
+                f.write(source)
+            job_files.append(input_path)
+
+        output_path = os.path.join(self.workdir, f'{job}.{output_format}')
+        done_path = os.path.join(self.workdir, f'{job}.done')
+        job_files.extend([output_path, done_path])
+
+        worker = self._idle.get()
+        try:
+            for attempt in range(2):
+                self._ensure_running(worker)
+                try:
+                    worker.run(input_path, f'{output_format}:{output_path}', operations,
+                               done_path, timeout=self.job_timeout, read_defines=read_defines)
+                    break
+                except RuntimeError:
+                    # A dead or hung worker is replaced; retry the job once
+                    worker.close()
+                    self.restarts += 1
+                    worker.start()
+                    if attempt:
+                        raise
+
+            if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+                raise RuntimeError(f"ImageMagick processing failed: {worker.last_error()}")
+            with open(output_path, 'rb') as f:
+                return f.read()
+        finally:
+            self._idle.put(worker)
+            for path in job_files:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _abandon(self):
+        """
+        Let go of the pool in a forked child without touching the parent's
+        workers or scratch directory. The child's copies of the worker pipes
+        are pointed at /dev/null, so the parent's workers still see end of
+        input when the parent closes them.
+        """
+        self._closed = True
+        devnull = os.open(os.devnull, os.O_RDWR)
+        try:
+            while True:
+                try:
+                    worker = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if worker.process is not None:
+                    for stream in (worker.process.stdin, worker.process.stderr):
+                        os.dup2(devnull, stream.fileno())
+                    worker.process = None
+        finally:
+            os.close(devnull)
+
+    def close(self):
+        """Stop all workers and remove the scratch directory."""
+        if self._closed:
+            return
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+_shared_pool = None
+_shared_options = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_pool(**options):
+    """
+    Return the process-wide pool, creating it on first use.
+    Passing different options replaces the pool with a newly configured one.
+    """
+    global _shared_pool, _shared_options
+    with _shared_lock:
+        if _shared_pool is not None and (not options or options == _shared_options):
+            return _shared_pool
+        if _shared_pool is not None:
+            _shared_pool.close()
+        _shared_pool = MagickPool(**options)
+        _shared_options = options
+        return _shared_pool
+
+
+def _forget_shared_pool():
+    """
+    Runs in every forked child. The inherited pool's workers belong to the
+    parent (closing it here, e.g. from atexit, would stop them), so the child
+    abandons it and creates its own on first use.
+    """
+    global _shared_pool, _shared_options, _shared_lock
+    # The lock may have been held by another thread at the fork
+    _shared_lock = threading.Lock()
+    if _shared_pool is not None:
+        _shared_pool._abandon()
+    _shared_pool = None
+    _shared_options = None
+
+
+def close_shared_pool():
+    global _shared_pool, _shared_options
+    with _shared_lock:
+        if _shared_pool is not None:
+            _shared_pool.close()
+        _shared_pool = None
+        _shared_options = None
+
+
+atexit.register(close_shared_pool)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_shared_pool)
@@ -0,0 +1,205 @@
+import zlib
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, features
+
+from core.ImageCompressor.ImageCompressor import PillowBackend
+
+# Neighbouring pixels closer than FLAT_STEP are a flat area, not an edge
+FLAT_STEP = 8
+MIDTONE_RANGE = (48, 208)
+
+# Segmentation works on square blocks; the paper level of a block is the
+# brightest pixel in it and its neighbours, and text is anything more than
+# TEXT_CONTRAST darker than that
+MASK_BLOCK = 32
+TEXT_CONTRAST = 96
+# Blocks with more flat mid-tone pixels than this are photos and stay in the background
+PHOTO_BLOCK_FRACTION = 0.3
+
+# The background layer is stored at 1/BACKGROUND_FACTOR of the mask resolution
+BACKGROUND_FACTOR = 3
+# Passes of neighbour filling for layer cells with no pixels of their own
+FILL_PASSES = 4
+# The foreground (text color) layer is stored at 1/FOREGROUND_FACTOR of the
+# mask resolution. Thin strokes and scanning vary the lightness of text but
+# not its hue: text whose cells all keep their tint (color minus its gray
+# level) within TEXT_TINT_SPREAD of the median is painted in one color instead
+FOREGROUND_FACTOR = 8
+TEXT_TINT_SPREAD = 32
+
+
+def rgb_array(pix):
+    """An (height, width, 3) view of an RGB fitz Pixmap without alpha."""
+    rgb = np.frombuffer(pix.samples_mv, np.uint8).reshape(pix.height, pix.stride)[:, :pix.width * 3]
+    return rgb.reshape(pix.height, pix.width, 3)
+
+
+def luminance(rgb):
+    """Integer Rec. 601 luma of an RGB array, as int16."""
+    luma = (rgb[..., 0].astype(np.int32) * 77 + rgb[..., 1].astype(np.int32) * 150
+            + rgb[..., 2].astype(np.int32) * 29) >> 8
+    return luma.astype(np.int16)
+
+
+def flat_midtones(gray):
+    """
+    Pixels that are mid-tones and differ little from their left and upper
+    neighbours. Glyph edges are mid-tones but never flat; shading and photos are.
+    """
+    flat = np.ones(gray.shape, bool)
+    flat[:, 1:] = np.abs(np.diff(gray, axis=1)) < FLAT_STEP
+    flat[1:, :] &= np.abs(np.diff(gray, axis=0)) < FLAT_STEP
+    return flat & (gray > MIDTONE_RANGE[0]) & (gray < MIDTONE_RANGE[1])
+
+
+def _blocks(array, block):
+    """Pad a 2-D array to whole blocks and view it as (rows, block, columns, block)."""
+    h, w = array.shape
+    rows, columns = -(-h // block), -(-w // block)
+    padded = np.pad(array, ((0, rows * block - h), (0, columns * block - w)), mode='edge')
+    return padded.reshape(rows, block, columns, block)
+
+
+def _grow(grid):
+    """3x3 neighbourhood maximum on a block grid."""
+    h, w = grid.shape
+    padded = np.pad(grid, 1, mode='edge')
+    return np.max([padded[y:y + h, x:x + w] for y in range(3) for x in range(3)], axis=0)
+
+
+def block_variance(gray, block=MASK_BLOCK):
+    """Variance of every block x block tile of a 2-D array, as a grid of float32."""
+    return _blocks(gray, block).var(axis=(1, 3), dtype=np.float32)
+
+
+def segment(rgb):
+    """
+    Split a page into a bilevel text mask (True where text is) using block
+    paper levels; photo blocks are excluded so they stay in the background.
+    """
+    gray = luminance(rgb)
+    h, w = gray.shape
+    blocks = _blocks(gray, MASK_BLOCK)
+    paper = _grow(blocks.max(axis=(1, 3)))
+    photo = _blocks(flat_midtones(gray), MASK_BLOCK).mean(axis=(1, 3)) > PHOTO_BLOCK_FRACTION
+    threshold = np.where(_grow(photo), -1, paper - TEXT_CONTRAST).astype(np.int16)
+    mask = blocks < threshold[:, None, :, None]
+    return mask.reshape(blocks.shape[0] * MASK_BLOCK, blocks.shape[2] * MASK_BLOCK)[:h, :w]
+
+
+def _cell_sums(rgb, selected, factor):
+    """Per factor x factor cell, the channel sums and count of the pixels where selected is set."""
+    h, w = selected.shape
+    rows, columns = -(-h // factor), -(-w // factor)
+    pad = ((0, rows * factor - h), (0, columns * factor - w))
+    known = np.pad(np.where(selected[..., None], rgb, np.uint8(0)), pad + ((0, 0),))
+    sums = known.reshape(rows, factor, columns, factor, 3).sum(axis=(1, 3), dtype=np.uint32)
+    del known
+    counts = np.pad(selected, pad).reshape(rows, factor, columns, factor).sum(axis=(1, 3), dtype=np.uint32)
+    return sums, counts
+
+
+def _cell_means(sums, counts):
+    """Mean color of each cell; cells with no pixels are filled from their neighbours."""
+    for _ in range(FILL_PASSES):
+        empty = counts == 0
+        if not empty.any():
+            break
+        neighbour_sums = np.zeros_like(sums)
+        neighbour_counts = np.zeros_like(counts)
+        for shift, axis in ((1, 0), (-1, 0), (1, 1), (-1, 1)):
+            neighbour_sums += np.roll(sums, shift, axis)
+            neighbour_counts += np.roll(counts, shift, axis)
+        sums[empty] = neighbour_sums[empty]
+        counts[empty] = neighbour_counts[empty]
+    empty = counts == 0
+    sums[empty] = 255
+    counts[empty] = 1
+    return (sums // counts[..., None]).astype(np.uint8)
+
+
+def background(rgb, mask, factor=BACKGROUND_FACTOR):
+    """
+    Downsample the page by factor, averaging only the non-text pixels of each
+    cell; cells that are all text are filled from their neighbours.
+    """
+    return _cell_means(*_cell_sums(rgb, ~mask, factor))
+
+
+def foreground(rgb, mask, factor=FOREGROUND_FACTOR):
+    """
+    The ink color of the text, downsampled by factor. Stroke edges blend
+    into the paper, so each cell averages the text pixels whose four
+    neighbours are text too, or all its text pixels where strokes are too
+    thin for that. Returns (colors, inked): the (rows, columns, 3) uint8
+    layer, with cells that hold no text filled from their neighbours, and
+    the grid of cells that do.
+    """
+    inner = mask.copy()
+    inner[1:] &= mask[:-1]
+    inner[:-1] &= mask[1:]
+    inner[:, 1:] &= mask[:, :-1]
+    inner[:, :-1] &= mask[:, 1:]
+    sums, counts = _cell_sums(rgb, inner, factor)
+    del inner
+    thin = counts == 0
+    edge_sums, edge_counts = _cell_sums(rgb, mask, factor)
+    sums[thin] = edge_sums[thin]
+    counts[thin] = edge_counts[thin]
+    inked = counts > 0
+    return _cell_means(sums, counts), inked
+
+
+def encode_mask(mask):
+    """
+    Encode a text mask as a PDF stencil. Returns (data, filter_name, decode_parms):
+    CCITT G4 when Pillow has libtiff, otherwise 1-bit Flate.
+    """
+    height, width = mask.shape
+    if features.check('libtiff'):
+        buffer = BytesIO()
+        # One strip, so the TIFF payload is a single G4 stream
+        Image.fromarray(mask).save(buffer, format='TIFF', compression='group4', strip_size=1 << 30)
+        buffer.seek(0)
+        tiff = Image.open(buffer)
+        offsets, counts = tiff.tag_v2[273], tiff.tag_v2[279]
+        if len(offsets) == 1:
+            data = buffer.getvalue()[offsets[0]:offsets[0] + counts[0]]
+            return data, '/CCITTFaxDecode', f'<< /K -1 /Columns {width} /Rows {height} >>'
+    # Stencil samples of 0 are painted
+    return zlib.compress(Image.fromarray(~mask).tobytes(), 9), '/FlateDecode', None
+
+
+def mrc_layers(rgb, quality, factor=BACKGROUND_FACTOR):
+    """
+    Segment an RGB page into MRC layers.
+
+    Returns (background, mask, color): background is (jpeg_data, size, mode),
+    mask is (data, size, filter_name, decode_parms) or None when the page has
+    no text, in which case the background keeps the full resolution. color
+    is the text's single (r, g, b) color in 0..1 or, when the text has
+    several colors, a (jpeg_data, size, mode) foreground layer at
+    1/FOREGROUND_FACTOR of the mask resolution that the mask cuts out.
+    """
+    mask = segment(rgb)
+    if not mask.any():
+        img = Image.fromarray(rgb)
+        data = PillowBackend().process(img, output_format='jpeg', quality=quality, colors=None)
+        return (data, img.size, 'RGB'), None, (0.0, 0.0, 0.0)
+
+    colors, inked = foreground(rgb, mask)
+    text_colors = colors[inked].astype(np.int16)
+    tints = text_colors - text_colors.mean(axis=1, keepdims=True)
+    if np.abs(tints - np.median(tints, axis=0)).max() <= TEXT_TINT_SPREAD:
+        color = tuple(float(value) / 255 for value in np.median(text_colors, axis=0))
+    else:
+        img = Image.fromarray(colors)
+        color = (PillowBackend().process(img, output_format='jpeg', quality=quality, colors=None), img.size, 'RGB')
+    del colors
+
+    img = Image.fromarray(background(rgb, mask, factor))
+    data = PillowBackend().process(img, output_format='jpeg', quality=quality, colors=None)
+    mask_data, filter_name, decode_parms = encode_mask(mask)
+    return (data, img.size, 'RGB'), (mask_data, mask.shape[::-1], filter_name, decode_parms), color
@@ -1,17 +1,423 @@
+import hashlib
+import itertools
+import math
+import mmap
 import os
+import re
+import shutil
 import tempfile
-import zipfile
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+import zlib
 from io import BytesIO
+import numpy as np
 from PIL import Image
 import fitz 
-import subprocess
+
+from core.ArchiveWriter.ArchiveWriter import ARCHIVE_KINDS, DirectoryWriter, ZipStreamWriter
+from core.ImageCompressor.ImageCompressor import LOSSY_FORMATS, ImageCompressor, PillowBackend
+from core.MixedRaster.MixedRaster import block_variance, flat_midtones, luminance, mrc_layers, rgb_array
+from core.PdfWriter.PdfWriter import PdfStreamWriter
+from core.RateControl.RateControl import allocate, curve_qualities, fit_curve, page_curve
+from core.TiledPipeline.TiledPipeline import PeakMemory
+
+# Bump when the same inputs and parameters would produce different output
+ENGINE_VERSION = 5
+
+# 'raster' re-renders every page as an image; 'smart' only recompresses embedded images;
+# 'extract' pulls the embedded images out as files instead of rendering pages;
+# 'mrc' splits each rendered page into a 1-bit text mask over a low-res JPEG background;
+# 'lossless' only runs the structural pass below
+PDF_MODES = ('raster', 'smart', 'extract', 'mrc', 'lossless')
+
+# Save options of the structural pass: drop unused and merge duplicate objects and
+# streams, deflate uncompressed streams, clean content streams, use object streams
+STRUCTURE_OPTIONS = dict(garbage=4, deflate=True, deflate_images=True, deflate_fonts=True, clean=True,
+                         use_objstms=1)
+
+# Embedded streams that are complete image files and are extracted byte for byte
+PASSTHROUGH_EXTENSIONS = ('jpeg', 'jpx')
+
+# Bilevel codecs are already far smaller than anything we would re-encode to
+SKIP_IMAGE_FILTERS = ('/JBIG2Decode', '/CCITTFaxDecode')
+MIN_IMAGE_PIXELS = 64 * 64
+
+# Images with at most this many distinct colors are treated as graphics and kept lossless
+GRAPHIC_MAX_COLORS = 4096
+# Keys that, with the raw stream, make two image XObjects the same image
+IMAGE_KEYS = ('SMask', 'Mask', 'ImageMask', 'Filter', 'DecodeParms', 'Decode', 'Width', 'Height',
+              'ColorSpace', 'BitsPerComponent')
+REFERENCE = re.compile(r'(\d+) 0 R')
+
+# Below this many pages, process start-up costs more than parallel rendering saves
+PARALLEL_MIN_PAGES = 8
+
+# Adaptive rendering: pages are classified from a render at ANALYSIS_DPI, then
+# rendered at the requested dpi times the scale for their class. 1-bit text
+# needs extra resolution to stay legible; photos need less than line art.
+ANALYSIS_DPI = 36
+ADAPTIVE_DPI_SCALE = {'bitonal': 1.5, 'gray': 1.0, 'color': 0.75}
+# A page is color when more than COLOR_FRACTION of its pixels have channels
+# further apart than COLOR_SPREAD
+COLOR_SPREAD = 24
+COLOR_FRACTION = 0.01
+# On a bitonal page mid-tones only occur on glyph and line edges; more than
+# FLAT_MIDTONE_FRACTION of flat mid-tone pixels means shading or a photo
+FLAT_MIDTONE_FRACTION = 0.01
+BITONAL_THRESHOLD = 128
+# Output formats that can store a page as 1 bit per pixel
+BITONAL_FORMATS = ('pdf', 'png')
+PAGE_CLASSES = {'1': 'bitonal', 'L': 'gray'}
+
+# A rendered page is blank when no block of it has a luma variance above
+# BLANK_VARIANCE (scanner noise and specks of dust stay below it, a period does not)
+BLANK_VARIANCE = 64
+# Encoded pages remembered per run, so repeated pages are encoded only once
+DUPLICATE_WINDOW = 16
+
+# target_bytes: container bytes per page on top of its image data (page object,
+# content stream, image dictionary; zip headers), by container
+TARGET_PAGE_OVERHEAD = {'pdf': 512, 'zip': 128, 'directory': 0}
+# Predicted sizes are within a few percent; this share of the budget is held back
+TARGET_MARGIN = 0.02
+
+
+def open_document(source):
+    """Open a PDF from a file path or, without copying it, from a bytes-like buffer."""
+    if isinstance(source, str):
+        return fitz.open(source)
+    return fitz.open(stream=source, filetype='pdf')
+
+
+def select_pages(pages, page_count):
+    """
+    Resolve a page selection to a sorted list of distinct 0-based page numbers.
+
+    pages may be None (every page), a page number, an iterable of page
+    numbers (e.g. range(0, 20, 2)), a slice, a predicate called with each
+    page number, or a string of 1-based pages and ranges such as '1-5, 8, 10-'.
+    Negative page numbers count from the end, as in Python.
+    """
+    if pages is None:
+        return list(range(page_count))
+    if callable(pages):
+        return [page_num for page_num in range(page_count) if pages(page_num)]
+    if isinstance(pages, slice):
+        return list(range(page_count)[pages])
+    if isinstance(pages, str):
+        selected = []
+        for part in filter(None, (part.strip() for part in pages.split(','))):
+            first, dash, last = part.partition('-')
+            try:
+                first = int(first) if first.strip() else 1
+                last = (int(last) if last.strip() else page_count) if dash else first
+            except ValueError:
+                raise ValueError(f"Invalid page range: {part}") from None
+            if not 1 <= first <= last <= page_count:
+                raise ValueError(f"Page range {part} is outside 1-{page_count}")
+            selected.extend(range(first - 1, last))
+        return sorted(set(selected))
+    if isinstance(pages, int):
+        pages = [pages]
+    selected = set()
+    for page_num in pages:
+        if not -page_count <= page_num < page_count:
+            raise ValueError(f"Page {page_num} is outside a document of {page_count} pages")
+        selected.add(page_num % page_count)
+    return sorted(selected)
+
+
+def pixmap_to_image(pix):
+    """
+    Wrap a fitz Pixmap's samples as a PIL image, honouring its stride and
+    colorspace, with no PNG encode/decode or file in between. Gray and
+    CMYK share the pixmap's memory, so release the image before pix; RGB
+    is unpacked once into Pillow's 4-byte layout, and alpha pixmaps
+    (premultiplied in MuPDF) are unpremultiplied while unpacking.
+    """
+    mode = {1: 'L', 3: 'RGB', 4: 'CMYK'}[pix.n - pix.alpha]
+    size = (pix.width, pix.height)
+    if pix.alpha and mode == 'L':
+        return Image.frombuffer('La', size, pix.samples_mv, 'raw', 'La', pix.stride, 1).convert('LA')
+    if pix.alpha:
+        return Image.frombuffer('RGBA', size, pix.samples_mv, 'raw', 'RGBa', pix.stride, 1)
+    return Image.frombuffer(mode, size, pix.samples_mv, 'raw', mode, pix.stride, 1)
+
+
+def classify_page(page):
+    """
+    Classify a page as 'bitonal', 'gray' or 'color' from a low-resolution
+    RGB render, using vectorized channel-spread and flat mid-tone counts.
+    """
+    zoom = ANALYSIS_DPI / 72
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csRGB, alpha=False)
+    rgb = rgb_array(pix)
+    spread = rgb.max(axis=2) - rgb.min(axis=2)
+    if np.count_nonzero(spread > COLOR_SPREAD) > COLOR_FRACTION * spread.size:
+        return 'color'
+
+    gray = luminance(rgb)
+    del rgb, pix
+    if np.count_nonzero(flat_midtones(gray)) > FLAT_MIDTONE_FRACTION * gray.size:
+        return 'gray'
+    return 'bitonal'
+
+
+def _render_adaptive(page, dpi, params, output_format):
+    """
+    Render a page at the DPI and colorspace its content class calls for.
+    Returns (class, image, pixmap); bitonal pages come back as mode '1'.
+    Release the image before the pixmap, as with pixmap_to_image.
+    """
+    page_class = classify_page(page)
+    if page_class == 'bitonal' and (params['resize'] or output_format not in BITONAL_FORMATS):
+        # Thresholding a page that is resampled or stored as gray anyway gains nothing
+        page_class = 'gray'
+    zoom = dpi * ADAPTIVE_DPI_SCALE[page_class] / 72
+    colorspace = fitz.csRGB if page_class == 'color' else fitz.csGRAY
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace, alpha=False)
+    if page_class != 'bitonal':
+        return page_class, pixmap_to_image(pix), pix
+    gray = np.frombuffer(pix.samples_mv, np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    return page_class, Image.fromarray(gray >= BITONAL_THRESHOLD), pix
+
+
+def _encode_bitonal(img, output_format, params):
+    """Encode a 1-bit page: packed Flate bits for PDF, otherwise a 1-bit PNG."""
+    if output_format == 'pdf':
+        return zlib.compress(img.tobytes(), 9)
+    buffer = BytesIO()
+    img.save(buffer, format='PNG', optimize=params['optimize'])
+    return buffer.getvalue()
+
+
+def _convert_page(compressed, output_format, quality):
+    """
+    Turn a compressed PNG page into the requested output.
+    Returns (image_size, mode, data); 'pdf' gives JPEG data for embedding.
+    """
+    if output_format == 'png':
+        return None, None, compressed
+    img = Image.open(BytesIO(compressed))
+    if output_format in ('pdf', 'jpeg') and img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    buffer = BytesIO()
+    # Use uppercase format for PIL
+    img.save(buffer, format='JPEG' if output_format == 'pdf' else output_format.upper(), quality=quality)
+    return img.size, img.mode, buffer.getvalue()
+
+
+def page_samples(pix):
+    """An (height, width, channels) view of a fitz Pixmap's samples."""
+    samples = np.frombuffer(pix.samples_mv, np.uint8).reshape(pix.height, pix.stride)
+    return samples[:, :pix.width * pix.n].reshape(pix.height, pix.width, pix.n)
+
+
+def blank_color(pix):
+    """
+    The mean color of a near-uniform page render as a tuple of 0..255
+    values, or None when any block of the page varies more than BLANK_VARIANCE.
+    """
+    samples = page_samples(pix)
+    # Every other row and column is plenty to tell a blank page from one with marks
+    sparse = samples[::2, ::2]
+    gray = luminance(sparse) if pix.n >= 3 else sparse[..., 0]
+    if block_variance(gray).max() > BLANK_VARIANCE:
+        return None
+    return tuple(int(value) for value in samples.reshape(-1, pix.n).mean(axis=0).round())
+
+
+def page_digest(pix):
+    """Hash of a page render; equal digests mean pixel-identical pages."""
+    digest = hashlib.blake2b(f'{pix.width}x{pix.height}x{pix.n}'.encode(), digest_size=16)
+    digest.update(pix.samples_mv)
+    return digest.digest()
+
+
+def _encode_blank(color, size, backend, params, output_format):
+    """
+    Trivial encoding of a blank page: a 'FILL' page with the color as
+    (r, g, b) in 0..1 for PDF output, otherwise a solid image of the color.
+    """
+    if output_format == 'pdf':
+        rgb = color * 3 if len(color) == 1 else color
+        return None, 'FILL', tuple(value / 255 for value in rgb)
+    img = Image.new('L' if len(color) == 1 else 'RGB', size, color)
+    if output_format in LOSSY_FORMATS:
+        params = dict(params, colors=None)
+    data = ImageCompressor(image_data=img, backend=backend).process_image(output_format=output_format, **params)
+    return None, img.mode, data
+
+
+def _resolve_references(doc, value, cache, depth=2):
+    """
+    Replace the indirect references in a PDF object string with a digest of
+    the objects they point to, so equal content compares equal across xrefs.
+    """
+    def resolve(match):
+        xref = int(match.group(1))
+        if xref not in cache:
+            body = doc.xref_object(xref, compressed=True)
+            if depth > 1:
+                body = _resolve_references(doc, body, cache, depth - 1)
+            digest = hashlib.blake2b(body.encode(), digest_size=16)
+            if doc.xref_is_stream(xref):
+                digest.update(doc.xref_stream_raw(xref))
+            cache[xref] = digest.hexdigest()
+        return cache[xref]
+    return REFERENCE.sub(resolve, value)
+
+
+def _compress_page(pdf_document, page_num, dpi, backend, params, output_format, direct=True,
+                   adaptive=False, mrc=False, encoded=None):
+    """
+    Render one page, compress it and convert it to output_format.
+    Returns (page_size, image_size, mode, data, digest); mode '1' is a bitonal
+    page as packed Flate bits for PDF output, and mode 'MRC' carries the
+    (background, mask, color) layers from mrc_layers as data.
+
+    Blank pages are not encoded from the render: for PDF output they come
+    back as mode 'FILL' with the page color as data, and their digest is None.
+    Otherwise digest identifies the render; with an `encoded` OrderedDict, a
+    render seen within the last DUPLICATE_WINDOW pages reuses its encoding.
+
+    direct encodes the page once, straight to the target format (JPEG for
+    PDF pages); otherwise it is compressed to PNG first and then converted.
+    adaptive picks each page's DPI and colorspace from its content.
+    """
+    page = pdf_document.load_page(page_num)
+    page_size = (page.rect.width, page.rect.height)
+    page_class = img = None
+    if mrc:
+        pix = page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72), colorspace=fitz.csRGB, alpha=False)
+    elif adaptive:
+        page_class, img, pix = _render_adaptive(page, dpi, params, output_format)
+    else:
+        pix = page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72))
+        img = pixmap_to_image(pix)
+
+    color = blank_color(pix)
+    if color is not None:
+        size = (pix.width, pix.height)
+        del img, pix
+        return (page_size,) + _encode_blank(color, size, backend, params, output_format) + (None,)
+    digest = page_digest(pix)
+    if encoded is not None and digest in encoded:
+        encoded.move_to_end(digest)
+        return (page_size,) + encoded[digest] + (digest,)
+
+    if mrc:
+        result = None, 'MRC', mrc_layers(rgb_array(pix), params['quality'])
+    elif page_class == 'bitonal' and direct:
+        result = img.size, img.mode, _encode_bitonal(img, output_format, params)
+    elif not direct:
+        compressed = ImageCompressor(image_data=img, backend=backend).process_image(output_format='png', **params)
+        # The image may map the pixmap's samples; drop it first
+        img = pix = None
+        result = _convert_page(compressed, output_format, params['quality'])
+    else:
+        target = 'jpeg' if output_format == 'pdf' else output_format
+        if target in LOSSY_FORMATS:
+            # A palette only helps lossless output; before JPEG it just adds banding
+            params = dict(params, colors=None)
+        data = ImageCompressor(image_data=img, backend=backend).process_image(output_format=target, **params)
+        mode = img.mode
+        img = pix = None
+        if output_format != 'pdf':
+            result = None, mode, data
+        else:
+            header = Image.open(BytesIO(data))
+            result = header.size, header.mode, data
+    del img, pix
+    if encoded is not None:
+        encoded[digest] = result
+        if len(encoded) > DUPLICATE_WINDOW:
+            encoded.popitem(last=False)
+    return (page_size,) + result + (digest,)
+
+
+# Document handles opened by this worker process, reused across its tasks
+_worker_documents = {}
+
+
+def _worker_document(pdf_path):
+    """This worker's open handle on pdf_path, opened on first use."""
+    pdf_document = _worker_documents.get(pdf_path)
+    if pdf_document is None:
+        pdf_document = _worker_documents[pdf_path] = fitz.open(pdf_path)
+    return pdf_document
+
+
+def _page_params(params, qualities, page_num):
+    """params with the page's own quality from a {page_num: quality} plan, if any."""
+    if qualities is None:
+        return params
+    return dict(params, quality=qualities[page_num])
+
+
+def _compress_page_range(pdf_path, page_nums, dpi, backend, params, output_format, direct, adaptive, mrc,
+                         qualities=None):
+    """Process-pool entry point: _compress_page for each of page_nums."""
+    pdf_document = _worker_document(pdf_path)
+    encoded = OrderedDict()
+    return [_compress_page(pdf_document, page_num, dpi, backend, _page_params(params, qualities, page_num),
+                           output_format, direct, adaptive, mrc, encoded)
+            for page_num in page_nums]
+
+
+def _sample_page(pdf_document, page_num, dpi, backend, params, output_format, qualities):
+    """
+    Rate-control sample of a page rendered as _compress_page renders it in
+    raster mode. Returns (curve, pixels, digest) with the page_curve over
+    qualities. A blank page is never encoded from its render; for it the
+    bytes of its blank encoding at the lowest quality, which the plan gives
+    it, are returned instead (0 for a PDF fill).
+    """
+    page = pdf_document.load_page(page_num)
+    pix = page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72))
+    color = blank_color(pix)
+    if color is not None:
+        if output_format == 'pdf':
+            return 0
+        blank = _encode_blank(color, (pix.width, pix.height), backend, dict(params, quality=qualities[0]),
+                              output_format)
+        return len(blank[2])
+    target = 'jpeg' if output_format == 'pdf' else output_format
+    params = dict(params, colors=None)
+
+    def encode(img, quality):
+        return ImageCompressor(image_data=img, backend=backend).process_image(
+            output_format=target, **dict(params, quality=quality))
+
+    img = pixmap_to_image(pix)
+    curve = page_curve(img, qualities, qualities[len(qualities) // 2], encode)
+    pixels = pix.width * pix.height
+    del img
+    return curve, pixels, page_digest(pix)
+
+
+def _sample_page_range(pdf_path, page_nums, dpi, backend, params, output_format, qualities):
+    """Process-pool entry point: _sample_page for each of page_nums."""
+    pdf_document = _worker_document(pdf_path)
+    return [_sample_page(pdf_document, page_num, dpi, backend, params, output_format, qualities)
+            for page_num in page_nums]
+
 
 class PdfCompressor:
-    def __init__(self):
+    def __init__(self, backend=None, cache=None):
         """
         Initialize PDF handler with an ImageCompressor instance.
+
+        Args:
+            backend: Image backend name or instance (None picks the fastest available);
+                worker processes get a pickled copy of the instance
+            cache: Optional ResultCache consulted before any PDF is processed
         """
-        self.compressor = ImageCompressor(image_data=b'')  # Initialize with empty data
+        self.compressor = ImageCompressor(image_data=b'', backend=backend)  # Initialize with empty data
+        self.backend = self.compressor.backend
+        self.cache = cache
+        self.stats = {}
         self.temp_files = []
         
     def __del__(self):
@@ -23,246 +429,794 @@ class PdfCompressor:
                 except Exception as e:
                     print(f"Failed to delete temporary file {temp_file}: {e}")
     
-    def _get_temp_file(self, extension):
-        """Create a temporary file with the given extension."""
-        temp_file = tempfile.NamedTemporaryFile(suffix=extension, delete=False)
+    def _get_temp_file(self, extension, directory=None):
+        """Create a temporary file with the given extension, in directory if given."""
+        temp_file = tempfile.NamedTemporaryFile(suffix=extension, delete=False, dir=directory)
         temp_file.close()
         self.temp_files.append(temp_file.name)
         return temp_file.name
     
-    def _ensure_pdf_file(self, pdf_path=None, pdf_data=None):
+    def _input_source(self, pdf_path=None, pdf_data=None):
         """
-        Ensure we have a PDF file path, creating one from data if needed.
-        Returns the path to the PDF file.
+        Return what documents are opened from, without duplicating the input,
+        and the memory map opened for it (None if there is none to close):
+        the file path, a read-only memory map of an open file, or a view of
+        bytes-like data (bytes, bytearray, mmap, memoryview, BytesIO).
+        File objects without a mappable descriptor are read instead.
         """
         if pdf_path:
-            return pdf_path
-        elif pdf_data:
-            temp_path = self._get_temp_file('.pdf')
-            with open(temp_path, 'wb') as f:
-                f.write(pdf_data)
-            return temp_path
-        else:
-            raise ValueError("Either pdf_path or pdf_data must be provided")
+            return os.fspath(pdf_path), None
+        if hasattr(pdf_data, 'read'):
+            name = getattr(pdf_data, 'name', None)
+            if isinstance(name, str) and os.path.isfile(name):
+                return name, None
+            try:
+                input_map = mmap.mmap(pdf_data.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError, AttributeError):
+                # In-memory files (BytesIO has a fileno() that raises), pipes, empty files
+                if hasattr(pdf_data, 'getbuffer'):
+                    return pdf_data.getbuffer(), None
+                pdf_data = pdf_data.read()
+            else:
+                return memoryview(input_map), input_map
+        if pdf_data:
+            return memoryview(pdf_data), None
+        raise ValueError("Either pdf_path or pdf_data must be provided")
+
+    def _source_path(self, source):
+        """
+        A file path worker processes can open. In-memory input is written to
+        a temporary file once, and only when pages are rendered in parallel.
+        """
+        if isinstance(source, str):
+            return source
+        temp_path = self._get_temp_file('.pdf')
+        with open(temp_path, 'wb') as f:
+            f.write(source)
+        return temp_path
     
-    def _convert_pdf_to_images(self, pdf_path, dpi=200):
+    def _iter_pages(self, source, dpi, workers, chunk_size, max_in_flight, params, output_format,
+                    direct=True, adaptive=False, mrc=False, page_numbers=None, qualities=None):
         """
-        Convert PDF to individual images.
-        Returns a list of image file paths.
+        Yield (page_size, image_size, mode, data, digest) for every page in
+        order, or only for the pages in page_numbers; no other page is rendered.
+        qualities optionally maps page numbers to their own JPEG quality.
+
+        With more than one worker, runs of chunk_size pages are processed
+        in separate processes, each with its own document handle; at most
+        max_in_flight pages are being processed or waiting at a time.
         """
-        pdf_document = fitz.open(pdf_path)
-        image_paths = []
-        
-        for page_num in range(len(pdf_document)):
-            page = pdf_document.load_page(page_num)
-            pix = page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72))
-            
-            image_path = self._get_temp_file('.png')
-            pix.save(image_path)
-            image_paths.append(image_path)
-        
-        return image_paths
+        with open_document(source) as pdf_document:
+            if page_numbers is None:
+                page_numbers = range(len(pdf_document))
+            page_count = len(page_numbers)
+            workers = max(1, min(workers or os.cpu_count() or 1, page_count))
+            backend = self.backend
+
+            if workers == 1 or page_count < PARALLEL_MIN_PAGES:
+                self.stats.update(pages=page_count, workers=1)
+                encoded = OrderedDict()
+                for page_num in page_numbers:
+                    yield _compress_page(pdf_document, page_num, dpi, backend,
+                                         _page_params(params, qualities, page_num), output_format,
+                                         direct, adaptive, mrc, encoded)
+                return
+
+        input_path = self._source_path(source)
+
+        # Several chunks per worker keep the pool busy when page costs differ
+        chunk_size = chunk_size or max(1, min(8, math.ceil(page_count / (workers * 4))))
+        max_in_flight = max(chunk_size, max_in_flight or workers * 2 * chunk_size)
+        self.stats.update(pages=page_count, workers=workers, chunk_size=chunk_size, max_in_flight=max_in_flight)
+        chunks = iter([page_numbers[start:start + chunk_size] for start in range(0, page_count, chunk_size)])
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+
+            def fill():
+                while len(pending) * chunk_size < max_in_flight:
+                    page_nums = next(chunks, None)
+                    if page_nums is None:
+                        return
+                    chunk_qualities = None if qualities is None else {n: qualities[n] for n in page_nums}
+                    pending.append(executor.submit(_compress_page_range, input_path, page_nums,
+                                                   dpi, backend, params, output_format, direct, adaptive,
+                                                   mrc, chunk_qualities))
+
+            fill()
+            while pending:
+                results = pending.popleft().result()
+                fill()
+                yield from results
     
-    def _compress_images(self, image_paths, output_format='png', quality=85, 
-                        resize=None, strip_metadata=True, colors=256, optimize=True):
+    def _write_archive(self, writer, entries):
         """
-        Compress a list of images using the image compressor.
-        Returns a list of compressed image data (bytes).
+        Add (name, data) entries to an archive writer as they are produced,
+        so only the entries in flight are held in memory.
         """
-        compressed_images = []
-        
-        for image_path in image_paths:
-            with open(image_path, 'rb') as f:
-                image_data = f.read()
-            
-            # Create new ImageCompressor instance for each image
-            compressor = ImageCompressor(image_data=image_data)
-            compressed_data = compressor.process_image(
-                output_format=output_format,
-                quality=quality,
-                resize=resize,
-                strip_metadata=strip_metadata,
-                colors=colors,
-                optimize=optimize
-            )
-            compressed_images.append(compressed_data)
-        
-        return compressed_images
+        with PeakMemory() as memory:
+            for name, data in entries:
+                writer.add(name, data)
+            writer.close()
+        self.stats.update(archive_entries=writer.entries, peak_memory=memory.peak)
+        if isinstance(writer, ZipStreamWriter):
+            self.stats['archive_stored'] = writer.stored
+
+    def _page_entries(self, pages, output_format, page_numbers=None):
+        """
+        Archive entries for rendered pages, named by page number, counting
+        blank and repeated pages and the bytes of all pages.
+        """
+        seen = set()
+        blank_pages = duplicate_pages = duplicate_bytes = page_bytes = 0
+        page_numbers = itertools.count() if page_numbers is None else page_numbers
+        for page_num, (_, _, _, data, digest) in zip(page_numbers, pages):
+            if digest is None:
+                blank_pages += 1
+            elif digest in seen:
+                duplicate_pages += 1
+                duplicate_bytes += len(data)
+            else:
+                seen.add(digest)
+            page_bytes += len(data)
+            yield f'page_{page_num + 1}.{output_format}', data
+        self.stats.update(blank_pages=blank_pages, duplicate_pages=duplicate_pages, duplicate_bytes=duplicate_bytes,
+                          page_bytes=page_bytes)
+
+    def _iter_embedded_images(self, source, output_format, params, page_numbers=None):
+        """
+        Extract mode: yield (name, data) for every embedded image, once per
+        xref, on every page or on the pages in page_numbers.
+
+        JPEG and JPEG 2000 streams are copied out byte for byte, as are
+        images MuPDF already hands back in output_format. Anything else,
+        and images with a soft mask, is decoded and encoded to output_format.
+        """
+        if output_format in LOSSY_FORMATS:
+            params = dict(params, colors=None)
+        seen = set()
+        passthrough = converted = 0
+        with open_document(source) as doc:
+            for page_num in range(len(doc)) if page_numbers is None else page_numbers:
+                page = doc[page_num]
+                index = 0
+                for info in page.get_images(full=True):
+                    xref, smask = info[0], info[1]
+                    if xref in seen:
+                        continue
+                    seen.add(xref)
+                    index += 1
+                    name = f'page_{page.number + 1}_image_{index}'
+
+                    extracted = doc.extract_image(xref)
+                    ext = extracted['ext']
+                    if not smask and (ext in PASSTHROUGH_EXTENSIONS or ext == output_format):
+                        passthrough += 1
+                        yield f'{name}.{ext}', extracted['image']
+                        continue
+                    del extracted
+
+                    pix = fitz.Pixmap(doc, xref)
+                    if pix.colorspace is None or pix.colorspace.n not in (1, 3):
+                        pix = fitz.Pixmap(fitz.csRGB, pix)
+                    if smask:
+                        pix = fitz.Pixmap(pix, fitz.Pixmap(doc, smask))
+                    img = pixmap_to_image(pix)
+                    data = ImageCompressor(image_data=img, backend=self.backend).process_image(
+                        output_format=output_format, **params)
+                    del img, pix
+                    converted += 1
+                    yield f'{name}.{output_format}', data
+        self.stats.update(images=len(seen), images_passthrough=passthrough, images_converted=converted)
     
-    def _create_pdf_from_images(self, image_data_list, output_format='png'):
+    def _image_placements(self, doc, page_numbers=None):
+        """
+        Largest displayed size in inches of each image xref across all pages,
+        or None when the image is used somewhere its placement is unknown.
+
+        With page_numbers only images on those pages are included, and not
+        the ones also shown on other pages, so the other pages stay untouched.
         """
-        Combine multiple images into a single PDF.
+        placements = {}
+        for page_num in range(len(doc)) if page_numbers is None else page_numbers:
+            page = doc[page_num]
+            for info in page.get_images(full=True):
+                xref = info[0]
+                if xref in placements and placements[xref] is None:
+                    continue
+                rects = page.get_image_rects(xref)
+                if not rects:
+                    placements[xref] = None
+                    continue
+                width, height = placements.get(xref) or (0, 0)
+                for rect in rects:
+                    width = max(width, abs(rect.width) / 72)
+                    height = max(height, abs(rect.height) / 72)
+                placements[xref] = (width, height)
+        if page_numbers is not None:
+            selected = set(page_numbers)
+            for page in doc:
+                if page.number not in selected:
+                    for info in page.get_images(full=True):
+                        placements.pop(info[0], None)
+        return placements
+
+    def _duplicate_images(self, doc, placements):
+        """
+        Find image XObjects with the same raw stream and image keys.
+
+        The copies are removed from placements, the first of each group gets
+        the largest placement of the group, and {first: [copies]} is returned.
+        """
+        first = {}
+        duplicates = {}
+        resolved = {}
+        for xref in list(placements):
+            digest = hashlib.blake2b(doc.xref_stream_raw(xref), digest_size=16)
+            for key in IMAGE_KEYS:
+                digest.update(_resolve_references(doc, doc.xref_get_key(xref, key)[1], resolved).encode())
+            digest = digest.digest()
+            if digest not in first:
+                first[digest] = xref
+                continue
+            original = first[digest]
+            placement = placements.pop(xref)
+            if placement is None or placements[original] is None:
+                placements[original] = None
+            else:
+                placements[original] = tuple(map(max, placement, placements[original]))
+            duplicates.setdefault(original, []).append(xref)
+        return duplicates
+
+    def _recompress_image(self, doc, xref, placement, quality, dpi):
+        """
+        Downsample and re-encode one image XObject in place.
+        Returns (bytes_before, bytes_after); equal when the image is left alone.
+        """
+        before = len(doc.xref_stream_raw(xref))
+        keys = dict((key, doc.xref_get_key(xref, key)[1]) for key in ('Filter', 'ImageMask', 'Mask'))
+        if (keys['ImageMask'] == 'true' or keys['Mask'] != 'null'
+                or any(name in keys['Filter'] for name in SKIP_IMAGE_FILTERS)):
+            return before, before
+
+        pix = fitz.Pixmap(doc, xref)
+        if pix.width * pix.height < MIN_IMAGE_PIXELS:
+            return before, before
+        if pix.alpha:
+            pix = fitz.Pixmap(pix, 0)
+        gray = pix.colorspace is not None and pix.colorspace.n == 1
+        if pix.colorspace is None or pix.colorspace.n not in (1, 3):
+            pix = fitz.Pixmap(fitz.csRGB, pix)
+        img = Image.frombytes('L' if gray else 'RGB', (pix.width, pix.height), pix.samples)
+
+        size = img.size
+        if placement is not None:
+            # Never keep more pixels than `dpi` needs at the largest placement
+            scale = max(placement[0] * dpi / img.size[0], placement[1] * dpi / img.size[1])
+            if scale < 0.9:
+                size = (max(1, math.ceil(img.size[0] * scale)), max(1, math.ceil(img.size[1] * scale)))
+
+        photographic = ('/DCTDecode' in keys['Filter'] or '/JPXDecode' in keys['Filter']
+                        or img.getcolors(GRAPHIC_MAX_COLORS) is None)
+        if photographic:
+            data = PillowBackend().process(img, output_format='jpeg', quality=quality,
+                                           resize=size if size != img.size else None, colors=None)
+            filter_name = '/DCTDecode'
+        else:
+            # Graphics stay lossless; Lanczos is fine for flat colors at this scale
+            if size != img.size:
+                img = img.resize(size, Image.LANCZOS)
+            data = zlib.compress(img.tobytes(), 9)
+            filter_name = '/FlateDecode'
+
+        if len(data) >= before:
+            return before, before
+        doc.update_stream(xref, data, compress=False)
+        doc.xref_set_key(xref, 'Filter', filter_name)
+        doc.xref_set_key(xref, 'DecodeParms', 'null')
+        doc.xref_set_key(xref, 'Decode', 'null')
+        doc.xref_set_key(xref, 'Width', str(size[0]))
+        doc.xref_set_key(xref, 'Height', str(size[1]))
+        doc.xref_set_key(xref, 'ColorSpace', '/DeviceGray' if gray else '/DeviceRGB')
+        doc.xref_set_key(xref, 'BitsPerComponent', '8')
+        return before, len(data)
+
+    def _recompress_pdf(self, source, quality, dpi, page_numbers=None):
+        """
+        Smart mode: re-encode only the embedded images (of the pages in
+        page_numbers), leaving text, fonts and vector content as they are.
         Returns PDF data as bytes.
         """
-        pdf_buffer = BytesIO()
-        
-        # Convert all images to PIL Image objects
-        images = []
-        for img_data in image_data_list:
-            img = Image.open(BytesIO(img_data))
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            images.append(img)
-        
-        # Save first image as PDF, then append others
-        if images:
-            images[0].save(
-                pdf_buffer,
-                format='PDF',
-                save_all=True,
-                append_images=images[1:]
+        doc = open_document(source)
+        try:
+            placements = self._image_placements(doc, page_numbers)
+            duplicates = self._duplicate_images(doc, placements)
+            before_total = after_total = recompressed = duplicate_bytes = 0
+            for xref, placement in placements.items():
+                copies = duplicates.get(xref, ())
+                before, after = self._recompress_image(doc, xref, placement, quality, dpi)
+                # Make the copies identical to the first, so garbage collection keeps one object
+                for copy in copies:
+                    doc.update_stream(copy, doc.xref_stream_raw(xref), compress=False)
+                    doc.update_object(copy, doc.xref_object(xref, compressed=True))
+                count = 1 + len(copies)
+                before_total += before * count
+                after_total += after * count
+                recompressed += (after < before) * count
+                duplicate_bytes += before * len(copies)
+            self.stats.update(
+                images=len(placements) + sum(len(copies) for copies in duplicates.values()),
+                images_recompressed=recompressed,
+                images_duplicate=sum(len(copies) for copies in duplicates.values()),
+                duplicate_bytes=duplicate_bytes,
+                image_bytes_before=before_total,
+                image_bytes_after=after_total
             )
-        
-        return pdf_buffer.getvalue()
-    
-    def _create_zip_from_images(self, image_data_list, output_format='png'):
+            # garbage=4 drops the replaced streams and merges duplicate objects and streams
+            return doc.tobytes(garbage=4, deflate=True)
+        finally:
+            doc.close()
+
+    def _optimize_structure(self, source, output_path=None):
         """
-        Create a zip file containing all images.
-        Returns zip data as bytes.
+        Lossless structural pass: subset embedded fonts to the glyphs used and
+        save with STRUCTURE_OPTIONS. Keeps the input when that is not smaller.
+        Returns PDF data as bytes, or output_path once written there.
         """
-        zip_buffer = BytesIO()
-        
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for i, img_data in enumerate(image_data_list, start=1):
-                zip_file.writestr(
-                    f'page_{i}.{output_format}',
-                    img_data
-                )
-        
-        zip_buffer.seek(0)
-        return zip_buffer.getvalue()
-    
+        size = os.path.getsize(source) if isinstance(source, str) else len(source)
+        with open_document(source) as doc:
+            if any(doc.get_page_fonts(page_num) for page_num in range(len(doc))):
+                doc.subset_fonts()
+            if output_path is None:
+                output_data = doc.tobytes(**STRUCTURE_OPTIONS)
+            else:
+                doc.save(output_path, **STRUCTURE_OPTIONS)
+
+        if output_path is None:
+            if len(output_data) < size:
+                return output_data
+            if isinstance(source, str):
+                with open(source, 'rb') as f:
+                    return f.read()
+            return bytes(source)
+        if os.path.getsize(output_path) >= size:
+            if isinstance(source, str):
+                shutil.copyfile(source, output_path)
+            else:
+                self.save_output(source, output_path)
+        return output_path
+
+    def _merge_pages(self, source, rendered, page_numbers, output_path=None):
+        """
+        Rebuild the whole document from the rendered PDF of the pages in
+        page_numbers, copying every other page through from the input
+        untouched with insert_pdf. Returns PDF data, or output_path once
+        written there.
+        """
+        selected = {page_num: index for index, page_num in enumerate(page_numbers)}
+        with open_document(source) as original, open_document(rendered) as pages, fitz.open() as doc:
+            # Consecutive pages from the same document are inserted in one call
+            runs = []
+            for page_num in range(len(original)):
+                document, index = (pages, selected[page_num]) if page_num in selected else (original, page_num)
+                if runs and runs[-1][0] is document and runs[-1][2] == index - 1:
+                    runs[-1][2] = index
+                else:
+                    runs.append([document, index, index])
+            for document, first, last in runs:
+                doc.insert_pdf(document, from_page=first, to_page=last)
+            if output_path is None:
+                return doc.tobytes(garbage=3, deflate=True)
+            doc.save(output_path, garbage=3, deflate=True)
+        return output_path
+
+    def _stage_path(self, final, output_path):
+        """Where a PDF stage writes: the output itself, a temporary file, or memory (None)."""
+        if final or output_path is None:
+            return output_path
+        return self._get_temp_file('.pdf')
+
+    def _release_stage(self, stage_output):
+        """Delete a stage's temporary file once the next stage has read it."""
+        if isinstance(stage_output, str) and stage_output in self.temp_files:
+            os.remove(stage_output)
+            self.temp_files.remove(stage_output)
+
+    def _pdf_pipeline(self, source, output_path, mode, dpi, workers, chunk_size, max_in_flight, params, direct,
+                      adaptive, optimize_structure, page_numbers=None, qualities=None):
+        """
+        PDF output: the mode's own stage; with a page selection in raster
+        and mrc modes, a merge with the pages that were not rendered; then
+        the structural pass (the only stage in 'lossless' mode). Each stage
+        is timed and its output size recorded in stats['stages']. Returns
+        PDF data, or None once written to output_path.
+        """
+        stages = self.stats['stages'] = {}
+        self.stats['input_bytes'] = os.path.getsize(source) if isinstance(source, str) else len(source)
+        merge = page_numbers is not None and mode in ('raster', 'mrc')
+        structure = mode == 'lossless' or optimize_structure
+        stage_output = source
+
+        def finish(name, start, output):
+            size = os.path.getsize(output) if isinstance(output, str) else len(output)
+            stages[name] = dict(seconds=round(time.perf_counter() - start, 3), bytes=size)
+            return output
+
+        if mode != 'lossless':
+            start = time.perf_counter()
+            final = not (merge or structure)
+            if mode == 'smart':
+                stage_output = self._recompress_pdf(source, params['quality'], dpi, page_numbers)
+                if final and output_path is not None:
+                    self.save_output(stage_output, output_path)
+                    stage_output = output_path
+            else:
+                # Streamed straight into the output when no other stage follows
+                stage_path = self._stage_path(final, output_path)
+                with (open(stage_path, 'wb') if stage_path else BytesIO()) as sink:
+                    self._stream_pdf(source, sink, dpi, workers, chunk_size, max_in_flight, params, direct,
+                                     adaptive, mode == 'mrc', page_numbers, qualities)
+                    stage_output = stage_path or sink.getvalue()
+            stage_output = finish(mode, start, stage_output)
+
+        if merge:
+            start = time.perf_counter()
+            merged = self._merge_pages(source, stage_output, page_numbers, self._stage_path(not structure, output_path))
+            self._release_stage(stage_output)
+            stage_output = finish('merge', start, merged)
+
+        if structure:
+            start = time.perf_counter()
+            try:
+                output_data = self._optimize_structure(stage_output, output_path)
+            finally:
+                self._release_stage(stage_output)
+            stage_output = finish('structure', start, output_data)
+        return None if output_path is not None else stage_output
+
+    def _stream_pdf(self, source, sink, dpi, workers, chunk_size, max_in_flight, params, direct=True,
+                    adaptive=False, mrc=False, page_numbers=None, qualities=None):
+        """
+        Raster pipeline for PDF output: render -> compress -> append -> release.
+        Pages are written to the sink in order as soon as they are ready.
+        Blank pages become flat fills and repeated pages share one XObject.
+        """
+        writer = PdfStreamWriter(sink)
+        page_classes = {'bitonal': 0, 'gray': 0, 'color': 0}
+        mask_bytes = background_bytes = foreground_bytes = 0
+        blank_pages = duplicate_bytes = 0
+        with PeakMemory() as memory:
+            for page_size, size, mode, data, digest in self._iter_pages(source, dpi, workers, chunk_size,
+                                                                        max_in_flight, params, 'pdf', direct,
+                                                                        adaptive, mrc, page_numbers,
+                                                                        qualities):
+                if mode == 'FILL':
+                    writer.add_fill_page(page_size, data)
+                    blank_pages += 1
+                    continue
+                reused = writer.reused
+                if mode == 'MRC':
+                    writer.add_mrc_page(page_size, *data, key=digest)
+                    background, mask, color = data
+                    layer = len(color[0]) if isinstance(color[0], (bytes, bytearray)) else 0
+                    encoded_bytes = len(background[0]) + (len(mask[0]) if mask else 0) + layer
+                    if writer.reused == reused:
+                        background_bytes += len(background[0])
+                        mask_bytes += len(mask[0]) if mask else 0
+                        foreground_bytes += layer
+                else:
+                    writer.add_image_page(data, size, mode, page_size,
+                                          '/FlateDecode' if mode == '1' else '/DCTDecode', key=digest)
+                    encoded_bytes = len(data)
+                    page_classes[PAGE_CLASSES.get(mode, 'color')] += 1
+                if writer.reused > reused:
+                    duplicate_bytes += encoded_bytes
+            writer.close()
+        self.stats.update(peak_memory=memory.peak, blank_pages=blank_pages, duplicate_pages=writer.reused,
+                          duplicate_bytes=duplicate_bytes)
+        if adaptive:
+            self.stats['page_classes'] = page_classes
+        if mrc:
+            self.stats.update(mask_bytes=mask_bytes, background_bytes=background_bytes,
+                              foreground_bytes=foreground_bytes)
+
+    def _unselected_bytes(self, doc, page_numbers):
+        """Size of the pages outside page_numbers on their own, as the structural pass saves them."""
+        selected = set(page_numbers)
+        with fitz.open() as rest:
+            for page_num in range(len(doc)):
+                if page_num not in selected:
+                    rest.insert_pdf(doc, from_page=page_num, to_page=page_num)
+            return len(rest.tobytes(**STRUCTURE_OPTIONS))
+
+    def _plan_qualities(self, source, dpi, workers, params, output_format, container, target_bytes,
+                        min_quality, page_numbers=None):
+        """
+        Rate control for target_bytes. Every page is rendered once and
+        encoded at a few qualities (the whole page at one, a sample mosaic at
+        all) to fit its size and distortion curves; each page then gets the
+        quality from min_quality to params['quality'] that minimizes the total
+        distortion, weighted by page pixels, within the budget left after
+        TARGET_MARGIN, container overhead and any pages copied through.
+
+        Returns {page_num: quality}; the prediction goes to stats.
+        """
+        start = time.perf_counter()
+        settings = list(range(min(min_quality, params['quality']), params['quality'] + 1))
+        points = curve_qualities(settings[0], settings[-1])
+        backend = self.backend
+        with open_document(source) as doc:
+            numbers = list(range(len(doc))) if page_numbers is None else page_numbers
+            fixed = TARGET_PAGE_OVERHEAD[container] * len(numbers)
+            if output_format == 'pdf' and page_numbers is not None:
+                fixed += self._unselected_bytes(doc, page_numbers)
+            workers = max(1, min(workers or os.cpu_count() or 1, len(numbers)))
+            if workers == 1 or len(numbers) < PARALLEL_MIN_PAGES:
+                samples = [_sample_page(doc, page_num, dpi, backend, params, output_format, points)
+                           for page_num in numbers]
+
+        if workers > 1 and len(numbers) >= PARALLEL_MIN_PAGES:
+            input_path = self._source_path(source)
+            chunk_size = max(1, math.ceil(len(numbers) / (workers * 4)))
+            chunks = [numbers[first:first + chunk_size] for first in range(0, len(numbers), chunk_size)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                samples = list(itertools.chain.from_iterable(executor.map(
+                    _sample_page_range, itertools.repeat(input_path), chunks, itertools.repeat(dpi),
+                    itertools.repeat(backend), itertools.repeat(params), itertools.repeat(output_format),
+                    itertools.repeat(points))))
+
+        # Blank pages have nothing to lose and a fixed cost (a fill in PDF
+        # output, a solid image otherwise); in PDF output repeats cost
+        # nothing either, as they share the first copy's image
+        sizes = np.zeros((len(numbers), len(settings)))
+        distortions = np.zeros_like(sizes)
+        weights = np.zeros(len(numbers))
+        first_rows = {}
+        repeats = {}
+        for row, sample in enumerate(samples):
+            if not isinstance(sample, tuple):
+                fixed += sample
+                continue
+            curve, pixels, digest = sample
+            if output_format == 'pdf' and digest in first_rows:
+                repeats[row] = first_rows[digest]
+                continue
+            first_rows[digest] = row
+            weights[row] = pixels
+            sizes[row], distortions[row] = fit_curve(curve, settings)
+        choice, predicted = allocate(sizes, distortions, weights, target_bytes * (1 - TARGET_MARGIN) - fixed)
+        for row, first_row in repeats.items():
+            choice[row] = choice[first_row]
+
+        qualities = {page_num: settings[index] for page_num, index in zip(numbers, choice)}
+        self.stats.update(target_bytes=target_bytes, predicted_bytes=int(round(predicted + fixed)),
+                          page_qualities={page_num + 1: quality for page_num, quality in qualities.items()},
+                          rate_control=dict(seconds=round(time.perf_counter() - start, 3),
+                                            samples=sum(isinstance(sample, tuple) for sample in samples),
+                                            qualities=points))
+        return qualities
+
     def process_pdf(self, pdf_path=None, pdf_data=None, output_format='pdf', 
                quality=85, resize=None, strip_metadata=True, colors=256, 
-               optimize=True, dpi=200):
+               optimize=True, dpi=200, mode='raster', workers=None, chunk_size=None,
+               output_path=None, max_in_flight=None, direct=True, archive='zip', adaptive=False,
+               optimize_structure=True, pages=None, target_bytes=None, min_quality=10):
         """
         Process a PDF by splitting into images, compressing each image, and 
         combining based on output format.
-        
+
+        In 'smart' mode (PDF output only) pages are not rasterized: each
+        embedded image is downsampled to `dpi` at its largest placement and
+        re-encoded in place, so text stays searchable and vectors sharp.
+        In 'extract' mode (image output only) the embedded images are saved
+        instead of the pages; JPEG and JPEG 2000 streams are not re-encoded.
+        'mrc' mode (PDF output only, meant for scans) renders each page at
+        `dpi` and stores it as a CCITT G4 text mask painted over a JPEG
+        background at a third of that resolution, in the text's color or,
+        when the text has several colors, through a low-resolution JPEG
+        color layer.
+
+        Rendered pages that are blank get a flat fill (or a solid image)
+        instead of an encoded render, and pixel-identical pages are encoded
+        once and share one image; smart mode merges identical embedded
+        images. stats reports blank_pages, duplicate_pages or images_duplicate,
+        and duplicate_bytes.
+
+        Every PDF pipeline ends with a lossless structural pass: fonts are
+        subset, unused and duplicate objects dropped, uncompressed streams
+        deflated and objects packed into object streams. 'lossless' mode runs
+        only that pass. stats['stages'] has the seconds and output bytes of
+        each stage.
+
+        With target_bytes (raster mode with JPEG pages: PDF, jpg or webp
+        output), quality becomes an upper bound: every page is first sampled
+        at a few qualities, then each page gets its own quality so that the
+        total distortion is lowest for the predicted output size. Busy pages
+        give up quality where it costs the most bytes. stats reports
+        target_bytes, predicted_bytes, actual_bytes, target_met and
+        page_qualities (by 1-based page number).
+
         Args:
             pdf_path: Path to input PDF file
-            pdf_data: PDF file data as bytes
+            pdf_data: PDF data as bytes, bytearray, mmap or memoryview, a BytesIO, or
+                an open binary file (memory-mapped); used in place, never copied
+                (streams with no file behind them are read)
             output_format: 'pdf' to return PDF, or image format ('png', 'jpg', etc.)
             quality: Quality setting (1-100)
             resize: Optional (width, height) to resize images
             strip_metadata: Whether to remove metadata
             colors: Maximum number of colors
             optimize: Whether to optimize output
-            dpi: Resolution for PDF to image conversion
+            dpi: Resolution for PDF to image conversion (smart mode: image resolution cap)
+            mode: 'raster', 'smart', 'extract', 'mrc' or 'lossless'
+            workers: Processes used to render pages (defaults to the CPU count)
+            chunk_size: Pages rendered per task (defaults to a few tasks per worker)
+            output_path: Write the output to this file instead of returning bytes;
+                PDF and zip output is streamed page by page. PDF output may
+                replace pdf_path itself; it is swapped in once complete
+            max_in_flight: Pages being processed at once with several workers
+                (defaults to two chunks per worker); bounds memory
+            direct: Encode each page once in the target format; False keeps the
+                older compress-to-PNG-then-convert path
+            archive: Image output container, 'zip' or 'directory' (writes plain
+                files into output_path; not cached)
+            adaptive: Classify each page from a low-resolution render as bitonal
+                text, grayscale or color, and render it at a DPI and colorspace
+                to match (1-bit, gray or RGB; `dpi` is the grayscale DPI)
+            optimize_structure: Finish PDF output with the lossless structural pass
+            pages: Only process these pages (see select_pages): a page number, an
+                iterable of them, a slice, a predicate, or a string like '1-5, 8'.
+                Other pages are never rendered; PDF output copies them through
+                unchanged, image output leaves them out
+            target_bytes: Optional size budget for the whole output in bytes
+            min_quality: Lowest quality target_bytes may give a page
             
         Returns:
-            Bytes of the output file (PDF or zip of images)
+            Bytes of the output file (PDF or zip of images), or output_path
+            when one is given
         """
         # Normalize output format
         output_format = output_format.lower()
         if output_format == 'jpg':
             output_format = 'jpeg'  
+        if mode not in PDF_MODES:
+            raise ValueError(f"Unknown PDF mode: {mode}")
+        if mode in ('smart', 'mrc', 'lossless') and output_format != 'pdf':
+            raise ValueError(f"{mode.capitalize()} mode only produces PDF output")
+        if mode == 'extract' and output_format == 'pdf':
+            raise ValueError("Extract mode only produces image output")
+        if archive not in ARCHIVE_KINDS:
+            raise ValueError(f"Unknown archive kind: {archive}")
+        directory_output = archive == 'directory' and output_format != 'pdf'
+        if directory_output and output_path is None:
+            raise ValueError("Directory output needs an output_path")
+        if target_bytes is not None:
+            if mode != 'raster' or adaptive or not direct or resize:
+                raise ValueError("target_bytes needs raster mode without adaptive, resize or direct=False")
+            if output_format != 'pdf' and output_format not in LOSSY_FORMATS:
+                raise ValueError(f"target_bytes needs PDF or lossy image output, not {output_format}")
+            if target_bytes <= 0:
+                raise ValueError("target_bytes must be positive")
         
-        input_path = self._ensure_pdf_file(pdf_path, pdf_data)
+        # Opened by path, or straight from memory; the input is never copied
+        source, input_map = self._input_source(pdf_path, pdf_data)
+        try:
+
+            page_numbers = page_count = None
+            if pages is not None:
+                if mode == 'lossless':
+                    raise ValueError("Lossless mode always optimizes the whole document")
+                with open_document(source) as doc:
+                    page_count = len(doc)
+                page_numbers = select_pages(pages, page_count)
+                if not page_numbers:
+                    raise ValueError("No pages selected")
+                if len(page_numbers) == page_count:
+                    page_numbers = None
         
-        # Convert PDF to individual images
-        image_paths = self._convert_pdf_to_images(input_path, dpi)
+            cache_key = None
+            if self.cache is not None and not directory_output:
+                cache_key = self.cache.make_key(
+                    source,
+                    dict(output_format=output_format, quality=quality, resize=resize,
+                         strip_metadata=strip_metadata, colors=colors, optimize=optimize, dpi=dpi, mode=mode,
+                         direct=direct, adaptive=adaptive, optimize_structure=optimize_structure,
+                         pages=None if page_numbers is None else tuple(page_numbers),
+                         target_bytes=target_bytes, min_quality=min_quality if target_bytes else None),
+                    self.engine_version()
+                )
+                if output_path is not None:
+                    if self.cache.get_file(cache_key, output_path):
+                        self.stats = {'cache_hit': True}
+                        return output_path
+                else:
+                    output_data = self.cache.get(cache_key)
+                    if output_data is not None:
+                        self.stats = {'cache_hit': True}
+                        return output_data
+            self.stats = {'cache_hit': False} if cache_key else {}
+            if page_numbers is not None:
+                self.stats['pages_skipped'] = page_count - len(page_numbers)
         
-        # Compress each image
-        compressed_images = self._compress_images(
-            image_paths,
-            output_format='png',  # Always convert to PNG first for quality
-            quality=quality,
-            resize=resize,
-            strip_metadata=strip_metadata,
-            colors=colors,
-            optimize=optimize
-        )
+            params = dict(quality=quality, resize=resize, strip_metadata=strip_metadata,
+                          colors=colors, optimize=optimize)
+            qualities = None
+            if target_bytes is not None:
+                container = 'pdf' if output_format == 'pdf' else archive
+                qualities = self._plan_qualities(source, dpi, workers, params, output_format, container,
+                                                 target_bytes, min_quality, page_numbers)
         
-        # Create output based on requested format
-        if output_format == 'pdf':
-            # Convert images back to PDF
-            output_data = self._create_pdf_from_images(compressed_images)
-        else:
-            # If requesting specific image format, convert each image
-            if output_format != 'png':
-                converted_images = []
-                for img_data in compressed_images:
-                    # Convert from PNG to requested format
-                    img = Image.open(BytesIO(img_data))
-                    img_buffer = BytesIO()
-                    # Use uppercase format for PIL
-                    img.save(img_buffer, format=output_format.upper(), quality=quality)
-                    converted_images.append(img_buffer.getvalue())
-                compressed_images = converted_images
-            
-            # Create zip file of images
-            output_data = self._create_zip_from_images(compressed_images, output_format)
+            if output_format == 'pdf':
+                pipeline_path = output_path
+                if (output_path is not None and isinstance(source, str) and os.path.exists(output_path)
+                        and os.path.samefile(source, output_path)):
+                    # Every stage reads the input while writing; build the output beside it and swap it in
+                    pipeline_path = self._get_temp_file('.pdf', os.path.dirname(os.path.abspath(output_path)))
+                output_data = self._pdf_pipeline(source, pipeline_path, mode, dpi, workers, chunk_size, max_in_flight,
+                                                 params, direct, adaptive, optimize_structure, page_numbers,
+                                                 qualities)
+                if pipeline_path != output_path:
+                    os.replace(pipeline_path, output_path)
+                    self.temp_files.remove(pipeline_path)
+                if target_bytes is not None:
+                    self._report_target(output_path, output_data)
+                return self._finish_output(cache_key, output_path, output_data)
+        
+            if mode == 'extract':
+                entries = self._iter_embedded_images(source, output_format, params, page_numbers)
+            else:
+                rendered = self._iter_pages(source, dpi, workers, chunk_size, max_in_flight, params,
+                                            output_format, direct, adaptive, page_numbers=page_numbers,
+                                            qualities=qualities)
+                entries = self._page_entries(rendered, output_format, page_numbers)
         
+            output_data = None
+            if directory_output:
+                self._write_archive(DirectoryWriter(output_path), entries)
+                if target_bytes is not None:
+                    # The budget of plain files is their bytes; there is no container
+                    self.stats.update(actual_bytes=self.stats['page_bytes'],
+                                      target_met=self.stats['page_bytes'] <= target_bytes)
+                return output_path
+            if output_path is not None:
+                with open(output_path, 'wb') as sink:
+                    self._write_archive(ZipStreamWriter(sink), entries)
+            else:
+                sink = BytesIO()
+                self._write_archive(ZipStreamWriter(sink), entries)
+                output_data = sink.getvalue()
+            if target_bytes is not None:
+                self._report_target(output_path, output_data)
+            return self._finish_output(cache_key, output_path, output_data)
+        finally:
+            # Let go of the input; after an error a document may still hold it
+            # until it is collected, and then so does the map
+            try:
+                if isinstance(source, memoryview):
+                    source.release()
+                if input_map is not None:
+                    input_map.close()
+            except BufferError:
+                pass
+
+    def _report_target(self, output_path, output_data):
+        """Record the actual output size next to the target_bytes prediction."""
+        size = os.path.getsize(output_path) if output_data is None else len(output_data)
+        self.stats.update(actual_bytes=size, target_met=size <= self.stats['target_bytes'])
+    
+    def _finish_output(self, cache_key, output_path, output_data):
+        """Store the result in the cache and return what process_pdf returns."""
+        if output_path is not None:
+            if cache_key is not None:
+                self.cache.put_file(cache_key, output_path)
+            return output_path
+        if cache_key is not None:
+            self.cache.put(cache_key, output_data)
         return output_data
     
+    def engine_version(self):
+        return f'pdf-{ENGINE_VERSION}/pymupdf-{fitz.VersionBind}/{self.compressor.engine_version()}'
+    
     def save_output(self, output_data, output_path):
         """Save the processed output to a file."""
         with open(output_path, 'wb') as f:
             f.write(output_data)
-
-class ImageCompressor:
-    def __init__(self, image_path=None, image_data=None):
-        if image_path is None and image_data is None:
-            raise ValueError("Either image_path or image_data must be provided")
-            
-        self.image_path = image_path
-        self.image_data = image_data
-        self.temp_files = []
-        
-    def __del__(self):
-        if hasattr(self, 'temp_files'):
-            for temp_file in self.temp_files:
-                try:
-                    os.remove(temp_file)
-                except Exception as e:
-                    print(f"Failed to delete temporary file {temp_file}: {e}")
-    
-    def _get_temp_file(self, extension):
-        temp_file = tempfile.NamedTemporaryFile(suffix=extension, delete=False)
-        temp_file.close()
-        self.temp_files.append(temp_file.name)
-        return temp_file.name
-    
-    def _ensure_image_file(self):
-        if self.image_path:
-            return self.image_path
-        elif self.image_data:
-            temp_path = self._get_temp_file('.png')
-            with open(temp_path, 'wb') as f:
-                f.write(self.image_data)
-            return temp_path
-        return None
-    
-    def process_image(self, output_format='png', quality=85, resize=None, strip_metadata=True, colors=256, optimize=True):
-        input_path = self._ensure_image_file()
-        output_path = self._get_temp_file(f'.{output_format}')
-        command = ['magick', input_path]
-        
-        if resize:
-            command.extend(['-resize', f'{resize[0]}x{resize[1]}'])
-        if strip_metadata:
-            command.append('-strip')
-        if colors:
-            command.extend(['-colors', str(colors)])
-        if optimize:
-            if output_format.lower() in ['jpg', 'jpeg']:
-                command.extend(['-interlace', 'JPEG']) 
-        
-        command.extend(['-quality', str(quality), output_path])
-        
-        try:
-            result = subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            with open(output_path, 'rb') as f:
-                return f.read()
-        except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"ImageMagick processing failed: {e.stderr.decode()}") from e
-    
-    def get_pil_image(self, **kwargs):
-        image_data = self.process_image(**kwargs)
-        return Image.open(BytesIO(image_data))
-    
-    def save_to_file(self, output_path, **kwargs):
-        image_data = self.process_image(**kwargs)
-        with open(output_path, 'wb') as f:
-            f.write(image_data)
\ No newline at end of file
@@ -0,0 +1,185 @@
+import zlib
+
+# Image modes that map straight onto PDF device colour spaces ('1' is 1-bit gray)
+COLORSPACES = {'1': '/DeviceGray', 'L': '/DeviceGray', 'RGB': '/DeviceRGB', 'CMYK': '/DeviceCMYK'}
+
+
+class PdfStreamWriter:
+    """
+    Write a PDF of image pages to a file object one page at a time.
+
+    Each page's objects are written as soon as the page is added; only the
+    object offsets are kept, so memory does not grow with page count.
+    Pages added with the same key share their image XObjects.
+
+    Args:
+        sink: Binary file object opened for writing
+    """
+
+    # Objects 1 and 2 are the catalog and the page tree, written on close
+    CATALOG = 1
+    PAGES = 2
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.offsets = {}
+        self.page_refs = []
+        # Image object numbers by page key, for pages that repeat
+        self.images = {}
+        self.reused = 0
+        self.next_object = 3
+        self.position = 0
+        self._write(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+
+    def _write(self, data):
+        self.sink.write(data)
+        self.position += len(data)
+
+    def _begin(self, number=None):
+        if number is None:
+            number = self.next_object
+            self.next_object += 1
+        self.offsets[number] = self.position
+        self._write(f'{number} 0 obj\n'.encode())
+        return number
+
+    def _object(self, body, number=None):
+        number = self._begin(number)
+        self._write(body.encode() + b'\nendobj\n')
+        return number
+
+    def _stream(self, dictionary, data):
+        number = self._begin()
+        self._write(f'<< {dictionary} /Length {len(data)} >>\nstream\n'.encode())
+        self._write(data)
+        self._write(b'\nendstream\nendobj\n')
+        return number
+
+    def _image(self, data, size, mode, filter_name, smask=None, decode_parms=None, mask_ref=None):
+        """Write an image XObject and return its object number; mask_ref is a stencil to paint it through."""
+        width, height = size
+        image = (f'/Type /XObject /Subtype /Image /Width {width} /Height {height} '
+                 f'/ColorSpace {COLORSPACES[mode]} /BitsPerComponent {1 if mode == "1" else 8} '
+                 f'/Filter {filter_name}')
+        if decode_parms is not None:
+            image += f' /DecodeParms {decode_parms}'
+        if mode == 'CMYK' and filter_name == '/DCTDecode':
+            # Adobe writes CMYK JPEGs inverted
+            image += ' /Decode [1 0 1 0 1 0 1 0]'
+        if smask is not None:
+            mask = self._stream(f'/Type /XObject /Subtype /Image /Width {width} /Height {height} '
+                                f'/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter {smask[1]}', smask[0])
+            image += f' /SMask {mask} 0 R'
+        if mask_ref is not None:
+            image += f' /Mask {mask_ref} 0 R'
+        return self._stream(image, data)
+
+    def _page(self, page_size, image_refs, content):
+        """Write a page drawing the given image XObjects (named /Im0, /Im1, ...) with content."""
+        page_width, page_height = page_size
+        content_ref = self._stream('/Filter /FlateDecode', zlib.compress(content.encode()))
+        xobjects = ' '.join(f'/Im{i} {ref} 0 R' for i, ref in enumerate(image_refs))
+        page_ref = self._object(
+            f'<< /Type /Page /Parent {self.PAGES} 0 R /MediaBox [0 0 {page_width:.4f} {page_height:.4f}] '
+            f'/Resources << /XObject << {xobjects} >> >> /Contents {content_ref} 0 R >>'
+        )
+        self.page_refs.append(page_ref)
+
+    def _shared(self, key):
+        """Image object numbers already written for key, or None."""
+        image_refs = self.images.get(key) if key is not None else None
+        if image_refs is not None:
+            self.reused += 1
+        return image_refs
+
+    def add_image_page(self, data, size, mode, page_size, filter_name='/DCTDecode', smask=None,
+                       decode_parms=None, placement=None, key=None):
+        """
+        Append a page showing one image, scaled to the whole page by default.
+
+        Args:
+            data: Encoded image stream (JPEG data for /DCTDecode, raw samples for /FlateDecode)
+            size: Image (width, height) in pixels
+            mode: 'L', 'RGB', 'CMYK', or '1' for packed 1-bit rows (0 is black)
+            page_size: Page (width, height) in points
+            filter_name: PDF filter the data is encoded with
+            smask: Optional (data, filter_name) of an 8-bit gray soft mask with the same size
+            decode_parms: Optional /DecodeParms dictionary, e.g. PNG predictors for /FlateDecode
+            placement: Optional (x, y, width, height) in points to draw the image at
+            key: Optional hashable; a later page with the same key reuses this image
+        """
+        image_refs = self._shared(key)
+        if image_refs is None:
+            image_refs = [self._image(data, size, mode, filter_name, smask, decode_parms)]
+            if key is not None:
+                self.images[key] = image_refs
+        x, y, draw_width, draw_height = placement or (0, 0) + tuple(page_size)
+        self._page(page_size, image_refs,
+                   f'q {draw_width:.4f} 0 0 {draw_height:.4f} {x:.4f} {y:.4f} cm /Im0 Do Q')
+
+    def add_mrc_page(self, page_size, background, mask=None, color=(0, 0, 0), key=None):
+        """
+        Append a mixed raster content page: a background image scaled to the
+        whole page, with a 1-bit stencil mask painted over it in one color or
+        cut out of a foreground color layer.
+
+        Args:
+            page_size: Page (width, height) in points
+            background: (data, size, mode) of the JPEG background layer
+            mask: Optional (data, size, filter_name, decode_parms) stencil mask;
+                samples of 0 are painted
+            color: (r, g, b) fill color of the mask, each 0..1, or (data, size,
+                mode) of a JPEG foreground layer shown where the mask paints
+            key: Optional hashable; a later page with the same key reuses all layers
+        """
+        page_width, page_height = page_size
+        placement = f'{page_width:.4f} 0 0 {page_height:.4f} 0 0 cm'
+        layered = isinstance(color[0], (bytes, bytearray))
+        image_refs = self._shared(key)
+        if image_refs is None:
+            image_refs = [self._image(*background, '/DCTDecode')]
+            if mask is not None:
+                data, (width, height), filter_name, decode_parms = mask
+                dictionary = (f'/Type /XObject /Subtype /Image /Width {width} /Height {height} '
+                              f'/ImageMask true /BitsPerComponent 1 /Filter {filter_name}')
+                if decode_parms is not None:
+                    dictionary += f' /DecodeParms {decode_parms}'
+                mask_ref = self._stream(dictionary, data)
+                # A foreground layer carries the mask; a single color paints it as a stencil
+                image_refs.append(self._image(*color, '/DCTDecode', mask_ref=mask_ref) if layered else mask_ref)
+            if key is not None:
+                self.images[key] = image_refs
+        content = f'q {placement} /Im0 Do Q'
+        if mask is not None and layered:
+            content += f' q {placement} /Im1 Do Q'
+        elif mask is not None:
+            red, green, blue = color
+            content += f' q {red:.3f} {green:.3f} {blue:.3f} rg {placement} /Im1 Do Q'
+        self._page(page_size, image_refs, content)
+
+    def add_fill_page(self, page_size, color=(1, 1, 1)):
+        """
+        Append a page that is a single flat color, with no image at all.
+
+        Args:
+            page_size: Page (width, height) in points
+            color: (r, g, b) fill color, each 0..1
+        """
+        page_width, page_height = page_size
+        red, green, blue = color
+        self._page(page_size, [],
+                   f'{red:.3f} {green:.3f} {blue:.3f} rg 0 0 {page_width:.4f} {page_height:.4f} re f')
+
+    def close(self):
+        """Write the page tree, catalog, cross-reference table and trailer."""
+        kids = ' '.join(f'{ref} 0 R' for ref in self.page_refs)
+        self._object(f'<< /Type /Pages /Kids [{kids}] /Count {len(self.page_refs)} >>', self.PAGES)
+        self._object(f'<< /Type /Catalog /Pages {self.PAGES} 0 R >>', self.CATALOG)
+
+        xref_offset = self.position
+        count = self.next_object
+        lines = [f'xref\n0 {count}\n', '0000000000 65535 f \n']
+        for number in range(1, count):
+            lines.append(f'{self.offsets[number]:010d} 00000 n \n')
+        self._write(''.join(lines).encode())
+        self._write(f'trailer\n<< /Size {count} /Root {self.CATALOG} 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n'.encode())
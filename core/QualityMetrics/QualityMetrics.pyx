@@ -0,0 +1,77 @@
+import numpy as np
+
+# SSIM stabilizers for 8-bit data (Wang et al. 2004)
+C1 = (0.01 * 255) ** 2
+C2 = (0.03 * 255) ** 2
+
+# Full-resolution tiles sampled for the metric: TILE_GRID x TILE_GRID tiles
+# of TILE_SIZE pixels, so the cost is bounded regardless of image size
+TILE_SIZE = 192
+TILE_GRID = 4
+
+
+def _box_mean(values, window):
+    """Mean over every window x window block, via a summed-area table."""
+    padded = np.zeros((values.shape[0] + 1, values.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(values, axis=0), axis=1, out=padded[1:, 1:])
+    total = (padded[window:, window:] - padded[:-window, window:]
+             - padded[window:, :-window] + padded[:-window, :-window])
+    return total / (window * window)
+
+
+def ssim(reference, test, window=8):
+    """
+    Mean SSIM of two equally sized grayscale float arrays, using a box
+    window instead of a Gaussian so every statistic is a summed-area lookup.
+    """
+    if reference.shape != test.shape:
+        raise ValueError("SSIM inputs must have the same shape")
+    window = min(window, reference.shape[0], reference.shape[1])
+    mu_x = _box_mean(reference, window)
+    mu_y = _box_mean(test, window)
+    var_x = _box_mean(reference * reference, window) - mu_x * mu_x
+    var_y = _box_mean(test * test, window) - mu_y * mu_y
+    cov = _box_mean(reference * test, window) - mu_x * mu_y
+    numerator = (2 * mu_x * mu_y + C1) * (2 * cov + C2)
+    denominator = (mu_x * mu_x + mu_y * mu_y + C1) * (var_x + var_y + C2)
+    return float(np.mean(numerator / denominator))
+
+
+def _halve(values):
+    height, width = values.shape[0] // 2 * 2, values.shape[1] // 2 * 2
+    v = values[:height, :width]
+    return (v[0::2, 0::2] + v[1::2, 0::2] + v[0::2, 1::2] + v[1::2, 1::2]) / 4.0
+
+
+def pyramid_ssim(reference, test, levels=3, window=8):
+    """
+    SSIM averaged over a 2x downscaled pyramid, so both fine detail and
+    larger structures count. Inputs are grayscale float arrays.
+    """
+    scores = []
+    for level in range(levels):
+        if scores and min(reference.shape) < window:
+            break
+        scores.append(ssim(reference, test, window))
+        if level + 1 < levels:
+            reference, test = _halve(reference), _halve(test)
+    return float(np.mean(scores))
+
+
+def tile_boxes(size, tile=TILE_SIZE, grid=TILE_GRID):
+    """Evenly spread crop boxes covering the image at full resolution."""
+    width, height = size
+    tile_w, tile_h = min(tile, width), min(tile, height)
+    xs = np.linspace(0, width - tile_w, grid).round().astype(int)
+    ys = np.linspace(0, height - tile_h, grid).round().astype(int)
+    return sorted({(int(x), int(y), int(x) + tile_w, int(y) + tile_h) for x in xs for y in ys})
+
+
+def sample_tiles(img, boxes):
+    """Grayscale float arrays of img cropped to each box (only the crops are converted)."""
+    return [np.asarray(img.crop(box).convert('L'), dtype=np.float64) for box in boxes]
+
+
+def tiled_ssim(reference_tiles, test_tiles, levels=2):
+    """Mean pyramid SSIM over matching tiles."""
+    return float(np.mean([pyramid_ssim(r, t, levels) for r, t in zip(reference_tiles, test_tiles)]))
@@ -0,0 +1,172 @@
+import numpy as np
+from PIL import Image
+
+# Bits per channel of the RGB -> palette index lookup table (32^3 entries)
+LUT_BITS = 5
+DITHER_MODES = (None, 'none', 'ordered', 'floyd-steinberg')
+# Palette builder of the 'pillow' quantizer for RGB and L images
+PILLOW_METHOD = Image.MEDIANCUT
+
+# 8x8 Bayer matrix, normalized to [-0.5, 0.5)
+_BAYER_8 = np.array([
+    [0, 32, 8, 40, 2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44, 4, 36, 14, 46, 6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [3, 35, 11, 43, 1, 33, 9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47, 7, 39, 13, 45, 5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21],
+], dtype=np.float32) / 64.0 - 0.5
+
+
+def _nearest(points, palette, chunk=65536):
+    """Index of the nearest palette entry for each point (squared Euclidean)."""
+    palette = palette.astype(np.float32)
+    palette_norms = (palette * palette).sum(axis=1)
+    result = np.empty(len(points), dtype=np.intp)
+    for start in range(0, len(points), chunk):
+        block = points[start:start + chunk].astype(np.float32)
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2; |x|^2 does not affect the argmin
+        distances = palette_norms[None, :] - 2.0 * (block @ palette.T)
+        result[start:start + chunk] = distances.argmin(axis=1)
+    return result
+
+
+def build_palette(pixels, colors=256, sample_size=65536, iterations=8, seed=0):
+    """
+    Build a palette with k-means on a random subsample of the pixels.
+
+    Args:
+        pixels: (N, 3) uint8 array
+        colors: Palette size (at most 256)
+        sample_size: Pixels drawn for clustering; cost is independent of image size
+        iterations: Lloyd iterations after k-means++ seeding
+
+    Returns:
+        (K, 3) uint8 palette, K <= colors
+    """
+    rng = np.random.default_rng(seed)
+    if len(pixels) > sample_size:
+        sample = pixels[rng.integers(0, len(pixels), sample_size)]
+    else:
+        sample = pixels
+    sample = sample.astype(np.float32)
+    unique = np.unique(sample, axis=0)
+    if len(unique) <= colors:
+        return unique.astype(np.uint8)
+
+    # k-means++ seeding on a smaller subset keeps this O(colors * subset)
+    seed_pool = sample[rng.integers(0, len(sample), min(len(sample), 4096))]
+    centers = [seed_pool[rng.integers(len(seed_pool))]]
+    nearest = ((seed_pool - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, colors):
+        total = nearest.sum()
+        if total <= 0:
+            break
+        choice = seed_pool[rng.choice(len(seed_pool), p=nearest / total)]
+        centers.append(choice)
+        nearest = np.minimum(nearest, ((seed_pool - choice) ** 2).sum(axis=1))
+    centers = np.array(centers, dtype=np.float32)
+
+    for _ in range(iterations):
+        labels = _nearest(sample, centers)
+        counts = np.bincount(labels, minlength=len(centers)).astype(np.float32)
+        used = counts > 0
+        for channel in range(3):
+            sums = np.bincount(labels, weights=sample[:, channel], minlength=len(centers))
+            centers[used, channel] = sums[used] / counts[used]
+
+    return np.clip(np.rint(centers), 0, 255).astype(np.uint8)
+
+
+def build_lookup(palette):
+    """Precompute the nearest palette index for every cell of a 32^3 RGB grid."""
+    levels = 1 << LUT_BITS
+    step = 256 // levels
+    axis = np.arange(levels, dtype=np.float32) * step + (step - 1) / 2.0
+    grid = np.stack(np.meshgrid(axis, axis, axis, indexing='ij'), axis=-1).reshape(-1, 3)
+    return _nearest(grid, palette).astype(np.uint8)
+
+
+def map_to_palette(rgb, lut):
+    shift = 8 - LUT_BITS
+    r = rgb[..., 0].astype(np.intp) >> shift
+    g = rgb[..., 1].astype(np.intp) >> shift
+    b = rgb[..., 2].astype(np.intp) >> shift
+    return lut[(r << (2 * LUT_BITS)) | (g << LUT_BITS) | b]
+
+
+def _palette_image(palette):
+    palette_img = Image.new('P', (1, 1))
+    flat = palette.reshape(-1).tolist()
+    palette_img.putpalette(flat + [0] * (768 - len(flat)))
+    return palette_img
+
+
+def pillow_palette(pixels, colors=256):
+    """The (K, 3) uint8 palette Pillow's PILLOW_METHOD builds for (N, 3) uint8 pixels."""
+    sample = Image.fromarray(np.ascontiguousarray(pixels, dtype=np.uint8).reshape(1, -1, 3))
+    quantized = sample.quantize(colors=colors, method=PILLOW_METHOD)
+    used = int(np.asarray(quantized).max()) + 1
+    return np.array(quantized.getpalette(), dtype=np.uint8).reshape(-1, 3)[:used]
+
+
+def pillow_map(img, palette):
+    """Map an RGB or L image onto a (K, 3) palette with Pillow: exact nearest color, no dither."""
+    source = img.convert('RGB') if img.mode == 'L' else img
+    return source.quantize(palette=_palette_image(palette), dither=Image.Dither.NONE)
+
+
+def apply_palette(img, palette, dither=None, lut=None, top=0):
+    """
+    Map an RGB or L image onto a (K, 3) palette, returning a P image.
+
+    lut is build_lookup(palette), built here when not given. top is the
+    image's first row within a larger image, so ordered dither stays
+    aligned when an image is mapped in strips.
+    """
+    if dither == 'floyd-steinberg':
+        # Error diffusion is sequential; Pillow's C loop does it against our palette
+        source = img.convert('RGB') if img.mode == 'L' else img
+        return source.quantize(palette=_palette_image(palette), dither=Image.Dither.FLOYDSTEINBERG)
+
+    rgb = np.asarray(img.convert('RGB') if img.mode == 'L' else img)
+    lut = build_lookup(palette) if lut is None else lut
+    if dither == 'ordered':
+        height, width = rgb.shape[:2]
+        # Spread the threshold over the typical gap between palette levels
+        spread = 255.0 / max(1.0, round(len(palette) ** (1.0 / 3.0)))
+        offset = top % 8
+        threshold = np.tile(_BAYER_8, ((height + offset) // 8 + 1, width // 8 + 1))[offset:offset + height, :width]
+        rgb = np.clip(rgb + threshold[..., None] * spread, 0, 255).astype(np.uint8)
+
+    out = Image.fromarray(map_to_palette(rgb, lut))
+    # putpalette turns the L index image into a P image
+    out.putpalette(palette.reshape(-1).tolist())
+    return out
+
+
+def quantize(img, colors=256, dither=None, sample_size=65536, seed=0):
+    """
+    Reduce an RGB or L image to a palette image of at most `colors` entries.
+
+    Args:
+        img: PIL image in RGB or L mode
+        colors: Palette size (2-256)
+        dither: None/'none', 'ordered' (8x8 Bayer) or 'floyd-steinberg'
+        sample_size: Pixels sampled to build the palette
+        seed: Seed for the subsample, so output is reproducible
+
+    Returns:
+        PIL image in P mode
+    """
+    if dither not in DITHER_MODES:
+        raise ValueError(f"Unknown dither mode: {dither}")
+    if img.mode not in ('RGB', 'L'):
+        raise ValueError(f"Quantizer expects RGB or L input, got {img.mode}")
+    colors = max(2, min(256, colors))
+
+    rgb = np.asarray(img.convert('RGB') if img.mode == 'L' else img)
+    palette = build_palette(rgb.reshape(-1, 3), colors, sample_size=sample_size, seed=seed)
+    return apply_palette(img, palette, dither)
@@ -0,0 +1,136 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from core.QualityMetrics.QualityMetrics import ssim
+
+# Qualities each page is trial-encoded at; curves are interpolated in between
+CURVE_POINTS = 4
+
+# The curve shape and distortion come from SAMPLE_GRID x SAMPLE_GRID tiles of
+# SAMPLE_TILE pixels, one centred in each cell of the page so margins are not
+# over-represented; the size level comes from one full-page encode
+SAMPLE_TILE = 48
+SAMPLE_GRID = 8
+
+# Bisection steps on the Lagrange multiplier of the allocation
+LAMBDA_STEPS = 48
+
+
+def curve_qualities(min_quality, max_quality, points=CURVE_POINTS):
+    """Integer qualities spread evenly from min_quality to max_quality."""
+    return sorted({int(round(q)) for q in np.linspace(min_quality, max_quality, points)})
+
+
+def quantizer_scale(quality):
+    """
+    Log of the factor libjpeg scales its quantization tables by at a quality.
+    Size and distortion are much closer to linear in it than in quality itself.
+    """
+    quality = np.asarray(quality, dtype=np.float64)
+    return np.log(np.where(quality < 50, 5000 / np.maximum(quality, 1), 200 - 2 * np.minimum(quality, 99.5)))
+
+
+def sample_boxes(size, tile=SAMPLE_TILE, grid=SAMPLE_GRID):
+    """Crop boxes of one tile centred in each grid cell, aligned to JPEG's 8x8 blocks."""
+    width, height = size
+    tile_w, tile_h = min(tile, width), min(tile, height)
+    boxes = []
+    for row in range(grid):
+        for column in range(grid):
+            x = min(int(width * (column + 0.5) / grid - tile_w / 2) // 8 * 8, width - tile_w)
+            y = min(int(height * (row + 0.5) / grid - tile_h / 2) // 8 * 8, height - tile_h)
+            boxes.append((max(0, x), max(0, y), max(0, x) + tile_w, max(0, y) + tile_h))
+    return boxes
+
+
+def sample_mosaic(img, boxes, grid=SAMPLE_GRID):
+    """Stitch the crops of img at boxes into one image, grid tiles to a row."""
+    tiles = [np.asarray(img.crop(box)) for box in boxes]
+    rows = [np.concatenate(tiles[start:start + grid], axis=1) for start in range(0, len(tiles), grid)]
+    return Image.fromarray(np.concatenate(rows, axis=0))
+
+
+def page_curve(img, qualities, anchor, encode):
+    """
+    Size and distortion of a page over qualities. Returns [(quality, bytes,
+    distortion)], with distortion as 1 - SSIM.
+
+    encode(image, quality) returns encoded bytes. The page is encoded once at
+    `anchor`, one of qualities; the other sizes scale its payload by how the
+    sample mosaic's payload changes, and distortion is measured on the mosaic.
+    Headers and tables, which do not grow with the image, are measured on a
+    single block and kept out of the scaling.
+    """
+    mosaic = sample_mosaic(img, sample_boxes(img.size))
+    block = mosaic.crop((0, 0, 8, 8))
+    reference = np.asarray(mosaic.convert('L'), dtype=np.float64)
+    sampled = {}
+    for quality in qualities:
+        data = encode(mosaic, quality)
+        with Image.open(BytesIO(data)) as decoded:
+            test = np.asarray(decoded.convert('L'), dtype=np.float64)
+        header = len(encode(block, quality))
+        sampled[quality] = header, max(len(data) - header, 1), 1 - ssim(reference, test)
+    anchor_header, anchor_payload, _ = sampled[anchor]
+    page_payload = max(len(encode(img, anchor)) - anchor_header, 1)
+    return [(quality, header + page_payload * payload / anchor_payload, distortion)
+            for quality, (header, payload, distortion) in sorted(sampled.items())]
+
+
+def fit_curve(curve, settings):
+    """
+    Predicted (bytes, distortion) arrays of a page at every quality in settings.
+    Log-size and distortion are interpolated linearly in the quantizer scale
+    between the measured points, then made monotone: more quality never
+    costs fewer bytes or gives more distortion, whatever the measurement noise.
+    """
+    # Negated so the axis increases with quality, as np.interp needs
+    measured = -quantizer_scale([quality for quality, _, _ in curve])
+    settings = -quantizer_scale(settings)
+    sizes = np.exp(np.interp(settings, measured, np.log([size for _, size, _ in curve])))
+    distortions = np.interp(settings, measured, [distortion for _, _, distortion in curve])
+    return np.maximum.accumulate(sizes), np.minimum.accumulate(distortions)
+
+
+def allocate(sizes, distortions, weights, budget):
+    """
+    Pick one setting per page that minimizes the weighted total distortion
+    with the predicted total bytes within budget.
+
+    sizes and distortions are (pages, settings) arrays with settings in
+    increasing quality. Each page independently minimizes distortion +
+    lambda * bytes; lambda is bisected to the smallest value that fits.
+    Returns (setting index per page, predicted bytes). When even the lowest
+    setting overruns the budget, every page gets it.
+    """
+    cost = distortions * np.asarray(weights, dtype=np.float64)[:, None]
+    rows = np.arange(len(sizes))
+
+    def choose(multiplier):
+        choice = np.argmin(cost + multiplier * sizes, axis=1)
+        return choice, float(sizes[rows, choice].sum())
+
+    choice, total = choose(0.0)
+    if total <= budget:
+        return choice, total
+    lowest = np.zeros(len(sizes), dtype=int)
+    if sizes[:, 0].sum() > budget:
+        return lowest, float(sizes[:, 0].sum())
+
+    # Above the steepest distortion saved per byte between neighbouring
+    # settings, no step up pays for its bytes and every page takes its smallest size
+    added_bytes = np.diff(sizes, axis=1)
+    saved = -np.diff(cost, axis=1)
+    slopes = np.divide(saved, added_bytes, out=np.zeros_like(saved), where=added_bytes > 0)
+    low, high = 0.0, 2 * float(slopes.max())
+    best = lowest, float(sizes[:, 0].sum())
+    for _ in range(LAMBDA_STEPS):
+        middle = (low + high) / 2
+        choice, total = choose(middle)
+        if total <= budget:
+            high, best = middle, (choice, total)
+        else:
+            low = middle
+    return best
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+HASH_CHUNK = 1024 * 1024
+
+
+def _default_directory():
+    """Per-user cache location for the platform."""
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'make-it-tiny', 'results')
+
+
+def _normalize(value):
+    """Make parameter values JSON-stable (tuples become lists, other objects their repr)."""
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return repr(value)
+
+
+class ResultCache:
+    """
+    Content-addressed on-disk cache of compression results.
+
+    Keys hash the input bytes, the normalized parameters and the engine
+    version, so a changed file, setting or engine never returns a stale
+    result. Entries are written atomically and evicted least recently used
+    once the cache grows past max_bytes.
+
+    Args:
+        directory: Cache directory (defaults to the per-user cache dir)
+        max_bytes: Size bound for all entries together
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or _default_directory()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = None  # path -> (size, last_used), loaded lazily
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __getstate__(self):
+        # Worker processes get their own counters and lock; callers hand
+        # the counts back to the original with add_counts
+        return {'directory': self.directory, 'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def make_key(self, source, params, engine_version):
+        """
+        Hash the input (a file path or bytes-like data) together with the
+        normalized parameters and engine version.
+        """
+        digest = hashlib.blake2b(digest_size=32)
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, 'rb') as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                    digest.update(chunk)
+        else:
+            digest.update(source)
+        digest.update(b'\0')
+        digest.update(json.dumps(_normalize(params), sort_keys=True).encode())
+        digest.update(b'\0')
+        digest.update(str(engine_version).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                self._index[path] = (st.st_size, st.st_mtime)
+
+    def get(self, key):
+        """Return cached bytes for key, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # mtime doubles as the LRU timestamp, shared with other processes
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if self._index is not None:
+                self._index[path] = (len(data), time.time())
+        return data
+
+    def get_file(self, key, output_path):
+        """Copy the cached entry for key to output_path; False on a miss."""
+        path = self._path(key)
+        try:
+            shutil.copyfile(path, output_path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return False
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if self._index is not None:
+                self._index[path] = (os.path.getsize(path), time.time())
+        return True
+
+    def put(self, key, data):
+        """Store data under key atomically, then evict down to max_bytes."""
+        self._store(key, len(data), lambda f: f.write(data))
+
+    def put_file(self, key, source_path):
+        """Store a copy of the file at source_path under key."""
+        with open(source_path, 'rb') as source:
+            self._store(key, os.fstat(source.fileno()).st_size,
+                        lambda f: shutil.copyfileobj(source, f, HASH_CHUNK))
+
+    def _store(self, key, size, write):
+        if size > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(temp_path, path)
+        except Exception:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            self._load_index()
+            self._index[path] = (size, os.path.getmtime(path))
+            self._evict()
+
+    def _evict(self):
+        total = sum(size for size, _ in self._index.values())
+        if total <= self.max_bytes:
+            return
+        for path, (size, _) in sorted(self._index.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            del self._index[path]
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            self._load_index()
+            for path in list(self._index):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._index = {}
+
+    def add_counts(self, hits, misses):
+        """Add the lookups a copy of this cache counted in another process."""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self):
+        with self._lock:
+            self._load_index()
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._index),
+                'bytes': sum(size for size, _ in self._index.values()),
+            }
+
+
+_default_cache = None
+
+
+def get_default_cache():
+    """Return the shared per-user cache, creating it on first use."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResultCache()
+    return _default_cache
@@ -0,0 +1,654 @@
+import math
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import threading
+import zlib
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from core.Quantizer.Quantizer import apply_palette, build_lookup, build_palette, pillow_map, pillow_palette
+
+DEFAULT_MEMORY_LIMIT = 256 * 1024 * 1024
+
+# Images above this many pixels are routed through the tiled pipeline
+LARGE_IMAGE_PIXELS = 64 * 1024 * 1024
+
+# Decoded bits per pixel for the raw layouts the strip readers understand
+RAW_BITS = {
+    'L': 8, 'P': 8, 'LA': 16, 'RGB': 24, 'BGR': 24,
+    'RGBA': 32, 'BGRA': 32, 'RGBX': 32, 'BGRX': 32, 'CMYK': 32,
+}
+PNG_RAWMODES = ('L', 'LA', 'RGB', 'RGBA', 'P')
+PNG_COLOR_TYPES = {'L': 0, 'RGB': 2, 'P': 3, 'LA': 4, 'RGBA': 6}
+
+# VmHWM above the current RSS by more than this after a reset means it did not happen
+RESET_SLACK = 4 << 20
+
+_bomb_check_lock = threading.Lock()
+
+
+def open_image(source):
+    """
+    Open an image header without Pillow's decompression-bomb limit, since
+    the tiled pipeline exists precisely for very large images.
+    """
+    if isinstance(source, Image.Image):
+        return source
+    with _bomb_check_lock:
+        saved = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                return Image.open(BytesIO(source))
+            return Image.open(source)
+        finally:
+            Image.MAX_IMAGE_PIXELS = saved
+
+
+def _working_mode(img):
+    if img.mode in ('RGB', 'RGBA', 'L', 'LA'):
+        return img.mode
+    return 'RGBA' if 'transparency' in img.info or img.mode.endswith('A') else 'RGB'
+
+
+def _current_rss():
+    """Resident set size of this process in bytes, or None if unknown."""
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            return None
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ('cb', wintypes.DWORD),
+                ('PageFaultCount', wintypes.DWORD),
+                ('PeakWorkingSetSize', ctypes.c_size_t),
+                ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t),
+                ('PeakPagefileUsage', ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+    return None
+
+
+def _high_water_mark():
+    """The kernel's peak RSS of this process (VmHWM) in bytes, or None off Linux."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _reset_high_water_mark():
+    """
+    Restart VmHWM from the current RSS. False where the kernel does not allow
+    it or takes the request without acting on it; VmHWM then stays the peak
+    of the process's whole lifetime and must not be read as a job's peak.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    high_water, rss = _high_water_mark(), _current_rss()
+    # Right after a reset the two agree, up to what changed between the reads
+    return high_water is not None and rss is not None and high_water - rss <= RESET_SLACK
+
+
+# PeakMemory blocks in progress; a reset of VmHWM is folded into them first
+_active_monitors = set()
+_monitors_lock = threading.Lock()
+
+
+class PeakMemory:
+    """
+    Context manager that tracks the process RSS while a job runs.
+
+    After exit, `peak` is the highest resident set size of the whole process
+    during the job, in bytes. It counts everything resident, including memory
+    the process held before the job; allocators reuse freed memory without
+    growing RSS, so it measures the footprint a job needs, not what the job
+    alone allocated. On Linux it is the kernel's exact high-water mark, reset
+    at entry (so earlier, larger jobs do not show through); where that reset
+    is unavailable or has no effect, and off Linux, RSS is sampled every
+    `interval` seconds and short spikes can be missed. `increase` is peak minus the RSS at entry, which is
+    only a lower bound on the job's own memory. Both are None where RSS
+    cannot be read.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.baseline = None
+        self.peak = None
+        self._exact = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        with _monitors_lock:
+            # Resetting VmHWM must not lose an enclosing block's peak
+            high_water = _high_water_mark()
+            for monitor in _active_monitors:
+                monitor._fold(high_water)
+            self._exact = high_water is not None and _reset_high_water_mark()
+            _active_monitors.add(self)
+        self.baseline = _current_rss()
+        self.peak = self.baseline
+        if self.baseline is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def _fold(self, high_water):
+        if self._exact and high_water is not None and self.peak is not None:
+            self.peak = max(self.peak, high_water)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._record()
+
+    def _record(self):
+        rss = _current_rss()
+        if rss is not None and rss > self.peak:
+            self.peak = rss
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._record()
+        with _monitors_lock:
+            _active_monitors.discard(self)
+            self._fold(_high_water_mark())
+
+    @property
+    def increase(self):
+        if self.peak is None or self.baseline is None:
+            return None
+        return self.peak - self.baseline
+
+
+def iter_png_idat(fp, piece_size=1 << 16):
+    """Yield the concatenated zlib stream of a PNG file's IDAT chunks in pieces."""
+    fp.seek(8)
+    while True:
+        head = fp.read(8)
+        if len(head) < 8:
+            return
+        length, chunk_type = struct.unpack('>I4s', head)
+        if chunk_type == b'IDAT':
+            remaining = length
+            while remaining:
+                data = fp.read(min(remaining, piece_size))
+                if not data:
+                    return
+                remaining -= len(data)
+                yield data
+            fp.seek(4, os.SEEK_CUR)
+        elif chunk_type == b'IEND':
+            return
+        else:
+            fp.seek(length + 4, os.SEEK_CUR)
+
+
+class PngStripReader:
+    """
+    Decode a non-interlaced PNG a band of rows at a time.
+
+    IDAT data is inflated incrementally; each band's scanlines go to a fresh
+    Pillow 'zip' decoder, preceded by the previous band's last row stored
+    unfiltered, so Up/Average/Paeth filters see the right predecessor.
+    """
+
+    def __init__(self, img, fp):
+        self.img = img
+        self.fp = fp
+        self.size = img.size
+        self.rawmode = img.tile[0][3]
+        if isinstance(self.rawmode, tuple):
+            self.rawmode = self.rawmode[0]
+        self.mode = _working_mode(img)
+        self.stride = (img.size[0] * RAW_BITS[self.rawmode] + 7) // 8 + 1
+
+    @classmethod
+    def supports(cls, img):
+        if img.format != 'PNG' or img.info.get('interlace') or len(img.tile) != 1:
+            return False
+        rawmode = img.tile[0][3]
+        if isinstance(rawmode, tuple):
+            rawmode = rawmode[0]
+        return img.tile[0][0] == 'zip' and rawmode in PNG_RAWMODES and img.mode == rawmode
+
+    def _idat_chunks(self):
+        return iter_png_idat(self.fp)
+
+    @staticmethod
+    def _feed(decoder, data):
+        """Feed data to the decoder; True once the band is complete."""
+        if not data:
+            return False
+        status, error = decoder.decode(data)
+        if error < 0:
+            raise ValueError("Could not decode PNG data")
+        return status < 0
+
+    def strips(self, rows):
+        width, height = self.size
+        inflater = zlib.decompressobj()
+        chunks = self._idat_chunks()
+        pending = bytearray()
+        previous = None
+        y = 0
+        while y < height:
+            band_rows = min(rows, height - y)
+            needed = band_rows * self.stride
+            while len(pending) < needed:
+                # max_length keeps a highly compressed chunk from inflating past the band
+                data = inflater.unconsumed_tail or next(chunks, None)
+                if data is None:
+                    raise ValueError("Truncated PNG data")
+                pending += inflater.decompress(data, needed - len(pending))
+            decode_rows = band_rows + (previous is not None)
+            decoder = Image._getdecoder(self.img.mode, 'zip', self.rawmode)
+            band = Image.new(self.img.mode, (width, decode_rows))
+            decoder.setimage(band.im, (0, 0, width, decode_rows))
+            # Re-wrap the scanlines as a stored zlib stream, a piece at a time
+            wrapper = zlib.compressobj(0)
+            done = False
+            if previous is not None:
+                done = self._feed(decoder, wrapper.compress(b'\x00' + previous))
+            view = memoryview(pending)
+            for start in range(0, needed, 1 << 20):
+                if done:
+                    break
+                done = self._feed(decoder, wrapper.compress(view[start:min(needed, start + (1 << 20))]))
+            view.release()
+            if not done:
+                self._feed(decoder, wrapper.flush())
+            decoder.cleanup()
+            del pending[:needed]
+
+            if previous is not None:
+                band = band.crop((0, 1, width, decode_rows))
+            previous = band.crop((0, band_rows - 1, width, band_rows)).tobytes('raw', self.rawmode)
+
+            if self.img.mode == 'P':
+                band.putpalette(self.img.palette)
+                if 'transparency' in self.img.info:
+                    band.info['transparency'] = self.img.info['transparency']
+            if band.mode != self.mode:
+                band = band.convert(self.mode)
+            yield band
+            y += band_rows
+
+
+class RawStripReader:
+    """
+    Read uncompressed row layouts (PPM/PGM, BMP, uncompressed TIFF strips)
+    straight from the file with Image.frombuffer, a band at a time.
+    """
+
+    def __init__(self, img, fp):
+        self.img = img
+        self.fp = fp
+        self.size = img.size
+        self.mode = _working_mode(img)
+        self.tiles = sorted(img.tile, key=lambda tile: tile[1][1])
+
+    @staticmethod
+    def _layout(args):
+        if isinstance(args, str):
+            return args, 0, 1
+        args = tuple(args) + (0, 1)
+        return args[0], args[1], args[2]
+
+    @classmethod
+    def supports(cls, img):
+        if not img.tile or img.mode not in ('L', 'P', 'RGB', 'RGBA', 'CMYK', 'LA'):
+            return False
+        for tile in img.tile:
+            codec, box, _, args = tile[:4]
+            rawmode, _, orientation = cls._layout(args)
+            if codec != 'raw' or rawmode not in RAW_BITS or orientation not in (1, -1):
+                return False
+            if box[0] != 0 or box[2] != img.size[0]:
+                return False
+        return True
+
+    def strips(self, rows):
+        width = self.size[0]
+        for codec, box, offset, args in (tile[:4] for tile in self.tiles):
+            rawmode, stride, orientation = self._layout(args)
+            stride = stride or (width * RAW_BITS[rawmode] + 7) // 8
+            tile_rows = box[3] - box[1]
+            for start in range(0, tile_rows, rows):
+                end = min(tile_rows, start + rows)
+                if orientation == 1:
+                    self.fp.seek(offset + start * stride)
+                else:
+                    # Bottom-up storage: the band's last row comes first in the file
+                    self.fp.seek(offset + (tile_rows - end) * stride)
+                data = self.fp.read((end - start) * stride)
+                band = Image.frombuffer(self.img.mode, (width, end - start), data,
+                                        'raw', rawmode, stride, orientation)
+                if self.img.mode == 'P':
+                    band.putpalette(self.img.palette)
+                    if 'transparency' in self.img.info:
+                        band.info['transparency'] = self.img.info['transparency']
+                if band.mode != self.mode:
+                    band = band.convert(self.mode)
+                yield band
+
+
+class WholeImageReader:
+    """
+    Decode the whole image (optionally shrunk on load) and hand it out in
+    strips. Memory is bounded only by what the decode itself needs.
+    """
+
+    def __init__(self, img, draft_size=None):
+        if draft_size is not None:
+            img.draft(img.mode, draft_size)
+        self.img = img
+        self.size = img.size
+        self.mode = _working_mode(img)
+
+    def strips(self, rows):
+        img = self.img if self.img.mode == self.mode else self.img.convert(self.mode)
+        width, height = img.size
+        for y in range(0, height, rows):
+            yield img.crop((0, y, width, min(height, y + rows)))
+
+
+class PngStreamWriter:
+    """Write a PNG to a file object strip by strip."""
+
+    def __init__(self, sink, size, mode, palette=None, compress_level=6):
+        self.sink = sink
+        self.size = size
+        self.mode = mode
+        self.bands = len(mode) if mode != 'P' else 1
+        self.compressor = zlib.compressobj(compress_level)
+        sink.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', size[0], size[1], 8, PNG_COLOR_TYPES[mode], 0, 0, 0))
+        if palette is not None:
+            self._chunk(b'PLTE', bytes(palette))
+
+    def _chunk(self, chunk_type, data):
+        self.sink.write(struct.pack('>I', len(data)))
+        self.sink.write(chunk_type)
+        self.sink.write(data)
+        self.sink.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff))
+
+    def write(self, rows):
+        """rows: uint8 array of shape (n, width * bands)."""
+        if self.mode == 'P':
+            filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+            filtered[:, 0] = 0
+            filtered[:, 1:] = rows
+        else:
+            # Sub filter: each byte minus the same channel of the left pixel
+            filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+            filtered[:, 0] = 1
+            filtered[:, 1:1 + self.bands] = rows[:, :self.bands]
+            np.subtract(rows[:, self.bands:], rows[:, :-self.bands], out=filtered[:, 1 + self.bands:])
+        data = self.compressor.compress(filtered.tobytes())
+        if data:
+            self._chunk(b'IDAT', data)
+
+    def close(self):
+        self._chunk(b'IDAT', self.compressor.flush())
+        self._chunk(b'IEND', b'')
+
+
+class TiledPipeline:
+    """
+    Resize, quantize and encode very large images with a fixed memory
+    ceiling by streaming bands of rows through each stage.
+
+    Sources are read band by band when their layout allows it (non-interlaced
+    PNG, PPM/PGM, BMP, uncompressed TIFF). JPEGs are shrunk on load when
+    the reduced decode fits the budget. Anything else goes through magick
+    with its pixel cache limited to the budget, or is decoded whole as a
+    last resort. Outputs that fit the budget are encoded in memory; larger
+    ones are streamed as PNG.
+
+    Args:
+        memory_limit: Working-set budget in bytes
+        encoder: Backend used for in-memory encodes (a PillowBackend)
+        magick: Optional MagickBackend used for sources that cannot be streamed
+    """
+
+    def __init__(self, memory_limit=DEFAULT_MEMORY_LIMIT, encoder=None, magick=None):
+        self.memory_limit = memory_limit
+        self.encoder = encoder
+        self.magick = magick
+        self.stats = {}
+
+    def _rows_for(self, width, bands):
+        # A band is held in a few copies at once (inflate, decode, resample)
+        rows = self.memory_limit // 16 // max(1, width * bands)
+        return int(max(8, min(4096, rows)))
+
+    def _open_reader(self, img, fp, out_size):
+        if PngStripReader.supports(img):
+            return PngStripReader(img, fp)
+        if RawStripReader.supports(img):
+            return RawStripReader(img, fp)
+        bands = len(_working_mode(img))
+        if img.format == 'JPEG' and out_size[0] < img.size[0]:
+            # DCT scaling gives at least out_size, at most 8x fewer pixels per side
+            scale = max(1, min(8, img.size[0] // out_size[0]))
+            decoded = (img.size[0] // scale) * (img.size[1] // scale) * bands
+            if decoded <= self.memory_limit // 2:
+                return WholeImageReader(img, draft_size=out_size)
+        if img.size[0] * img.size[1] * bands <= self.memory_limit // 2:
+            return WholeImageReader(img)
+        return None
+
+    def _resized_strips(self, reader, out_size, out_rows, src_rows):
+        """
+        Yield output bands of out_rows rows.
+
+        Lanczos is separable, so like Pillow we resample horizontally first:
+        each source strip is narrowed to the output width as it arrives, and
+        the vertical pass runs over a rolling window of those narrow rows.
+        """
+        width, height = reader.size
+        out_width, out_height = out_size
+        if out_size == reader.size:
+            yield from reader.strips(out_rows)
+            return
+
+        scale_y = height / out_height
+        # Lanczos support is 3 source pixels per output pixel when shrinking
+        margin = int(math.ceil(3 * max(1.0, scale_y))) + 2
+        strips = reader.strips(src_rows)
+        window = None
+        window_top = 0
+        for out_top in range(0, out_height, out_rows):
+            out_bottom = min(out_height, out_top + out_rows)
+            need_top = max(0, int(math.floor(out_top * scale_y)) - margin)
+            need_bottom = min(height, int(math.ceil(out_bottom * scale_y)) + margin)
+
+            while window is None or window_top + window.size[1] < need_bottom:
+                strip = next(strips)
+                if out_width != width:
+                    strip = strip.resize((out_width, strip.size[1]), Image.LANCZOS)
+                if window is None:
+                    window = strip
+                else:
+                    joined = Image.new(window.mode, (out_width, window.size[1] + strip.size[1]))
+                    joined.paste(window, (0, 0))
+                    joined.paste(strip, (0, window.size[1]))
+                    window = joined
+            if need_top > window_top:
+                window = window.crop((0, need_top - window_top, out_width, window.size[1]))
+                window_top = need_top
+
+            if height == out_height:
+                yield window.crop((0, out_top - window_top, out_width, out_bottom - window_top))
+                continue
+            band = window.crop((0, 0, out_width, need_bottom - window_top))
+            box = (0, out_top * scale_y - window_top, out_width, out_bottom * scale_y - window_top)
+            yield band.resize((out_width, out_bottom - out_top), Image.LANCZOS, box=box)
+
+    def process(self, source, sink, output_format='png', quality=85, resize=None,
+                strip_metadata=True, colors=256, optimize=True, quantizer=None, dither=None):
+        """Encode source into the sink file object; returns self.stats."""
+        self.stats = {'encodes': 1, 'quality': quality}
+        with PeakMemory() as memory:
+            self._process(source, sink, output_format.lower(), quality, resize,
+                          strip_metadata, colors, optimize, quantizer, dither)
+        self.stats['peak_memory'] = memory.peak
+        return self.stats
+
+    def _process(self, source, sink, output_format, quality, resize,
+                 strip_metadata, colors, optimize, quantizer, dither):
+        fp = open(source, 'rb') if isinstance(source, (str, os.PathLike)) else BytesIO(source)
+        try:
+            img = open_image(fp)
+            width, height = img.size
+            if resize:
+                scale = min(resize[0] / width, resize[1] / height)
+                out_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            else:
+                out_size = img.size
+
+            reader = self._open_reader(img, fp, out_size)
+            if reader is None:
+                if self.magick is not None and self.magick.is_available():
+                    self.stats['strategy'] = 'magick'
+                    return self._process_with_magick(source, sink, output_format, quality, resize,
+                                                     strip_metadata, colors, optimize, dither)
+                # Nothing can stream this source; decode it whole
+                reader = WholeImageReader(img)
+                self.stats['bounded'] = False
+            self.stats.setdefault('strategy', type(reader).__name__)
+            self.stats.setdefault('bounded', True)
+
+            bands = len(reader.mode)
+            src_rows = self._rows_for(width, bands)
+            # The vertical pass keeps out_rows * (height / out_height) narrowed rows
+            out_rows = self._rows_for(out_size[0] * max(1, math.ceil(height / out_size[1])), bands)
+            out_bytes = out_size[0] * out_size[1] * bands
+
+            fits = out_bytes <= self.memory_limit // 4
+            if not fits and output_format != 'png' and self.magick is not None and self.magick.is_available():
+                # Only PNG can be written incrementally here; magick can page to disk
+                self.stats['strategy'] = 'magick'
+                return self._process_with_magick(source, sink, output_format, quality, resize,
+                                                 strip_metadata, colors, optimize, dither)
+            if fits or output_format != 'png':
+                if not fits:
+                    self.stats['bounded'] = False
+                output = Image.new(reader.mode, out_size)
+                top = 0
+                for strip in self._resized_strips(reader, out_size, out_rows, src_rows):
+                    output.paste(strip, (0, top))
+                    top += strip.size[1]
+                sink.write(self.encoder.process(output, output_format=output_format, quality=quality,
+                                                strip_metadata=strip_metadata, colors=colors,
+                                                optimize=optimize, quantizer=quantizer, dither=dither))
+                return
+
+            self._stream_png(reader, sink, out_size, out_rows, src_rows, quality, colors, quantizer, dither)
+        finally:
+            fp.close()
+
+    def _stream_png(self, reader, sink, out_size, out_rows, src_rows, quality, colors, quantizer=None,
+                    dither=None):
+        compress_level = min(9, quality // 10)
+        if colors and colors <= 256 and reader.mode in ('RGB', 'L'):
+            # Pass 1 samples the output for a global palette, built as the in-memory
+            # path builds it for this quantizer; pass 2 maps each strip onto it
+            rng = np.random.default_rng(0)
+            per_band = max(1, 65536 * out_rows // out_size[1])
+            samples = []
+            for strip in self._resized_strips(reader, out_size, out_rows, src_rows):
+                pixels = np.asarray(strip.convert('RGB')).reshape(-1, 3)
+                samples.append(pixels[rng.integers(0, len(pixels), min(per_band, len(pixels)))])
+            samples = np.concatenate(samples)
+            kmeans = quantizer != 'pillow'
+            palette = build_palette(samples, colors) if kmeans else pillow_palette(samples, colors)
+            lut = build_lookup(palette) if kmeans else None
+            self.stats['passes'] = 2
+
+            reader = self._reopen(reader)
+            writer = PngStreamWriter(sink, out_size, 'P', palette.reshape(-1), compress_level)
+            top = 0
+            for strip in self._resized_strips(reader, out_size, out_rows, src_rows):
+                if kmeans:
+                    mapped = apply_palette(strip.convert('RGB'), palette, dither, lut, top)
+                else:
+                    mapped = pillow_map(strip.convert('RGB'), palette)
+                writer.write(np.asarray(mapped))
+                top += strip.size[1]
+            writer.close()
+            return
+
+        writer = PngStreamWriter(sink, out_size, reader.mode, compress_level=compress_level)
+        for strip in self._resized_strips(reader, out_size, out_rows, src_rows):
+            writer.write(np.asarray(strip).reshape(strip.size[1], -1))
+        writer.close()
+
+    def _reopen(self, reader):
+        """Fresh reader over the same file for a second pass."""
+        if isinstance(reader, WholeImageReader):
+            return reader
+        reader.fp.seek(0)
+        return type(reader)(open_image(reader.fp), reader.fp)
+
+    def _process_with_magick(self, source, sink, output_format, quality, resize,
+                             strip_metadata, colors, optimize, dither):
+        """Let magick stream through its disk-backed pixel cache within the budget."""
+        limit = f'{max(1, self.memory_limit // (1024 * 1024))}MiB'
+        operations = self.magick._build_operations(output_format, quality, resize, strip_metadata,
+                                                   colors, optimize, dither)
+        read_args = self.magick._define_args(self.magick._build_read_defines(resize))
+        input_spec = os.fspath(source) if isinstance(source, (str, os.PathLike)) else '-'
+        command = (['magick', '-limit', 'memory', limit, '-limit', 'map', limit]
+                   + read_args + [input_spec] + operations + [f'{output_format}:-'])
+        process = subprocess.Popen(command, stdin=subprocess.PIPE if input_spec == '-' else subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if input_spec == '-':
+            writer = threading.Thread(target=self._feed_stdin, args=(process.stdin, source), daemon=True)
+            writer.start()
+        # stderr is drained alongside stdout, so neither pipe can fill up and stall magick
+        stderr = []
+        reader = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+        reader.start()
+        shutil.copyfileobj(process.stdout, sink)
+        reader.join()
+        if process.wait() != 0:
+            raise RuntimeError(f"ImageMagick processing failed: {stderr[0].decode(errors='replace')}")
+
+    @staticmethod
+    def _feed_stdin(stdin, data):
+        try:
+            stdin.write(data)
+        finally:
+            stdin.close()
@@ -1,9 +1,13 @@
 import sys
+import multiprocessing
 from PySide6.QtWidgets import QApplication
 from PySide6.QtCore import Qt
 from components.main_window import MainWindow
 
 if __name__ == "__main__":
+    # Batch compression uses process pools; needed for frozen builds
+    multiprocessing.freeze_support()
+    
     app = QApplication(sys.argv)
     app.setStyle("Fusion")
     window = MainWindow()
@@ -4,17 +4,23 @@ from PySide6.QtCore import Qt, Signal, QThread, Signal
 import os
 from components.file_drop import FileDropArea
 from components.compression_slider import CompressionSlider
+from components.toggle import AnimatedToggle
 from components.message import show_error_message, show_success_message
 from components.loader import trigger_loader
 from core.ImageCompressor.ImageCompressor import ImageCompressor
+from core.ResultCache.ResultCache import get_default_cache
 from theme.theme import theme_manager, get_current_theme, get_app_primary_color, get_app_primary_hover_color
 
+# SSIM the auto quality mode must keep; 0.98 is visually indistinguishable for most photos
+AUTO_QUALITY_SSIM = 0.98
+
 class ImageCompressionWorker(QThread):
     """Worker thread for image compression to prevent UI freezing"""
     finished = Signal(str)  # Emits output path on success
     error = Signal(str)     # Emits error message on failure
     
-    def __init__(self, image_path, quality, resize, output_format, colors, output_path):
+    def __init__(self, image_path, quality, resize, output_format, colors, output_path, target_bytes=None,
+                 target_ssim=None, allow_scale=False):
         super().__init__()
         self.image_path = image_path
         self.quality = quality
@@ -22,21 +28,25 @@ class ImageCompressionWorker(QThread):
         self.output_format = output_format
         self.colors = colors
         self.output_path = output_path
+        self.target_bytes = target_bytes
+        self.target_ssim = target_ssim
+        self.allow_scale = allow_scale
         
     def run(self):
         try:
             # Call the backend processor
-            processor = ImageCompressor(image_path=self.image_path)
-            processed_data = processor.process_image(
+            processor = ImageCompressor(image_path=self.image_path, cache=get_default_cache())
+            # Very large images stream straight to the output file
+            processor.save_to_file(
+                self.output_path,
                 output_format=self.output_format, 
                 quality=self.quality,
                 resize=self.resize,
-                colors=self.colors
+                colors=self.colors,
+                target_bytes=self.target_bytes,
+                allow_scale=self.allow_scale,
+                target_ssim=self.target_ssim
             )
-            
-            # Save the result
-            with open(self.output_path, 'wb') as f:
-                f.write(processed_data)
                 
             self.finished.emit(self.output_path)
         except Exception as e:
@@ -112,6 +122,21 @@ class ImageView(QWidget):
         slider_labels_layout.addWidget(self.max_label)
         
         comp_level_layout.addWidget(slider_labels)
+        
+        # Auto quality: the slider becomes the upper bound of a perceptual search
+        auto_quality_row = QFrame()
+        auto_quality_layout = QHBoxLayout(auto_quality_row)
+        auto_quality_layout.setContentsMargins(0, 0, 0, 0)
+        auto_quality_layout.setSpacing(10)
+        
+        self.auto_quality_toggle = AnimatedToggle()
+        auto_quality_layout.addWidget(self.auto_quality_toggle)
+        
+        self.auto_quality_label = QLabel("Auto quality (smallest file that still looks the same)")
+        auto_quality_layout.addWidget(self.auto_quality_label)
+        auto_quality_layout.addStretch()
+        
+        comp_level_layout.addWidget(auto_quality_row)
         options_layout.addWidget(comp_level_frame)
         
         # Resize options
@@ -147,6 +172,36 @@ class ImageView(QWidget):
         resize_layout.addWidget(resize_inputs)
         options_layout.addWidget(resize_frame)
         
+        # Target size option
+        target_frame = QFrame()
+        target_layout = QVBoxLayout(target_frame)
+        target_layout.setContentsMargins(0, 0, 0, 0)
+        target_layout.setSpacing(5)
+        
+        self.target_label = QLabel("Target File Size in KB (optional):")
+        target_layout.addWidget(self.target_label)
+        
+        self.target_input = QLineEdit()
+        self.target_input.setPlaceholderText("e.g. 200")
+        self.target_input.setFixedWidth(120)
+        target_layout.addWidget(self.target_input)
+        
+        # Downscaling to meet the target is opt-in; by default only quality is lowered
+        allow_scale_row = QFrame()
+        allow_scale_layout = QHBoxLayout(allow_scale_row)
+        allow_scale_layout.setContentsMargins(0, 0, 0, 0)
+        allow_scale_layout.setSpacing(10)
+        
+        self.allow_scale_toggle = AnimatedToggle()
+        allow_scale_layout.addWidget(self.allow_scale_toggle)
+        
+        self.allow_scale_label = QLabel("Shrink dimensions if needed to reach the target size")
+        allow_scale_layout.addWidget(self.allow_scale_label)
+        allow_scale_layout.addStretch()
+        
+        target_layout.addWidget(allow_scale_row)
+        options_layout.addWidget(target_frame)
+        
         # Output format
         format_frame = QFrame()
         format_layout = QVBoxLayout(format_frame)
@@ -259,6 +314,14 @@ class ImageView(QWidget):
             }}
         """)
         
+        # Auto quality label styling
+        self.auto_quality_label.setStyleSheet(f"""
+            QLabel {{
+                font-size: 13px; 
+                color: {theme.TEXT_SECONDARY};
+            }}
+        """)
+        
         # Resize label styling
         self.resize_label.setStyleSheet(f"""
             QLabel {{
@@ -268,6 +331,23 @@ class ImageView(QWidget):
             }}
         """)
         
+        # Target size label styling
+        self.target_label.setStyleSheet(f"""
+            QLabel {{
+                font-size: 15px; 
+                color: {theme.TEXT_PRIMARY}; 
+                font-weight: bold;
+            }}
+        """)
+        
+        # Allow scale label styling
+        self.allow_scale_label.setStyleSheet(f"""
+            QLabel {{
+                font-size: 13px; 
+                color: {theme.TEXT_SECONDARY};
+            }}
+        """)
+        
         # Times label styling
         self.times_label.setStyleSheet(f"""
             QLabel {{
@@ -289,6 +369,7 @@ class ImageView(QWidget):
         """
         self.width_input.setStyleSheet(input_style)
         self.height_input.setStyleSheet(input_style)
+        self.target_input.setStyleSheet(input_style)
         
         # Format label styling
         self.format_label.setStyleSheet(f"""
@@ -381,6 +462,23 @@ class ImageView(QWidget):
             except ValueError:
                 resize = None  # Don't resize if invalid dimensions
             
+            # Optional size budget; quality becomes the upper bound
+            target_text = self.target_input.text().strip()
+            if target_text:
+                try:
+                    target_kb = int(target_text)
+                except ValueError:
+                    raise ValueError("Target file size must be a whole number of KB") from None
+                if target_kb <= 0:
+                    raise ValueError("Target file size must be greater than 0 KB")
+                target_bytes = target_kb * 1024
+            else:
+                target_bytes = None
+            allow_scale = bool(target_bytes) and self.allow_scale_toggle.isChecked()
+            
+            # Perceptual target; a size budget takes precedence
+            target_ssim = AUTO_QUALITY_SSIM if self.auto_quality_toggle.isChecked() and not target_bytes else None
+            
             # Get output format
             output_format = 'jpg' if self.jpg_btn.isChecked() else 'png'
             
@@ -392,7 +490,8 @@ class ImageView(QWidget):
             
             # Create and start worker thread
             self.compression_worker = ImageCompressionWorker(
-                self.image_path, quality, resize, output_format, colors, output_path
+                self.image_path, quality, resize, output_format, colors, output_path, target_bytes, target_ssim,
+                allow_scale
             )
             self.compression_worker.finished.connect(self.on_compression_success)
             self.compression_worker.error.connect(self.on_compression_error)
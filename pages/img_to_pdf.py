@@ -1,163 +1,347 @@
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QFrame, QLabel, QComboBox, QPushButton, QHBoxLayout
-from PySide6.QtCore import Qt
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QFrame, QLabel, QComboBox, QPushButton, QHBoxLayout, QButtonGroup
+from PySide6.QtCore import Qt, Signal, QThread
+import os
+
 from components.file_drop import FileDropArea
+from components.message import show_error_message, show_success_message
+from components.loader import trigger_loader
+from core.ImageToPdf.ImageToPdf import ImageToPdfConverter
+from theme.theme import theme_manager, get_current_theme, get_app_primary_color, get_app_primary_hover_color
+
+class ImgToPDFWorker(QThread):
+    """Worker thread for image to PDF conversion to prevent UI freezing"""
+    finished = Signal(str)  # Emits output path on success
+    error = Signal(str)     # Emits error message on failure
+
+    def __init__(self, image_paths, page_size, orientation, output_path):
+        super().__init__()
+        self.image_paths = image_paths
+        self.page_size = page_size
+        self.orientation = orientation
+        self.output_path = output_path
+
+    def run(self):
+        try:
+            # Pages are written to the output file one image at a time
+            converter = ImageToPdfConverter()
+            converter.convert(
+                self.image_paths,
+                output_path=self.output_path,
+                page_size=self.page_size,
+                orientation=self.orientation
+            )
+
+            self.finished.emit(self.output_path)
+        except Exception as e:
+            self.error.emit(str(e))
 
 class ImgToPDFView(QWidget):
+    conversion_complete = Signal(str)
+
     def __init__(self):
         super().__init__()
+        self.image_paths = []
+        self.conversion_worker = None
+
+        # Connect to theme manager
+        theme_manager.theme_changed.connect(self.on_theme_changed)
+
+        self.setup_ui()
+        self.setup_connections()
+        self.apply_theme()
+
+    def setup_ui(self):
         layout = QVBoxLayout(self)
         layout.setContentsMargins(40, 40, 40, 40)
         layout.setSpacing(25)
-        
+
         # Title frame
         title_frame = QFrame()
         title_layout = QVBoxLayout(title_frame)
         title_layout.setContentsMargins(0, 0, 0, 0)
         title_layout.setSpacing(5)
-        
-        title = QLabel("Image to PDF Conversion")
-        title.setStyleSheet("""
-            QLabel {
-                font-size: 24px;
-                font-weight: bold;
-                color: #333333;
-            }
-        """)
-        title_layout.addWidget(title)
-        
-        desc = QLabel("Convert one or multiple images to a PDF document")
-        desc.setStyleSheet("""
-            QLabel {
-                font-size: 16px;
-                color: #666666;
-            }
-        """)
-        title_layout.addWidget(desc)
-        
+
+        self.title = QLabel("Image to PDF Conversion")
+        title_layout.addWidget(self.title)
+
+        self.desc = QLabel("Convert one or multiple images to a PDF document")
+        title_layout.addWidget(self.desc)
+
         layout.addWidget(title_frame)
-        
+
         # Drop area
-        drop_area = FileDropArea("Drop Images Here", "or click to browse image files (JPG, PNG, WEBP)")
-        layout.addWidget(drop_area)
-        
+        self.drop_area = FileDropArea("Drop Images Here", "or click to browse image files (JPG, PNG)", 'image',
+                                      multiple=True)
+        layout.addWidget(self.drop_area)
+
         # Options frame
         options_frame = QFrame()
         options_layout = QVBoxLayout(options_frame)
         options_layout.setContentsMargins(20, 20, 20, 20)
         options_layout.setSpacing(15)
-        
+
         # Page size
         page_size_frame = QFrame()
         page_size_layout = QVBoxLayout(page_size_frame)
         page_size_layout.setContentsMargins(0, 0, 0, 0)
         page_size_layout.setSpacing(5)
-        
-        page_size_label = QLabel("PDF Page Size:")
-        page_size_label.setStyleSheet("font-size: 15px; color: #333333; font-weight: bold;")
-        page_size_layout.addWidget(page_size_label)
-        
-        page_size_combo = QComboBox()
-        page_size_combo.addItems(["Auto", "Letter", "A4", "A3", "Legal"])
-        page_size_combo.setStyleSheet("""
-            QComboBox {
-                padding: 8px;
-                border: 1px solid #e0e0e0;
-                border-radius: 5px;
-                font-size: 14px;
-            }
-        """)
-        page_size_layout.addWidget(page_size_combo)
+
+        self.page_size_label = QLabel("PDF Page Size:")
+        page_size_layout.addWidget(self.page_size_label)
+
+        self.page_size_combo = QComboBox()
+        self.page_size_combo.addItems(["Auto", "Letter", "A4", "A3", "Legal"])
+        page_size_layout.addWidget(self.page_size_combo)
         options_layout.addWidget(page_size_frame)
-        
+
         # Orientation
         orientation_frame = QFrame()
         orientation_layout = QVBoxLayout(orientation_frame)
         orientation_layout.setContentsMargins(0, 0, 0, 0)
         orientation_layout.setSpacing(5)
-        
-        orientation_label = QLabel("Orientation:")
-        orientation_label.setStyleSheet("font-size: 15px; color: #333333; font-weight: bold;")
-        orientation_layout.addWidget(orientation_label)
-        
+
+        self.orientation_label = QLabel("Orientation:")
+        orientation_layout.addWidget(self.orientation_label)
+
         orientation_group = QFrame()
         orientation_group_layout = QHBoxLayout(orientation_group)
         orientation_group_layout.setContentsMargins(0, 0, 0, 0)
         orientation_group_layout.setSpacing(15)
-        
-        portrait_btn = QPushButton("Portrait")
-        portrait_btn.setCheckable(True)
-        portrait_btn.setChecked(True)
-        portrait_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #e0e0e0;
-                color: #333333;
-                border: none;
-                padding: 8px 15px;
-                border-radius: 5px;
-                font-size: 14px;
-            }
-            QPushButton:checked {
-                background-color: #009688;
-                color: white;
-            }
-        """)
-        
-        landscape_btn = QPushButton("Landscape")
-        landscape_btn.setCheckable(True)
-        landscape_btn.setStyleSheet(portrait_btn.styleSheet())
-        
-        orientation_group_layout.addWidget(portrait_btn)
-        orientation_group_layout.addWidget(landscape_btn)
+
+        self.orientation_group = QButtonGroup(self)
+
+        self.portrait_btn = QPushButton("Portrait")
+        self.portrait_btn.setCheckable(True)
+        self.portrait_btn.setChecked(True)
+
+        self.landscape_btn = QPushButton("Landscape")
+        self.landscape_btn.setCheckable(True)
+
+        self.orientation_group.addButton(self.portrait_btn, 0)
+        self.orientation_group.addButton(self.landscape_btn, 1)
+
+        orientation_group_layout.addWidget(self.portrait_btn)
+        orientation_group_layout.addWidget(self.landscape_btn)
         orientation_group_layout.addStretch()
-        
+
         orientation_layout.addWidget(orientation_group)
         options_layout.addWidget(orientation_frame)
-        
+
         layout.addWidget(options_frame)
         layout.addStretch()
-        
+
         # Action buttons
         btn_frame = QFrame()
         btn_layout = QHBoxLayout(btn_frame)
         btn_layout.setContentsMargins(0, 0, 0, 0)
         btn_layout.setSpacing(15)
-        
-        convert_btn = QPushButton("Convert to PDF")
-        convert_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #009688;
+
+        self.convert_btn = QPushButton("Convert to PDF")
+        self.convert_btn.setCursor(Qt.PointingHandCursor)
+        self.convert_btn.setEnabled(False)
+
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.setCursor(Qt.PointingHandCursor)
+
+        btn_layout.addStretch()
+        btn_layout.addWidget(self.cancel_btn)
+        btn_layout.addWidget(self.convert_btn)
+
+        layout.addWidget(btn_frame)
+
+    def setup_connections(self):
+        """Set up signal connections"""
+        self.drop_area.files_selected.connect(self.handle_files_selected)
+        self.convert_btn.clicked.connect(self.convert_images)
+        self.cancel_btn.clicked.connect(self.close)
+
+    def on_theme_changed(self, is_dark_mode):
+        """Handle theme changes from the theme manager"""
+        self.apply_theme()
+
+    def apply_theme(self):
+        """Apply the current theme to all UI elements"""
+        theme = get_current_theme()
+        primary_color = get_app_primary_color()
+        primary_hover = get_app_primary_hover_color()
+
+        # Title styling
+        self.title.setStyleSheet(f"""
+            QLabel {{
+                font-size: 24px;
+                font-weight: bold;
+                color: {theme.TEXT_PRIMARY};
+            }}
+        """)
+
+        # Description styling
+        self.desc.setStyleSheet(f"""
+            QLabel {{
+                font-size: 16px;
+                color: {theme.TEXT_SECONDARY};
+            }}
+        """)
+
+        # Option label styling
+        option_label_style = f"""
+            QLabel {{
+                font-size: 15px;
+                color: {theme.TEXT_PRIMARY};
+                font-weight: bold;
+            }}
+        """
+        self.page_size_label.setStyleSheet(option_label_style)
+        self.orientation_label.setStyleSheet(option_label_style)
+
+        # Page size styling
+        self.page_size_combo.setStyleSheet(f"""
+            QComboBox {{
+                padding: 8px;
+                border: 1px solid {theme.BORDER_PRIMARY};
+                border-radius: 5px;
+                font-size: 14px;
+                background-color: {theme.SURFACE_BG};
+                color: {theme.TEXT_PRIMARY};
+            }}
+        """)
+
+        # Orientation button styling
+        orientation_button_style = f"""
+            QPushButton {{
+                background-color: {theme.SURFACE_BG};
+                color: {theme.TEXT_PRIMARY};
+                border: none;
+                padding: 8px 15px;
+                border-radius: 5px;
+                font-size: 14px;
+            }}
+            QPushButton:checked {{
+                background-color: {primary_color};
+                color: white;
+            }}
+        """
+        self.portrait_btn.setStyleSheet(orientation_button_style)
+        self.landscape_btn.setStyleSheet(orientation_button_style)
+
+        # Convert button styling
+        self.convert_btn.setStyleSheet(f"""
+            QPushButton {{
+                background-color: {primary_color};
                 color: white;
                 border: none;
                 padding: 12px 24px;
                 border-radius: 5px;
                 font-size: 15px;
                 min-width: 180px;
-            }
-            QPushButton:hover {
-                background-color: #00796b;
-            }
+            }}
+            QPushButton:hover {{
+                background-color: {primary_hover};
+            }}
+            QPushButton:disabled {{
+                background-color: #b2dfdb;
+            }}
         """)
-        convert_btn.setCursor(Qt.PointingHandCursor)
-        
-        cancel_btn = QPushButton("Cancel")
-        cancel_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #f5f5f5;
-                color: #333333;
-                border: 1px solid #e0e0e0;
+
+        # Cancel button styling
+        self.cancel_btn.setStyleSheet(f"""
+            QPushButton {{
+                background-color: {theme.SURFACE_BG};
+                color: {theme.TEXT_PRIMARY};
+                border: 1px solid {theme.BORDER_PRIMARY};
                 padding: 12px 24px;
                 border-radius: 5px;
                 font-size: 15px;
                 min-width: 180px;
-            }
-            QPushButton:hover {
-                background-color: #e0e0e0;
-            }
+            }}
+            QPushButton:hover {{
+                background-color: {theme.BORDER_PRIMARY};
+            }}
         """)
-        cancel_btn.setCursor(Qt.PointingHandCursor)
-        
-        btn_layout.addStretch()
-        btn_layout.addWidget(cancel_btn)
-        btn_layout.addWidget(convert_btn)
-        
-        layout.addWidget(btn_frame)
\ No newline at end of file
+
+    def handle_files_selected(self, file_paths):
+        """Handle when files are dropped or selected"""
+        self.image_paths = list(file_paths)
+        self.convert_btn.setEnabled(bool(self.image_paths))
+
+    def convert_images(self):
+        """Convert the selected images with the chosen page settings"""
+        if not self.image_paths:
+            return
+
+        # Show loader
+        trigger_loader('show', self, "Creating PDF...")
+
+        # Disable UI controls during conversion
+        self.convert_btn.setEnabled(False)
+        self.cancel_btn.setEnabled(False)
+
+        try:
+            # Get all the parameters from the UI
+            page_size = self.page_size_combo.currentText().lower()
+            orientation = 'landscape' if self.landscape_btn.isChecked() else 'portrait'
+
+            # Get output path
+            output_path = self.get_output_path()
+
+            # Create and start worker thread
+            self.conversion_worker = ImgToPDFWorker(
+                self.image_paths, page_size, orientation, output_path
+            )
+            self.conversion_worker.finished.connect(self.on_conversion_success)
+            self.conversion_worker.error.connect(self.on_conversion_error)
+            self.conversion_worker.start()
+
+        except Exception as e:
+            self.on_conversion_error(str(e))
+
+    def on_conversion_success(self, output_path):
+        """Handle successful conversion"""
+        # Hide loader
+        trigger_loader('hide')
+
+        # Re-enable UI controls
+        self.convert_btn.setEnabled(True)
+        self.cancel_btn.setEnabled(True)
+
+        # Emit completion signal and show success message
+        self.conversion_complete.emit(output_path)
+        show_success_message("PDF created successfully!", f"PDF saved to:\n{output_path}")
+
+        # Clean up worker
+        if self.conversion_worker:
+            self.conversion_worker.deleteLater()
+            self.conversion_worker = None
+
+    def on_conversion_error(self, error_message):
+        """Handle conversion error"""
+        # Hide loader
+        trigger_loader('hide')
+
+        # Re-enable UI controls
+        self.convert_btn.setEnabled(True)
+        self.cancel_btn.setEnabled(True)
+
+        # Show error message
+        show_error_message(error_message, "Image to PDF conversion failed")
+
+        # Clean up worker
+        if self.conversion_worker:
+            self.conversion_worker.deleteLater()
+            self.conversion_worker = None
+
+    def get_output_path(self):
+        """Generate output path next to the first selected image"""
+        base, _ = os.path.splitext(self.image_paths[0])
+        return f"{base}_converted.pdf"
+
+    def closeEvent(self, event):
+        """Handle window close event"""
+        # Hide loader if visible
+        trigger_loader('hide')
+
+        # Stop worker thread if running
+        if self.conversion_worker and self.conversion_worker.isRunning():
+            self.conversion_worker.terminate()
+            self.conversion_worker.wait()
+
+        super().closeEvent(event)
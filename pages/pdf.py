@@ -3,10 +3,12 @@ from PySide6.QtCore import Qt, Signal, QThread, Signal
 import os
 
 from components.compression_slider import CompressionSlider
+from components.toggle import AnimatedToggle
 from components.file_drop import FileDropArea
 from components.message import show_error_message, show_success_message
 from components.loader import trigger_loader  
 from core.PdfCompressor.PdfCompressor import PdfCompressor
+from core.ResultCache.ResultCache import get_default_cache
 from theme.theme import theme_manager, get_current_theme, get_app_primary_color, get_app_primary_hover_color
 
 class PDFCompressionWorker(QThread):
@@ -14,25 +16,26 @@ class PDFCompressionWorker(QThread):
     finished = Signal(str)  # Emits output path on success
     error = Signal(str)     # Emits error message on failure
     
-    def __init__(self, pdf_path, quality, output_path):
+    def __init__(self, pdf_path, quality, output_path, mode='raster'):
         super().__init__()
         self.pdf_path = pdf_path
         self.quality = quality
         self.output_path = output_path
+        self.mode = mode
         
     def run(self):
         try:
             # Call the backend processor
-            processor = PdfCompressor()
-            compressed_pdf = processor.process_pdf(
+            processor = PdfCompressor(cache=get_default_cache())
+            # Pages are streamed straight into the output file
+            processor.process_pdf(
                 pdf_path=self.pdf_path,
                 output_format='pdf', 
-                quality=self.quality
+                quality=self.quality,
+                mode=self.mode,
+                output_path=self.output_path
             )
             
-            # Save the result
-            processor.save_output(compressed_pdf, self.output_path)
-            
             self.finished.emit(self.output_path)
         except Exception as e:
             self.error.emit(str(e))
@@ -109,6 +112,23 @@ class PDFView(QWidget):
         comp_level_layout.addWidget(slider_labels)
         options_layout.addWidget(comp_level_frame)
         
+        # Smart mode: recompress embedded images only, keep text and vectors.
+        # Off by default so the page keeps rasterizing, as it always has
+        smart_row = QFrame()
+        smart_layout = QHBoxLayout(smart_row)
+        smart_layout.setContentsMargins(0, 0, 0, 0)
+        smart_layout.setSpacing(10)
+        
+        self.smart_toggle = AnimatedToggle()
+        self.smart_toggle.setChecked(False)
+        smart_layout.addWidget(self.smart_toggle)
+        
+        self.smart_label = QLabel("Keep text selectable (only compress images)")
+        smart_layout.addWidget(self.smart_label)
+        smart_layout.addStretch()
+        
+        options_layout.addWidget(smart_row)
+        
         layout.addWidget(options_frame)
         layout.addStretch()
         
@@ -188,6 +208,13 @@ class PDFView(QWidget):
             }}
         """)
         
+        self.smart_label.setStyleSheet(f"""
+            QLabel {{
+                font-size: 13px; 
+                color: {theme.TEXT_SECONDARY};
+            }}
+        """)
+        
         # Compress button styling
         self.compress_btn.setStyleSheet(f"""
             QPushButton {{
@@ -243,13 +270,14 @@ class PDFView(QWidget):
         try:
             # Get all the parameters from the UI
             quality = self.comp_slider.value()
+            mode = 'smart' if self.smart_toggle.isChecked() else 'raster'
             
             # Get output path
             output_path = self.get_output_path()
             
             # Create and start worker thread
             self.compression_worker = PDFCompressionWorker(
-                self.pdf_path, quality, output_path
+                self.pdf_path, quality, output_path, mode
             )
             self.compression_worker.finished.connect(self.on_compression_success)
             self.compression_worker.error.connect(self.on_compression_error)
@@ -1,12 +1,14 @@
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QFrame, QLabel, QPushButton, QHBoxLayout, QButtonGroup
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QFrame, QLabel, QPushButton, QHBoxLayout, QButtonGroup, QLineEdit
 from PySide6.QtCore import Qt, Signal, QThread
 import os
 
 from components.compression_slider import CompressionSlider
+from components.toggle import AnimatedToggle
 from components.file_drop import FileDropArea
 from components.message import show_error_message, show_success_message
 from components.loader import trigger_loader
 from core.PdfCompressor.PdfCompressor import PdfCompressor
+from core.ResultCache.ResultCache import get_default_cache
 from theme.theme import theme_manager, get_current_theme, get_app_primary_color, get_app_primary_hover_color
 
 class PDFToImgWorker(QThread):
@@ -14,30 +16,29 @@ class PDFToImgWorker(QThread):
     finished = Signal(str)  # Emits output path on success
     error = Signal(str)     # Emits error message on failure
     
-    def __init__(self, pdf_path, output_format, quality, output_path):
+    def __init__(self, pdf_path, output_format, quality, output_path, mode='raster', pages=None):
         super().__init__()
         self.pdf_path = pdf_path
         self.output_format = output_format
         self.quality = quality
         self.output_path = output_path
+        self.mode = mode
+        self.pages = pages
         
     def run(self):
         try:
-            # Read the PDF file
-            with open(self.pdf_path, 'rb') as f:
-                pdf_data = f.read()
-            
-            # Call the backend processor
-            processor = PdfCompressor()
-            images_zip = processor.process_pdf(
-                pdf_data=pdf_data,
+            # Call the backend processor; the PDF is opened by path, not read into memory
+            processor = PdfCompressor(cache=get_default_cache())
+            # Images are written to the archive as each one finishes
+            processor.process_pdf(
+                pdf_path=self.pdf_path,
                 output_format=self.output_format,
-                quality=self.quality
+                quality=self.quality,
+                mode=self.mode,
+                output_path=self.output_path,
+                pages=self.pages
             )
             
-            # Save the result
-            processor.save_output(images_zip, self.output_path)
-            
             self.finished.emit(self.output_path)
         except Exception as e:
             self.error.emit(str(e))
@@ -147,6 +148,37 @@ class PDFToImgView(QWidget):
         quality_layout.addWidget(slider_labels)
         options_layout.addWidget(quality_frame)
         
+        # Extract mode: save the embedded images instead of rendering pages
+        extract_row = QFrame()
+        extract_layout = QHBoxLayout(extract_row)
+        extract_layout.setContentsMargins(0, 0, 0, 0)
+        extract_layout.setSpacing(10)
+        
+        self.extract_toggle = AnimatedToggle()
+        extract_layout.addWidget(self.extract_toggle)
+        
+        self.extract_label = QLabel("Extract embedded images instead of converting pages")
+        extract_layout.addWidget(self.extract_label)
+        extract_layout.addStretch()
+        
+        options_layout.addWidget(extract_row)
+        
+        # Page selection; only these pages are rendered
+        pages_frame = QFrame()
+        pages_layout = QVBoxLayout(pages_frame)
+        pages_layout.setContentsMargins(0, 0, 0, 0)
+        pages_layout.setSpacing(5)
+        
+        self.pages_label = QLabel("Pages (optional):")
+        pages_layout.addWidget(self.pages_label)
+        
+        self.pages_input = QLineEdit()
+        self.pages_input.setPlaceholderText("All pages, or e.g. 1-5, 8, 10-")
+        self.pages_input.setFixedWidth(240)
+        pages_layout.addWidget(self.pages_input)
+        
+        options_layout.addWidget(pages_frame)
+        
         layout.addWidget(options_frame)
         layout.addStretch()
         
@@ -235,6 +267,32 @@ class PDFToImgView(QWidget):
             }}
         """)
         
+        self.extract_label.setStyleSheet(f"""
+            QLabel {{
+                font-size: 13px; 
+                color: {theme.TEXT_SECONDARY};
+            }}
+        """)
+        
+        # Pages label and input styling
+        self.pages_label.setStyleSheet(f"""
+            QLabel {{
+                font-size: 15px; 
+                color: {theme.TEXT_PRIMARY}; 
+                font-weight: bold;
+            }}
+        """)
+        self.pages_input.setStyleSheet(f"""
+            QLineEdit {{
+                padding: 8px;
+                border: 1px solid {theme.BORDER_PRIMARY};
+                border-radius: 4px;
+                font-size: 14px;
+                color: {theme.TEXT_PRIMARY};
+                background-color: {theme.SURFACE_BG};
+            }}
+        """)
+        
         # Format button styling
         format_button_style = f"""
             QPushButton {{
@@ -309,13 +367,15 @@ class PDFToImgView(QWidget):
             # Get all the parameters from the UI
             quality = self.quality_slider.value()
             output_format = 'jpg' if self.jpg_btn.isChecked() else 'png'
+            mode = 'extract' if self.extract_toggle.isChecked() else 'raster'
+            pages = self.pages_input.text().strip() or None
             
             # Get output path
             output_path = self.get_output_path(output_format)
             
             # Create and start worker thread
             self.conversion_worker = PDFToImgWorker(
-                self.pdf_path, output_format, quality, output_path
+                self.pdf_path, output_format, quality, output_path, mode, pages
             )
             self.conversion_worker.finished.connect(self.on_conversion_success)
             self.conversion_worker.error.connect(self.on_conversion_error)
@@ -1,6 +1,13 @@
-from setuptools import setup
+from glob import glob
+from pathlib import Path
+
+from setuptools import Extension, setup
 from Cython.Build import cythonize
 
+# core/X/X.pyx builds as core.X.X, the dotted path the modules import each other by
+extensions = [Extension('.'.join(Path(path).with_suffix('').parts), [path])
+              for path in sorted(glob("core/*/*.pyx"))]
+
 setup(
-    ext_modules=cythonize("core/PdfCompressor/PdfCompressor.pyx", compiler_directives={"language_level": "3"})
-)
\ No newline at end of file
+    ext_modules=cythonize(extensions, compiler_directives={"language_level": "3"})
+)
@@ -0,0 +1,44 @@
+"""
+target_bytes on ZIP image output from a PDF with blank pages.
+
+Build the core extensions first (python setup.py build_ext --inplace).
+Usage: python -m pytest tests
+"""
+import os
+import sys
+from io import BytesIO
+
+import fitz
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.PdfCompressor.PdfCompressor import PdfCompressor
+
+
+def make_pdf(pages=10, blank_every=3):
+    rng = np.random.default_rng(0)
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        if page_num % blank_every == blank_every - 1:
+            continue
+        page.insert_textbox(fitz.Rect(72, 72, 540, 400), "Lorem ipsum dolor sit amet. " * 50, fontsize=10)
+        photo = BytesIO()
+        base = rng.integers(0, 255, (24, 32, 3), dtype=np.uint8)
+        Image.fromarray(base).resize((800, 600), Image.BICUBIC).save(photo, format='JPEG', quality=90)
+        page.insert_image(fitz.Rect(72, 420, 540, 780), stream=photo.getvalue())
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_zip_target_counts_blank_pages():
+    compressor = PdfCompressor(backend='pillow')
+    target = 600000
+    output = compressor.process_pdf(pdf_data=make_pdf(), output_format='jpg', dpi=150, workers=1,
+                                    target_bytes=target)
+    assert compressor.stats['blank_pages'] == 3
+    assert compressor.stats['target_met']
+    assert len(output) <= target